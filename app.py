@@ -1,14 +1,22 @@
-import os
-from flask import Flask, render_template
-from config import DISCORD_TOKEN
-from personas import PERSONAS, REWARD_PERSONAS
+import logging
+import threading
+from functools import lru_cache
+from flask import Flask, Response, render_template
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev_key_123")
+app.secret_key = config.getenv("FLASK_SECRET_KEY", "dev_key_123")
+
+@lru_cache(maxsize=1)
+def landing_content() -> dict:
+    """Template data for the landing page, built on first request; it never changes while running."""
+    # Imported here so importing app, e.g. to serve /metrics from the bot, stays cheap
+    from personas import PERSONAS
+    from rewards import REWARD_TIERS
 
-@app.route('/')
-def home():
-    """Landing page route."""
     features = [
         {
             "icon": "🎭",
@@ -46,51 +54,33 @@ def home():
     # Show all reward tiers
     rewards = [
         {
-            "unlock": "5 uses",
-            "reward": "Meme Lord Mode",
-            "description": "Master of internet culture and memes"
-        },
-        {
-            "unlock": "10 uses",
-            "reward": "Dank Memer Mode",
-            "description": "The original chaotic personality"
-        },
-        {
-            "unlock": "15 uses",
-            "reward": "Poetry Master",
-            "description": "Responses flow like beautiful verses"
-        },
-        {
-            "unlock": "25 uses",
-            "reward": "Chaos Agent Mode",
-            "description": "Pure randomness and surreal humor"
-        },
-        {
-            "unlock": "35 uses",
-            "reward": "Quantum Physicist",
-            "description": "Scientific and quantum-inspired responses"
-        },
-        {
-            "unlock": "50 uses",
-            "reward": "Elite Status",
-            "description": "Fancy formatting and theatrical responses"
-        },
-        {
-            "unlock": "75 uses",
-            "reward": "Shakespearean Dramatist",
-            "description": "Dramatic and theatrical responses"
-        },
-        {
-            "unlock": "100 uses",
-            "reward": "Legendary Mode",
-            "description": "The ultimate AI personality"
+            "unlock": f"{tier.streak} uses",
+            "reward": tier.title,
+            "description": tier.description
         }
+        for tier in REWARD_TIERS
     ]
 
-    return render_template('index.html', 
-                         features=features,
-                         personas=personas,
-                         rewards=rewards)
+    return {"features": features, "personas": personas, "rewards": rewards}
+
+@app.route('/')
+def home():
+    """Landing page route."""
+    return render_template('index.html', **landing_content())
+
+@app.route('/metrics')
+def metrics_route():
+    """Prometheus scrape endpoint for this process's metrics."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def serve_in_thread(port: int, host: str = '0.0.0.0'):
+    """Serve the app from a daemon thread so another process (the bot) can expose /metrics."""
+    from werkzeug.serving import make_server
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Serving /metrics on port %s", server.server_port)
+    return server
 
 if __name__ == '__main__':
+    config.init(validate_keys=False)
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import logging
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cache import SingleFlight
+from database import StorageBackend, UserState
+from metrics import DB_OPERATION_SECONDS
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+def _timed(func, *args):
+    """Call a backend method on the executor thread, recording how long it took."""
+    start = time.perf_counter()
+    try:
+        with span(f"db.{func.__name__}"):
+            return func(*args)
+    finally:
+        DB_OPERATION_SECONDS.observe(time.perf_counter() - start, func.__name__)
+
+class AsyncDatabase:
+    """Awaitable front for Database that keeps SQLite off the event loop.
+
+    Calls are queued to a dedicated executor sized by the backend (a single
+    thread for SQLite, so statements run in the order they were issued) and
+    never block the gateway. Concurrent reads
+    for the same user share a single query; their result is shared too, so
+    callers must treat it as read-only.
+    """
+
+    def __init__(self, db: StorageBackend):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=db.max_workers, thread_name_prefix="database")
+        self._reads = SingleFlight()
+        self.calls = 0
+
+    async def _run(self, func, *args):
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        # The caller's context goes along so the call shows up in its trace
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, _timed, func, *args))
+
+    async def _read(self, func, user_id: int):
+        return await self._reads.do((func.__name__, user_id), lambda: self._run(func, user_id))
+
+    async def load_user(self, user_id: int) -> tuple:
+        return await self._read(self.db.load_user, user_id)
+
+    async def get_user_streak(self, user_id: int) -> tuple:
+        return await self._read(self.db.get_user_streak, user_id)
+
+    async def get_user_preferences(self, user_id: int) -> tuple:
+        return await self._read(self.db.get_user_preferences, user_id)
+
+    async def load_and_touch_user(self, user_id: int, guild_id: int = None) -> UserState:
+        return await self._run(self.db.load_and_touch_user, user_id, guild_id)
+
+    async def update_user_streak(self, user_id: int) -> tuple:
+        return await self._run(self.db.update_user_streak, user_id)
+
+    async def save_user_preference(self, user_id: int, default_persona: str = None, custom_settings: dict = None) -> bool:
+        return await self._run(self.db.save_user_preference, user_id, default_persona, custom_settings)
+
+    async def save_streaks(self, rows: list, members: list = ()):
+        await self._run(self.db.save_streaks, rows, members)
+
+    async def top_streaks(self, kind: str, limit: int, guild_id: int = None) -> list:
+        return await self._run(self.db.top_streaks, kind, limit, guild_id)
+
+    async def close(self):
+        """Close the backend once queued work is done, then stop the executor."""
+        await self._run(self.db.close)
+        self._executor.shutdown(wait=True)
+        logger.info("Database executor stopped after %s calls (%s reads coalesced)", self.calls, self._reads.coalesced)
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "reads_coalesced": self._reads.coalesced}
@@ -0,0 +1,67 @@
+"""Micro-benchmark for the Database layer.
+
+Runs the per-question workload from /smelty (preferences lookup, streak
+read, streak update, reward check) against two setups:
+
+- per-call: a new sqlite3 connection for every call with the default rollback journal, as before
+- persistent: one long-lived connection with WAL, synchronous=NORMAL, mmap and a larger page cache
+
+Usage: python bench_database.py [iterations] [users]
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+os.environ.setdefault("DISCORD_TOKEN", "bench-discord-token")
+os.environ.setdefault("DEEPSEEK_API_KEY", "sk-bench")
+
+import logging
+from database import Database
+
+class PerCallDatabase(Database):
+    """The old behaviour: open and close a connection around every call."""
+
+    @contextmanager
+    def get_connection(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+def question(db: Database, user_id: int):
+    db.get_user_preferences(user_id)
+    db.get_user_streak(user_id)
+    db.update_user_streak(user_id)
+    db.get_user_streak(user_id)
+
+def run(db_class, iterations: int, users: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = db_class(os.path.join(tmp, "bench.db"))
+        for user_id in range(users):
+            db.save_user_preference(user_id, "dank_memer")
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            question(db, i % users)
+        elapsed = time.perf_counter() - start
+
+        db.close()
+        return iterations * 4 / elapsed
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    logging.disable(logging.INFO)
+
+    before = run(PerCallDatabase, iterations, users)
+    after = run(Database, iterations, users)
+    print(f"{iterations} questions, {users} users, 4 DB calls each")
+    print(f"  per-call connection:  {before:10.0f} ops/sec")
+    print(f"  persistent + WAL:     {after:10.0f} ops/sec  ({after / before:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Startup benchmark: what each entry module costs to import, and how long until the bot is ready.
+
+Every measurement runs in a fresh interpreter, so nothing is already in
+sys.modules. Import times come from `python -X importtime` (the module's
+cumulative time, without interpreter startup). Time to ready is importing
+bot plus config.init() and bot.init_storage() on a new database in a
+temporary directory: everything start_bot() does before it connects.
+
+Usage: python bench_startup.py [runs] [--check]
+
+With --check, exits with status 1 when a median is over its budget, so
+an import that slows every test run and restart shows up here first.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Median milliseconds allowed per measurement
+BUDGETS_MS = {
+    "config": 25,  # Settings only: no logging setup, no .env parsing without a file
+    "app": 200,  # Flask; personas and rewards are loaded on the first page view
+    "cluster": 100,  # The supervisor doesn't import the bot
+    "bot": 450,  # discord.py and aiohttp are most of this
+    "ready": 600  # import bot, config.init(), open and migrate the database
+}
+
+READY_SCRIPT = """
+import time
+start = time.perf_counter()
+import bot
+bot.config.init()
+bot.init_storage()
+print((time.perf_counter() - start) * 1000)
+"""
+
+def _env() -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("DISCORD_TOKEN", "bench-discord-token")
+    env.setdefault("DEEPSEEK_API_KEY", "sk-bench")
+    return env
+
+def import_ms(module: str) -> float:
+    """Cumulative import time of module in a new interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=_env(), cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    for line in reversed(result.stderr.splitlines()):
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"No import time reported for {module}")
+
+def ready_ms() -> float:
+    """Milliseconds from the start of `import bot` until it could connect to Discord."""
+    with tempfile.TemporaryDirectory() as tmp:  # The database is created in the working directory
+        result = subprocess.run(
+            [sys.executable, "-c", READY_SCRIPT],
+            env=_env(), cwd=tmp, capture_output=True, text=True, check=True
+        )
+    return float(result.stdout.split()[-1])
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--check"]
+    runs = int(args[0]) if args else 5
+    check = "--check" in sys.argv
+
+    over = []
+    print(f"Median of {runs} runs, each in a new interpreter")
+    for name, budget in BUDGETS_MS.items():
+        measure = ready_ms if name == "ready" else lambda: import_ms(name)
+        median = statistics.median(measure() for _ in range(runs))
+        status = "ok" if median <= budget else "OVER"
+        label = "time to ready" if name == "ready" else f"import {name}"
+        print(f"  {label:<16} {median:8.1f} ms   budget {budget:5d} ms   {status}")
+        if median > budget:
+            over.append(name)
+
+    if check and over:
+        print(f"Over budget: {', '.join(over)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,96 @@
+import logging
 import discord
 from discord import app_commands
-from config import DISCORD_TOKEN, logger
-from database import Database
+import config
+from config import (
+    AUTO_SHARD,
+    CLUSTER_STATE_ADDRESS,
+    DISCORD_TOKEN,
+    MAX_QUESTION_TOKENS,
+    METRICS_PORT,
+    QUESTION_OVERFLOW,
+    SHARD_COUNT,
+    SHARD_HEALTH_INTERVAL,
+    SHARD_IDS,
+    SHORT_REQUEST_TOKENS,
+    STREAM_MIN_TOKENS,
+    STREAM_RESPONSES
+)
+from async_database import AsyncDatabase
+from database import LEADERBOARD_COLUMNS, open_database
+from leaderboard import Leaderboard
+from metrics import DISCORD_SEND_SECONDS
+from tracing import span, start_trace, tracer
+from scheduler import HIGH, NORMAL, DeadlineExceeded, QueueFull
+from tokens import estimate_tokens, truncate_tokens
 from personas import PERSONAS, REWARD_PERSONAS, RICKROLL_RESPONSES, get_unlock_message, get_persona
-from utils import call_llm, handle_long_response
+from rewards import REWARD_TIERS, has_reward, next_tier, reward_names
+from user_state import UserStateCache
+from utils import (
+    call_llm,
+    check_rate_limit,
+    handle_long_response,
+    inflight_requests,
+    llm_client,
+    llm_scheduler,
+    rate_limiter,
+    response_cache,
+    send_streamed_response,
+    stream_llm
+)
 import asyncio
-import json
+import signal
+from datetime import datetime
 
-# Initialize Discord client with all intents
+logger = logging.getLogger(__name__)
+
+# Initialize Discord client with all intents; sharded when configured or launched by cluster.py
 intents = discord.Intents.default()
-client = discord.Client(intents=intents)
+if AUTO_SHARD or SHARD_COUNT:
+    client = discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
-# Initialize database
-db = Database()
+# The database and the in-memory user state in front of it; set by init_storage()
+db = None
+user_states = None
+leaderboard = None
+
+def init_storage(backend=None):
+    """Open the database, bringing its schema up to date, and build the state kept in front of it.
+
+    Called by start_bot() rather than on import, so importing this module
+    doesn't touch the database. backend defaults to the configured database.
+    Cluster workers can see the same user, so they skip the local user cache.
+    """
+    global db, user_states, leaderboard
+    if db is not None:
+        return
+    db = AsyncDatabase(backend or open_database())
+    user_states = UserStateCache(db, enabled=CLUSTER_STATE_ADDRESS is None)
+    leaderboard = Leaderboard(db, flush=user_states.flush)
+
+async def close_storage():
+    """Write back pending user state and close the database."""
+    global db, user_states, leaderboard
+    if db is None:
+        return
+    await user_states.close()
+    await db.close()
+    db = user_states = leaderboard = None
 
 @tree.command(name="help", description="Show available modes and features of the bot")
 async def help_command(interaction):
     """Display help information about the bot."""
     try:
         # Get user's unlocked rewards
-        _, _, unlocked_rewards = db.get_user_streak(interaction.user.id)
+        _, _, rewards_mask = await user_states.get_streak(interaction.user.id)
 
         # Build help text based on available features
         base_modes = ", ".join(f"`{m}`" for m in PERSONAS.keys())
-        unlocked_modes = ", ".join(f"`{m}`" for m in REWARD_PERSONAS.keys() if m in unlocked_rewards)
+        unlocked_modes = ", ".join(f"`{m}`" for m in REWARD_PERSONAS.keys() if has_reward(rewards_mask, m))
+        reward_tiers = "".join(f"• {tier.streak} uses: Unlock {tier.title}\n" for tier in REWARD_TIERS)
 
         # Build the special modes section only if there are unlocked modes
         special_modes_section = ""
@@ -37,24 +103,21 @@ async def help_command(interaction):
             f"{special_modes_section}"
             "🎮 **How to Use:**\n"
             "/smelty mode:[choose_mode] question:[your_question]\n"
-            "/prefs - Set your default personality mode\n\n"
+            "/prefs - Set your default personality mode\n"
+            "/leaderboard - See who has the longest streaks\n\n"
             "📝 **Example:**\n"
             "/smelty mode:cynical_vc question:What's your take on AI startups?\n\n"
             "🌟 **Streak Rewards:**\n"
-            "• 5 uses: Unlock Meme Lord mode\n"
-            "• 10 uses: Unlock Dank Memer mode\n"
-            "• 25 uses: Unlock Chaos Agent mode\n"
-            "• 50 uses: Unlock Elite Status\n"
-            "• 100 uses: Unlock Legendary status\n\n"
+            f"{reward_tiers}\n"
             "⚡ **Rate Limits:**\n"
-            "• 5 requests per minute to keep things running smoothly\n\n"
+            "• 5 requests per minute per user to keep things running smoothly\n\n"
             "Need more help? Just ask away! 🚀"
         )
 
         await interaction.response.send_message(help_text)
-        logger.info(f"Help command used by {interaction.user.name}")
+        logger.info("Help command used by %s", interaction.user.name)
     except Exception as e:
-        logger.error(f"Error displaying help: {e}", exc_info=True)
+        logger.error("Error displaying help: %s", e, exc_info=True)
         await interaction.response.send_message(
             "❌ Sorry, couldn't display help right now. Please try again later!"
         )
@@ -79,16 +142,16 @@ async def preferences(
     """Set user preferences."""
     try:
         # Get current preferences
-        default_persona, custom_settings = db.get_user_preferences(interaction.user.id)
+        default_persona, custom_settings = await user_states.get_preferences(interaction.user.id)
         custom_settings = custom_settings or {}
 
         if any([default_mode, response_style, mention_style, streak_display]):
             # Validate and update preferences
             if default_mode:
                 # Verify the mode exists and user has access
-                streak, _, unlocked_rewards = db.get_user_streak(interaction.user.id)
+                streak, _, rewards_mask = await user_states.get_streak(interaction.user.id)
 
-                if default_mode in REWARD_PERSONAS and default_mode not in unlocked_rewards:
+                if default_mode in REWARD_PERSONAS and not has_reward(rewards_mask, default_mode):
                     await interaction.response.send_message(
                         f"❌ You haven't unlocked the {default_mode} mode yet!\n"
                         f"Keep using the bot to unlock more personalities!"
@@ -96,7 +159,7 @@ async def preferences(
                     return
 
                 if default_mode not in PERSONAS and default_mode not in REWARD_PERSONAS:
-                    available_modes = list(PERSONAS.keys()) + [r for r in unlocked_rewards if r in REWARD_PERSONAS]
+                    available_modes = list(PERSONAS.keys()) + [r for r in reward_names(rewards_mask) if r in REWARD_PERSONAS]
                     await interaction.response.send_message(
                         f"❌ Invalid mode! Available modes: {', '.join(available_modes)}"
                     )
@@ -131,7 +194,7 @@ async def preferences(
             })
 
             # Save preferences
-            if db.save_user_preference(interaction.user.id, default_mode or default_persona, custom_settings):
+            if await user_states.save_preferences(interaction.user.id, default_mode or default_persona, custom_settings):
                 # Build response message
                 response = ["✅ Your preferences have been updated!"]
                 if default_mode:
@@ -171,7 +234,7 @@ async def preferences(
             await interaction.response.send_message('\n'.join(response))
 
     except Exception as e:
-        logger.error(f"Error handling preferences: {e}", exc_info=True)
+        logger.error("Error handling preferences: %s", e, exc_info=True)
         await interaction.response.send_message(
             "❌ Something went wrong with preferences. Please try again later!"
         )
@@ -185,41 +248,70 @@ async def preferences(
     question="Your question or prompt for the AI"
 )
 async def smelty(interaction, question: str, mode: str = None):
-    try:
-        logger.info(f"Command received - User: {interaction.user.name} (ID: {interaction.user.id})")
+    # The interaction ID doubles as the trace ID, so a slow answer's trace can be found from the logs
+    with start_trace("smelty", interaction.id, user_id=interaction.user.id, guild_id=interaction.guild_id or 0):
+        await answer_question(interaction, question, mode)
 
-        # Get user preferences
-        default_mode, custom_settings = db.get_user_preferences(interaction.user.id)
-        custom_settings = custom_settings or {}
-
-        # If no mode specified, use user's preferred mode
-        if not mode:
-            mode = default_mode or "cynical_vc"  # Fallback to default
-            logger.info(f"Using default mode {mode} for user {interaction.user.name}")
-
-        logger.info(f"Parameters - Mode: {mode}, Question: {question}")
+async def answer_question(interaction, question: str, mode: str = None):
+    """Handle /smelty: check limits, record the use, then ask the LLM and send the answer."""
+    try:
+        logger.info("Command received - User: %s (ID: %s, interaction %s)", interaction.user.name, interaction.user.id, interaction.id)
 
-        # Check if it's a rickroll request
+        # Rickroll only needs the preferred mode, and doesn't count towards the streak
         if question.lower().strip() == "rickroll":
+            with span("user_state.get_preferences"):
+                default_mode, _ = await user_states.get_preferences(interaction.user.id)
+            mode = mode or default_mode or "cynical_vc"
             response = RICKROLL_RESPONSES.get(mode, RICKROLL_RESPONSES["dank_memer"])
-            logger.info(f"Rickroll request processed for mode: {mode}")
-            await interaction.response.send_message(response)
+            logger.info("Rickroll request processed for mode: %s", mode)
+            with span("discord.send"):
+                await interaction.response.send_message(response)
             return
 
-        # Update user streak with more logging
-        previous_streak = db.get_user_streak(interaction.user.id)[0]
-        streak, highest_streak, unlocked_rewards = db.update_user_streak(interaction.user.id)
-        logger.info(f"User streak updated - Previous: {previous_streak}, New: {streak}")
+        # Oversized questions are cut down or refused before they use up a rate limit token
+        question_tokens = estimate_tokens(question)
+        trimmed = question_tokens > MAX_QUESTION_TOKENS
+        if trimmed:
+            if QUESTION_OVERFLOW == 'reject':
+                await interaction.response.send_message(
+                    f"📏 Whoa, that's a novel! Please keep questions under about {MAX_QUESTION_TOKENS * 4} characters."
+                )
+                return
+            question = truncate_tokens(question, MAX_QUESTION_TOKENS)
+            question_tokens = estimate_tokens(question)
+
+        # Per-user and per-guild rate limits
+        with span("rate_limit"):
+            rate_limit_msg = await check_rate_limit(interaction.user.id, interaction.guild_id)
+        if rate_limit_msg:
+            await interaction.response.send_message(rate_limit_msg)
+            return
+
+        # Load preferences and record this use; the streak is written back later in a batch
+        with span("user_state.touch"):
+            user_state = await user_states.touch(interaction.user.id, interaction.guild_id)
+        custom_settings = user_state.custom_settings
+        streak, highest_streak, rewards_mask = user_state.streak, user_state.highest_streak, user_state.rewards_mask
+        if streak:
+            leaderboard.record(interaction.user.id, interaction.guild_id, streak, highest_streak, datetime.now())
+        logger.debug("User streak updated - Previous: %s, New: %s", user_state.previous_streak, streak)
+
+        # If no mode specified, use user's preferred mode
+        if not mode:
+            mode = user_state.default_persona or "cynical_vc"  # Fallback to default
+            logger.debug("Using default mode %s for user %s", mode, interaction.user.name)
+
+        logger.debug("Parameters - Mode: %s, Question: %s", mode, question)
 
         # Get appropriate persona based on mode and unlocked rewards
-        persona = get_persona(mode, unlocked_rewards)
+        persona = get_persona(mode, rewards_mask)
         if not persona:
             available_modes = (
                 list(PERSONAS.keys()) +
-                [r for r in unlocked_rewards if r in REWARD_PERSONAS]
+                [r for r in reward_names(rewards_mask) if r in REWARD_PERSONAS]
             )
             modes_str = ", ".join(f"`{m}`" for m in available_modes)
-            logger.warning(f"Invalid mode requested: {mode} by user {interaction.user.name}")
+            logger.warning("Invalid mode requested: %s by user %s", mode, interaction.user.name)
             await interaction.response.send_message(
                 f"❌ Invalid mode! Available modes: {modes_str}\n"
                 f"💡 Use `/help` to see all features and examples!"
@@ -227,15 +319,12 @@ async def smelty(interaction, question: str, mode: str = None):
             return
 
         # Defer response with logging
-        await interaction.response.defer(thinking=True)
-        logger.info("Response deferred, initiating API call")
+        with span("discord.defer"):
+            await interaction.response.defer(thinking=True)
+        logger.debug("Response deferred, initiating API call")
 
+        queue_notice = False
         try:
-            # Get AI response with enhanced logging
-            logger.info(f"Calling LLM API for user {interaction.user.name} with persona {mode}")
-            response = call_llm(persona["prompt"], question)
-            logger.info("Received LLM API response successfully")
-
             # Format response based on user preferences
             response_style = custom_settings.get('response_style', 'normal')
             mention_style = custom_settings.get('mention_style', 'username')
@@ -248,55 +337,111 @@ async def smelty(interaction, question: str, mode: str = None):
             elif mention_style == 'nickname':
                 user_mention = interaction.user.display_name
 
-            # Format response based on style
+            # Build the text that goes before the response based on style
             if response_style == 'fancy':
-                formatted_response = f"```diff\n+ {mode.upper()} MODE\n```\n{user_mention}\n{response}"
+                header = f"```diff\n+ {mode.upper()} MODE\n```\n{user_mention}\n"
             elif response_style == 'minimal':
-                formatted_response = f"{response}"
+                header = ""
             else:  # normal
-                formatted_response = f"**[{mode}]** {user_mention}\n{response}"
+                header = f"**[{mode}]** {user_mention}\n"
 
             # Add streak information if enabled
+            streak_message = ""
             if streak_display == 'on':
                 streak_message = f"\n🎯 Current Streak: {streak}"
                 if highest_streak > streak:
                     streak_message += f" (Highest: {highest_streak})"
 
                 # Add new reward notifications
-                new_rewards = [r for r in unlocked_rewards if r not in json.loads(db.get_user_streak(interaction.user.id)[2])]
-                if new_rewards:
+                if user_state.new_rewards_mask:
                     streak_message += "\n\n🎉 **New Rewards Unlocked!**"
-                    for reward in new_rewards:
+                    for reward in reward_names(user_state.new_rewards_mask):
                         streak_message += f"\n{get_unlock_message(reward)}"
-                elif streak >= 5:
-                    next_tier = next((tier for tier in [5, 10, 25, 50, 100] if tier > streak), None)
-                    if next_tier:
-                        streak_message += f"\n👀 Next reward at {next_tier} streak!"
+                elif streak >= REWARD_TIERS[0].streak:
+                    upcoming = next_tier(streak)
+                    if upcoming:
+                        streak_message += f"\n👀 Next reward at {upcoming.streak} streak!"
+
+            if trimmed:
+                streak_message = "\n✂️ Your question was trimmed to fit." + streak_message
+
+            # Reward-tier users and requests with little to read and write skip ahead of the normal lane
+            max_tokens = persona["max_tokens"]
+            priority = HIGH if rewards_mask or question_tokens + max_tokens <= SHORT_REQUEST_TOKENS else NORMAL
+
+            async def show_queue_position(position):
+                nonlocal queue_notice
+                queue_notice = True
+                await interaction.edit_original_response(
+                    content=f"⏳ Lots of questions right now! You're #{position} in line..."
+                )
 
-                formatted_response += streak_message
+            llm_options = {
+                "cacheable": persona.get("cacheable", True),
+                "guild_id": interaction.guild_id,
+                "priority": priority,
+                "on_queued": show_queue_position,
+                "max_tokens": max_tokens
+            }
 
-            await interaction.followup.send(formatted_response)
-            logger.info(f"Response sent successfully to user {interaction.user.name}")
+            # Get AI response with enhanced logging
+            logger.debug("Calling LLM API for user %s with persona %s", interaction.user.name, mode)
+            # Short answers arrive in one message; streaming them would only add edits
+            if STREAM_RESPONSES and max_tokens >= STREAM_MIN_TOKENS:
+                with span("stream_llm", mode=mode):
+                    await send_streamed_response(
+                        interaction,
+                        stream_llm(persona["prompt"], question, **llm_options),
+                        header=header,
+                        footer=streak_message
+                    )
+            else:
+                response = await call_llm(persona["prompt"], question, **llm_options)
+                logger.debug("Received LLM API response successfully")
+                with DISCORD_SEND_SECONDS.time("send"), span("discord.send"):
+                    await interaction.followup.send(f"{header}{response}{streak_message}")
+            logger.debug("Response sent successfully to user %s", interaction.user.name)
+
+        except QueueFull:
+            await interaction.followup.send(
+                "🚦 I'm swamped with questions right now!\n"
+                "⏳ Give it a minute and ask me again."
+            )
+
+        except DeadlineExceeded:
+            logger.warning("Request from %s expired in the LLM queue", interaction.user.name)
+            await interaction.followup.send(
+                "⌛ Sorry, the line was too long and your question timed out.\n"
+                "🔄 Please try again in a moment!"
+            )
 
         except Exception as e:
             error_msg = str(e)
             if "Rate limit exceeded" in error_msg:
-                logger.warning(f"Rate limit hit for user {interaction.user.name}")
+                logger.warning("Rate limit hit for user %s", interaction.user.name)
                 await interaction.followup.send(
                     "🚫 Whoa there, speed racer! You're moving too fast!\n"
                     "⏳ Take a quick breather (about 60 seconds) before your next wild take.\n"
                     "🤔 Perfect time to review your previous chaos or check `/help` for more modes!"
                 )
             else:
-                logger.error(f"Error getting response: {e}", exc_info=True)
+                logger.error("Error getting response: %s", e, exc_info=True)
                 await interaction.followup.send(
                     "🤖 Oops! My circuits are a bit tangled right now.\n"
                     "🔄 Give me a moment to recalibrate and try again!\n"
                     "💡 Tip: Try a different mode or question if this persists."
                 )
 
+        finally:
+            # The answer went out as a new followup, so the "#N in line" message is left over
+            if queue_notice:
+                try:
+                    await interaction.delete_original_response()
+                except discord.errors.HTTPException as e:
+                    logger.warning("Could not remove queue position message: %s", e)
+
     except Exception as e:
-        logger.error(f"Error processing command: {e}", exc_info=True)
+        logger.error("Error processing command: %s", e, exc_info=True)
         error_response = (
             "⚠️ Something went sideways! Don't worry, it's not you - it's me.\n"
             "🔄 Please try again in a moment!"
@@ -306,6 +451,36 @@ async def smelty(interaction, question: str, mode: str = None):
         else:
             await interaction.followup.send(error_response)
 
+@tree.command(name="leaderboard", description="See the top streaks in this server or everywhere!")
+@app_commands.describe(
+    ranking="Rank by current or highest streak (current/highest)",
+    scope="Just this server or every server (server/global)"
+)
+async def leaderboard_command(interaction, ranking: str = "current", scope: str = "server"):
+    """Show the top streaks."""
+    try:
+        if ranking not in LEADERBOARD_COLUMNS:
+            await interaction.response.send_message(
+                "❌ Invalid ranking! Choose from: current, highest"
+            )
+            return
+        if scope not in ['server', 'global']:
+            await interaction.response.send_message(
+                "❌ Invalid scope! Choose from: server, global"
+            )
+            return
+
+        guild_id = interaction.guild_id if scope == 'server' else None
+        text = await leaderboard.text(ranking, guild_id)
+        # Mentions show names without pinging everyone on the board
+        await interaction.response.send_message(text, allowed_mentions=discord.AllowedMentions.none())
+        logger.info("Leaderboard command used by %s", interaction.user.name)
+    except Exception as e:
+        logger.error("Error showing leaderboard: %s", e, exc_info=True)
+        await interaction.response.send_message(
+            "❌ Couldn't load the leaderboard right now. Please try again later!"
+        )
+
 @tree.command(name="invite", description="Get the bot's invite link!")
 async def invite_command(interaction):
     """Provides the bot's invite link."""
@@ -327,9 +502,9 @@ async def invite_command(interaction):
             f"Click here to invite me: {invite_url}\n\n"
             f"*I only need basic permissions to send messages and use commands!*"
         )
-        logger.info(f"Invite command used by {interaction.user.name}")
+        logger.info("Invite command used by %s", interaction.user.name)
     except Exception as e:
-        logger.error(f"Error generating invite link: {e}")
+        logger.error("Error generating invite link: %s", e)
         await interaction.response.send_message(
             "❌ Oops! Something went wrong generating the invite link. "
             "Please try again later!"
@@ -339,35 +514,92 @@ async def invite_command(interaction):
 async def on_ready():
     """Called when the bot is ready."""
     try:
-        await tree.sync()
-        logger.info(f"Logged in as {client.user} (ID: {client.user.id})")
+        # In a cluster only the process holding shard 0 syncs commands
+        if SHARD_IDS is None or 0 in SHARD_IDS:
+            await tree.sync()
+        logger.info("Logged in as %s (ID: %s)", client.user, client.user.id)
         logger.info("Bot is ready and commands are synced!")
         logger.info("------")
     except Exception as e:
-        logger.error(f"Error during startup: {e}", exc_info=True)
+        logger.error("Error during startup: %s", e, exc_info=True)
+
+async def report_shard_health(report_health, interval: float = SHARD_HEALTH_INTERVAL):
+    """Send each shard's gateway state to report_health every interval."""
+    await client.wait_until_ready()
+    while not client.is_closed():
+        shards = client.shards if isinstance(client, discord.AutoShardedClient) else {}
+        guild_counts = {}
+        for guild in client.guilds:
+            guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+        for shard_id, shard in shards.items():
+            report_health({
+                "shard_id": shard_id,
+                "latency": shard.latency,
+                "closed": shard.is_closed(),
+                "guilds": guild_counts.get(shard_id, 0)
+            })
+        await asyncio.sleep(interval)
+
+async def start_bot(report_health=None):
+    """Start the Discord bot with reconnection handling.
 
-async def start_bot():
-    """Start the Discord bot with reconnection handling."""
+    report_health, if given, is called with per-shard health dicts.
+    """
     retry_count = 0
     max_retries = 5
     base_delay = 1
 
-    while retry_count < max_retries:
-        try:
-            async with client:
-                await client.start(DISCORD_TOKEN)
-        except discord.errors.HTTPException as e:
-            if e.status == 429:  # Too Many Requests
-                delay = base_delay * (2 ** retry_count)  # Exponential backoff
-                logger.warning(f"Rate limited. Retrying in {delay} seconds...")
-                await asyncio.sleep(delay)
-                retry_count += 1
-            else:
-                logger.error(f"HTTP Error: {e}")
+    config.init()
+    init_storage()
+    metrics_server = None
+    health_task = None
+    # Ctrl-C cancels this task rather than raising an Exception, so cleanup lives in the finally
+    try:
+        # Open provider connections before the first question arrives
+        await llm_client.warm_up()
+        if METRICS_PORT:
+            from app import serve_in_thread
+            metrics_server = serve_in_thread(METRICS_PORT)
+        user_states.start()
+        health_task = asyncio.ensure_future(report_shard_health(report_health)) if report_health else None
+
+        # SIGTERM (e.g. from cluster.py) closes the gateway so the cleanup below runs
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(client.close()))
+
+        while retry_count < max_retries:
+            try:
+                async with client:
+                    await client.start(DISCORD_TOKEN)
+                break  # Closed on purpose
+            except discord.errors.HTTPException as e:
+                if e.status == 429:  # Too Many Requests
+                    delay = base_delay * (2 ** retry_count)  # Exponential backoff
+                    logger.warning("Rate limited. Retrying in %s seconds...", delay)
+                    await asyncio.sleep(delay)
+                    retry_count += 1
+                else:
+                    logger.error("HTTP Error: %s", e)
+                    break
+            except Exception as e:
+                logger.error("Error during bot execution: %s", e)
                 break
-        except Exception as e:
-            logger.error(f"Error during bot execution: {e}")
-            break
+    finally:
+        if health_task is not None:
+            health_task.cancel()
+        logger.info("Response cache stats: %s", response_cache.stats())
+        logger.info("Request coalescing stats: %s", inflight_requests.stats())
+        logger.info("Rate limiter stats: %s", rate_limiter.stats())
+        logger.info("LLM scheduler stats: %s", llm_scheduler.stats())
+        logger.info("Provider health: %s", llm_client.health_stats())
+        logger.info("User state cache stats: %s", user_states.stats())
+        logger.info("Leaderboard stats: %s", leaderboard.stats())
+        logger.info("Database stats: %s", db.stats())
+        logger.info("Tracing stats: %s", tracer.stats())
+        await llm_client.close()
+        await close_storage()
+        tracer.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(start_bot())
\ No newline at end of file
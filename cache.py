@@ -0,0 +1,148 @@
+import logging
+import time
+import asyncio
+from collections import OrderedDict
+from config import CACHE_TIMEOUT, CACHE_MAX_BYTES, CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """TTL + LRU cache for LLM responses, bounded by entry count and total size."""
+
+    def __init__(
+        self,
+        ttl: float = CACHE_TIMEOUT,
+        max_bytes: int = CACHE_MAX_BYTES,
+        max_entries: int = CACHE_MAX_ENTRIES
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # key -> (expires_at, response, size in bytes); oldest use first
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(system_message: str, user_message: str, params: dict) -> tuple:
+        """Build a cache key from the persona prompt, normalized question and generation parameters."""
+        question = " ".join(user_message.lower().split())
+        return system_message, question, tuple(sorted(params.items()))
+
+    def get(self, key: tuple) -> str:
+        """Return the cached response for key, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, response, size = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def set(self, key: tuple, response: str):
+        """Store a response, evicting least recently used entries to stay within bounds."""
+        # The persona prompt is shared with PERSONAS, so only the question and answer add memory
+        size = len(key[1].encode()) + len(response.encode())
+        if size > self.max_bytes:
+            logger.debug("Response too large to cache (%s bytes)", size)
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, response, size)
+        self.size += size
+
+        while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: tuple):
+        _, _, size = self._entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters plus current footprint."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+class SingleFlight:
+    """Collapse identical concurrent LLM requests into a single upstream call.
+
+    The first caller for a key becomes the leader and does the work; callers
+    that arrive while it is in flight await the leader's result instead.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> Future or Task resolving to the response
+        self.leaders = 0
+        self.coalesced = 0
+
+    def get(self, key: tuple):
+        """Return the in-flight future for key, or None if nobody is fetching it."""
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+        return future
+
+    def lead(self, key: tuple) -> asyncio.Future:
+        """Register the caller as leader for key; it must call finish() when done."""
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        return future
+
+    def finish(self, key: tuple, response: str):
+        """Hand the leader's response to every waiting follower."""
+        future = self._calls.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    async def do(self, key: tuple, func) -> str:
+        """Await func() once per key, sharing its result with concurrent callers."""
+        task = self.get(key)
+        if task is None:
+            # Run as its own task so a cancelled leader doesn't cancel its followers
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: tuple, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter went away
+
+    def stats(self) -> dict:
+        """Upstream calls made versus calls saved by coalescing."""
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
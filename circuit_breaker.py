@@ -0,0 +1,156 @@
+import logging
+import asyncio
+import time
+from collections import deque
+from config import (
+    BREAKER_FAILURE_RATE,
+    BREAKER_WINDOW,
+    BREAKER_MIN_CALLS,
+    BREAKER_OPEN_SECONDS,
+    BREAKER_SLOW_CALL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker for one provider.
+
+    Calls are scored over a rolling window: errors and calls slower than
+    slow_call_seconds both count as failures. Once the failure rate reaches
+    failure_rate the breaker opens and the provider is skipped outright. While
+    open, a background probe checks the provider every open_seconds; a
+    successful probe moves to half-open, where one live call decides between
+    closing again and re-opening.
+
+    allow() hands each admitted call a permit, which the call passes back
+    with its outcome. While half-open only the trial call's permit counts,
+    so a straggler admitted before the breaker opened can't decide it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        probe=None,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        window: int = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+        clock=time.monotonic
+    ):
+        self.name = name
+        self.probe = probe  # async callable that raises if the provider is unhealthy
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.clock = clock
+        self.outcomes = deque(maxlen=window)  # True for a failed or slow call
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._permits = 0  # Last permit handed out
+        self._trial = None  # Permit of the half-open trial call in flight
+        self._probe_task = None
+
+    def allow(self) -> int:
+        """A permit for a live call to this provider right now, or None if it may not go."""
+        self._permits += 1
+        if self.state == CLOSED:
+            return self._permits
+
+        if self.state == OPEN:
+            # Without a background probe, let a live call test the provider after the cool-down
+            if self.probe is None and self.clock() - self.opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN)
+            else:
+                return None
+
+        if self._trial is not None:
+            return None
+        self._trial = self._permits
+        return self._trial
+
+    def release(self, permit: int = None):
+        """Hand back a permit that ended up unused (e.g. a cancelled call), freeing the trial slot if it was the trial."""
+        if permit is not None and permit == self._trial:
+            self._trial = None
+
+    def record_success(self, latency: float, permit: int = None):
+        slow = latency >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if permit is None or permit != self._trial:
+                return  # Admitted before the breaker opened; only the trial decides
+            self._trial = None
+            if slow:
+                self._open()
+            else:
+                self.outcomes.clear()
+                self._set_state(CLOSED)
+            return
+        self._record(slow)
+
+    def record_failure(self, permit: int = None):
+        if self.state == HALF_OPEN:
+            if permit is None or permit != self._trial:
+                return
+            self._trial = None
+            self._open()
+            return
+        self._record(True)
+
+    def _record(self, failed: bool):
+        self.outcomes.append(failed)
+        if self.state == CLOSED and len(self.outcomes) >= self.min_calls:
+            if sum(self.outcomes) / len(self.outcomes) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self._set_state(OPEN)
+        self.opened_at = self.clock()
+        self.times_opened += 1
+        self.outcomes.clear()
+        if self.probe is not None and (self._probe_task is None or self._probe_task.done()):
+            self._probe_task = asyncio.ensure_future(self._probe_until_healthy())
+
+    async def _probe_until_healthy(self):
+        """Probe the provider in the background until it answers again."""
+        while self.state == OPEN:
+            await asyncio.sleep(self.open_seconds)
+            try:
+                await self.probe()
+            except Exception as e:
+                logger.warning("%s probe failed, circuit stays open: %r", self.name, e)
+                continue
+            logger.info("%s probe succeeded, allowing a trial call", self.name)
+            self._set_state(HALF_OPEN)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning("%s circuit %s -> %s", self.name, self.state, state)
+            self.state = state
+
+    def health(self) -> float:
+        """Share of recent calls that were fast and successful (0.0 when open)."""
+        if self.state == OPEN:
+            return 0.0
+        if not self.outcomes:
+            return 1.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def close(self):
+        """Stop any background probe."""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    def as_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "health": round(self.health(), 3),
+            "times_opened": self.times_opened
+        }
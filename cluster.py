@@ -0,0 +1,242 @@
+"""Run the bot as several sharded worker processes under one supervisor.
+
+Usage: python cluster.py [--shards N] [--workers N]
+
+The supervisor splits shard ids into contiguous ranges, starts one worker
+process per range and restarts any worker that dies. It also hosts the
+state that must agree across shards: the rate limiter and response cache
+live in a manager server, and workers use them through proxies. Workers
+report per-shard health back over a queue.
+"""
+import logging
+import argparse
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from multiprocessing.managers import BaseManager
+import config
+from config import CLUSTER_WORKERS, DISCORD_TOKEN, METRICS_PORT, SHARD_COUNT, SHARD_HEALTH_INTERVAL
+from cache import ResponseCache
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Objects shared by every worker, created on first use inside the manager server
+SHARED_OBJECTS = {
+    "rate_limiter": RateLimiter,
+    "response_cache": ResponseCache
+}
+
+# A shard that hasn't reported for this many intervals is flagged
+STALE_AFTER_INTERVALS = 3
+MAX_RESTART_DELAY = 60
+
+class _Locked:
+    """Serializes calls into a shared object; the manager serves each worker on its own thread."""
+
+    def __init__(self, obj):
+        self._obj = obj
+        self._lock = threading.Lock()
+
+    def call(self, method: str, *args, **kwargs):
+        with self._lock:
+            return getattr(self._obj, method)(*args, **kwargs)
+
+_instances = {}
+
+def _get_shared(name: str) -> _Locked:
+    if name not in _instances:
+        _instances[name] = _Locked(SHARED_OBJECTS[name]())
+    return _instances[name]
+
+class ClusterState(BaseManager):
+    pass
+
+ClusterState.register("get", callable=_get_shared, exposed=("call",))
+
+class SharedObject:
+    """Client side of a shared object: method calls run in the manager process.
+
+    Every call is a blocking round trip to the state server, so code on the
+    event loop goes through utils.shared_call() rather than calling directly.
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+
+    def call(self, method: str, *args, **kwargs):
+        return self._proxy.call(method, *args, **kwargs)
+
+    def __getattr__(self, method: str):
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+def shared_object(name: str, address: tuple = None):
+    """The cluster-wide instance of a SHARED_OBJECTS entry, or a new local one outside a cluster."""
+    if address is None:
+        return SHARED_OBJECTS[name]()
+    manager = ClusterState(address=address, authkey=multiprocessing.current_process().authkey)
+    manager.connect()
+    return SharedObject(manager.get(name))
+
+def shard_ranges(shard_count: int, workers: int) -> list:
+    """Split shard ids 0..shard_count-1 into at most `workers` contiguous, near-equal ranges."""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+def recommended_shard_count() -> int:
+    """Ask Discord how many shards this bot should run."""
+    import requests  # Only the supervisor needs it, and only without --shards
+    response = requests.get(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {DISCORD_TOKEN}"},
+        timeout=10
+    )
+    response.raise_for_status()
+    return response.json()["shards"]
+
+def run_worker(cluster_id: int, shard_ids: list, shard_count: int, state_address: tuple, health_queue):
+    """Worker process entry point: run the bot for shard_ids."""
+    # bot and utils read these from config when imported below
+    config.SHARD_IDS = shard_ids
+    config.SHARD_COUNT = shard_count
+    config.CLUSTER_STATE_ADDRESS = state_address
+    if METRICS_PORT:
+        config.METRICS_PORT = METRICS_PORT + cluster_id  # One scrape target per worker
+
+    import asyncio
+    import bot
+
+    def report(health: dict):
+        health_queue.put({"cluster_id": cluster_id, **health})
+
+    logger.info("Cluster worker %s starting shards %s of %s", cluster_id, shard_ids, shard_count)
+    asyncio.run(bot.start_bot(report_health=report))
+
+class Supervisor:
+    """Starts, watches and restarts the worker processes of a cluster."""
+
+    def __init__(self, shard_count: int, workers: int = CLUSTER_WORKERS, target=run_worker, extra_args: tuple = ()):
+        self.shard_count = shard_count
+        self.ranges = shard_ranges(shard_count, workers)
+        self.target = target
+        self.extra_args = extra_args
+        self.context = multiprocessing.get_context("spawn")
+        self.health_queue = self.context.Queue()
+        self.health = {}  # shard_id -> latest report plus when it arrived
+        self.processes = {}  # cluster_id -> Process
+        self.restarts = {}  # cluster_id -> restarts so far
+        self._restart_at = {}  # cluster_id -> monotonic time of the next restart attempt
+        self._state = None
+        self._stopping = False
+
+    @property
+    def state_address(self) -> tuple:
+        return self._state.address
+
+    def start(self):
+        self._state = ClusterState(address=("127.0.0.1", 0), ctx=self.context)
+        self._state.start()
+        logger.info("Cluster state server on %s; %s workers for %s shards", self._state.address, len(self.ranges), self.shard_count)
+        for cluster_id in range(len(self.ranges)):
+            self.restarts[cluster_id] = 0
+            self._spawn(cluster_id)
+
+    def _spawn(self, cluster_id: int):
+        process = self.context.Process(
+            target=self.target,
+            args=(cluster_id, self.ranges[cluster_id], self.shard_count, self._state.address, self.health_queue, *self.extra_args),
+            name=f"smelty-cluster-{cluster_id}",
+            daemon=True
+        )
+        process.start()
+        self.processes[cluster_id] = process
+        logger.info("Started worker %s (pid %s) for shards %s", cluster_id, process.pid, self.ranges[cluster_id])
+
+    def poll(self, timeout: float = 1.0):
+        """Collect health reports for up to `timeout` seconds and restart dead workers."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                report = self.health_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            self.health[report["shard_id"]] = {**report, "received": time.monotonic()}
+
+        if self._stopping:
+            return
+        now = time.monotonic()
+        for cluster_id, process in self.processes.items():
+            if process.is_alive():
+                continue
+            if cluster_id not in self._restart_at:
+                delay = min(MAX_RESTART_DELAY, 2 ** self.restarts[cluster_id])
+                logger.error("Worker %s exited with code %s; restarting in %ss", cluster_id, process.exitcode, delay)
+                self._restart_at[cluster_id] = now + delay
+            elif now >= self._restart_at[cluster_id]:
+                del self._restart_at[cluster_id]
+                self.restarts[cluster_id] += 1
+                self._spawn(cluster_id)
+
+    def stale_shards(self, interval: float = SHARD_HEALTH_INTERVAL) -> list:
+        """Shards with no health report for STALE_AFTER_INTERVALS intervals."""
+        cutoff = time.monotonic() - interval * STALE_AFTER_INTERVALS
+        return [
+            shard_id for shard_ids in self.ranges for shard_id in shard_ids
+            if self.health.get(shard_id, {}).get("received", 0) < cutoff
+        ]
+
+    def run(self):
+        """Supervise until SIGINT or SIGTERM, logging cluster health every interval."""
+        self.start()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        signal.signal(signal.SIGINT, lambda *_: self.stop())
+        next_report = time.monotonic() + SHARD_HEALTH_INTERVAL
+        while not self._stopping:
+            self.poll()
+            if time.monotonic() >= next_report:
+                next_report += SHARD_HEALTH_INTERVAL
+                reporting = len(self.health)
+                logger.info("Cluster health: %s/%s shards reporting, restarts %s", reporting, self.shard_count, self.restarts)
+                stale = self.stale_shards()
+                if stale:
+                    logger.warning("Shards without recent health reports: %s", stale)
+        self.shutdown()
+
+    def stop(self):
+        self._stopping = True
+
+    def shutdown(self, timeout: float = 30):
+        """Ask every worker to stop, wait for them, then stop the state server."""
+        self._stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM: the bot closes its connections and flushes state
+        for process in self.processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+        if self._state is not None:
+            self._state.shutdown()
+            self._state = None
+        logger.info("Cluster stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as a sharded cluster")
+    parser.add_argument("--shards", type=int, default=SHARD_COUNT, help="total shards (default: Discord's recommendation)")
+    parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS, help="worker processes")
+    args = parser.parse_args()
+
+    config.init()
+    shard_count = args.shards or recommended_shard_count()
+    Supervisor(shard_count, args.workers).run()
+
+if __name__ == "__main__":
+    main()
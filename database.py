@@ -1,135 +1,359 @@
+import logging
 import sqlite3
+import threading
+from abc import ABC, abstractmethod
 from contextlib import contextmanager
-from config import DATABASE_PATH, logger
+from config import (
+    DATABASE_PATH,
+    DATABASE_URL,
+    DATABASE_CACHE_KB,
+    DATABASE_MMAP_BYTES,
+    DATABASE_BUSY_TIMEOUT
+)
+from migrations import migrate
+from rewards import newly_unlocked, reward_names
 from datetime import datetime, timedelta
+from typing import NamedTuple
 import json
 
-class Database:
-    def __init__(self):
-        self.db_path = DATABASE_PATH
+logger = logging.getLogger(__name__)
+
+# Compiled statements kept per connection; the queries below are fixed strings, so every call is a hit
+STATEMENT_CACHE_SIZE = 64
+
+# A use within this long of the previous one extends the streak
+STREAK_WINDOW = timedelta(hours=24)
+
+# Leaderboard kinds and the user_streaks column each ranks by
+LEADERBOARD_COLUMNS = {"current": "streak_count", "highest": "highest_streak"}
+
+class UserState(NamedTuple):
+    """A user's preferences and streak after recording one more use."""
+    default_persona: str
+    custom_settings: dict
+    previous_streak: int
+    streak: int
+    highest_streak: int
+    rewards_mask: int  # Every unlocked reward; see rewards.py
+    new_rewards_mask: int  # Unlocked by this use
+
+def advance_streak(streak: int, highest_streak: int, last_use: datetime, rewards_mask: int, now: datetime) -> tuple:
+    """Apply one use at `now` to a streak.
+
+    Returns (new streak, new highest streak, mask of newly unlocked rewards).
+    A use within 24 hours of the last one extends the streak; otherwise it
+    restarts at 1.
+    """
+    if last_use is not None and now - last_use <= STREAK_WINDOW:
+        streak += 1
+        new_rewards = newly_unlocked(streak, rewards_mask)
+        if new_rewards:
+            logger.info("New rewards unlocked: %s at streak %s", reward_names(new_rewards), streak)
+        return streak, max(streak, highest_streak), new_rewards
+    return 1, highest_streak or 1, 0
+
+def top_streaks_query(kind: str, by_guild: bool, param: str = "?") -> str:
+    """SQL for the top streaks of a kind, best first, served by the migration 3 indexes.
+
+    Parameters are (guild_id if by_guild, cutoff if kind is "current", limit);
+    current streaks older than the cutoff have lapsed and are left out.
+    """
+    column = LEADERBOARD_COLUMNS[kind]
+    conditions = []
+    if by_guild:
+        source = "guild_members m JOIN user_streaks s ON s.user_id = m.user_id"
+        conditions.append(f"m.guild_id = {param}")
+    else:
+        source = "user_streaks s"
+    if kind == "current":
+        conditions.append(f"s.last_use >= {param}")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f'''
+        SELECT s.user_id, s.{column}, s.last_use
+        FROM {source}
+        {where}
+        ORDER BY s.{column} DESC, s.user_id
+        LIMIT {param}
+    '''
+
+def top_streaks_params(kind: str, limit: int, guild_id: int = None) -> tuple:
+    """Parameters for top_streaks_query, in order."""
+    params = () if guild_id is None else (guild_id,)
+    if kind == "current":
+        params += (datetime.now() - STREAK_WINDOW,)
+    return params + (limit,)
+
+class StorageBackend(ABC):
+    """Interface every storage backend implements.
+
+    Database is the SQLite backend; postgres_database.PostgresDatabase shares
+    state between processes and hosts. Rewards are passed around as the
+    bitmask from rewards.py. A backend missing any method fails when it is
+    created rather than when the method is first called.
+    """
+
+    # Threads that may call into the backend at once
+    max_workers = 1
+
+    @abstractmethod
+    def load_user(self, user_id: int) -> tuple:
+        """Return (default_persona, custom_settings, streak, highest_streak, last_use, rewards_mask)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_streaks(self, rows: list, members: list = ()):
+        """Upsert (user_id, streak, highest_streak, last_use, rewards_mask) rows in one transaction.
+
+        members holds (guild_id, user_id) pairs to record as guild members in the same transaction.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_and_touch_user(self, user_id: int, guild_id: int = None) -> UserState:
+        raise NotImplementedError
+
+    @abstractmethod
+    def top_streaks(self, kind: str, limit: int, guild_id: int = None) -> list:
+        """Return up to limit (user_id, score, last_use) rows for a LEADERBOARD_COLUMNS kind, best first.
+
+        guild_id restricts them to that guild's members. Raises on database errors.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_user_streak(self, user_id: int) -> tuple:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_streak(self, user_id: int) -> tuple:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_user_preference(self, user_id: int, default_persona: str = None, custom_settings: dict = None) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_preferences(self, user_id: int) -> tuple:
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self):
+        raise NotImplementedError
+
+def open_database() -> StorageBackend:
+    """Open the backend configured by DATABASE_URL, or the local SQLite file."""
+    if DATABASE_URL and DATABASE_URL.startswith(("postgres://", "postgresql://")):
+        from postgres_database import PostgresDatabase
+        return PostgresDatabase(DATABASE_URL)
+    return Database()
+
+class Database(StorageBackend):
+    """SQLite backend: one tuned connection shared by every thread."""
+
+    def __init__(self, db_path: str = DATABASE_PATH):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
         self.init_db()
 
     def init_db(self):
-        """Initialize the database with required tables."""
+        """Create or upgrade the schema; existing data is kept."""
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-
-                # Drop and recreate user_streaks table with proper schema
-                cursor.execute('''DROP TABLE IF EXISTS user_streaks''')
-                cursor.execute('''
-                    CREATE TABLE user_streaks (
-                        user_id INTEGER PRIMARY KEY,
-                        streak_count INTEGER DEFAULT 0,
-                        highest_streak INTEGER DEFAULT 0,
-                        last_use TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        unlocked_rewards TEXT DEFAULT '[]'
-                    )
-                ''')
-
-                # Drop and recreate user_preferences table with proper schema
-                cursor.execute('''DROP TABLE IF EXISTS user_preferences''')
-                cursor.execute('''
-                    CREATE TABLE user_preferences (
-                        user_id INTEGER PRIMARY KEY,
-                        default_persona TEXT,
-                        custom_settings TEXT DEFAULT '{}',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-                conn.commit()
-                logger.info("Database tables created successfully")
+                migrate(conn)
         except Exception as e:
-            logger.error(f"Database initialization failed: {e}")
+            logger.error("Database initialization failed: %s", e)
             raise
 
+    def _connect(self) -> sqlite3.Connection:
+        """Open the long-lived connection and apply the performance PRAGMAs."""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DATABASE_BUSY_TIMEOUT,
+            check_same_thread=False,  # Shared across threads, serialized by self._lock
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        # With WAL, NORMAL only fsyncs at checkpoints; a crash can lose the last commits but not corrupt the file
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DATABASE_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DATABASE_MMAP_BYTES}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        logger.info("Opened database %s (journal_mode=%s)", self.db_path, journal_mode)
+        return conn
+
     @contextmanager
     def get_connection(self):
-        """Context manager for database connections."""
-        conn = sqlite3.connect(self.db_path)
-        try:
-            yield conn
-        finally:
-            conn.close()
+        """Context manager yielding the shared connection, one caller at a time.
+
+        Uncommitted work is rolled back if the block raises.
+        """
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def close(self):
+        """Checkpoint the WAL and close the connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.execute("PRAGMA optimize")
+                self._conn.close()
+                self._conn = None
 
     def update_user_streak(self, user_id: int) -> tuple:
-        """Update user streak and return current streak and any new rewards."""
+        """Update user streak and return (streak, highest_streak, rewards_mask)."""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                current_time = datetime.now()
+                _, streak, highest_streak, rewards_mask, _ = self._advance_streak(cursor, user_id)
+                conn.commit()
+                return streak, highest_streak, rewards_mask
+
+        except Exception as e:
+            logger.error("Error updating user streak: %s", e)
+            return 0, 0, 0
 
-                # Get user's current streak info
+    def load_and_touch_user(self, user_id: int, guild_id: int = None) -> UserState:
+        """Read preferences, advance the streak and record guild membership in one transaction.
+
+        This is everything /smelty needs from the database for a question.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
                 cursor.execute('''
-                    SELECT streak_count, last_use, highest_streak, unlocked_rewards 
-                    FROM user_streaks 
+                    SELECT default_persona, custom_settings 
+                    FROM user_preferences 
                     WHERE user_id = ?
                 ''', (user_id,))
-                result = cursor.fetchone()
-
-                new_streak = 1
-                highest_streak = 1
-                unlocked_rewards = []
+                preferences = cursor.fetchone()
+                default_persona, settings = preferences if preferences else (None, '{}')
 
-                if result:
-                    streak_count, last_use, current_highest, rewards_json = result
-                    last_use = datetime.strptime(last_use, '%Y-%m-%d %H:%M:%S.%f')
-                    time_diff = current_time - last_use
-                    unlocked_rewards = json.loads(rewards_json)
-
-                    # If last use was within 24 hours, increment streak
-                    if time_diff <= timedelta(hours=24):
-                        new_streak = streak_count + 1
-                        highest_streak = max(new_streak, current_highest)
-
-                        # Check for new rewards
-                        new_rewards = self._check_rewards(new_streak, unlocked_rewards)
-                        if new_rewards:
-                            unlocked_rewards.extend(new_rewards)
-                    else:
-                        highest_streak = current_highest or 1
-
-                # Update streak in database
-                cursor.execute('''
-                    INSERT INTO user_streaks (
-                        user_id, streak_count, highest_streak, last_use, unlocked_rewards
-                    ) VALUES (?, ?, ?, ?, ?)
-                    ON CONFLICT(user_id) DO UPDATE SET 
-                        streak_count = excluded.streak_count,
-                        highest_streak = excluded.highest_streak,
-                        last_use = excluded.last_use,
-                        unlocked_rewards = excluded.unlocked_rewards
-                ''', (
-                    user_id, new_streak, highest_streak, current_time,
-                    json.dumps(unlocked_rewards)
-                ))
+                previous, streak, highest, rewards, new_rewards = self._advance_streak(cursor, user_id)
+                if guild_id is not None:
+                    cursor.execute(
+                        "INSERT OR IGNORE INTO guild_members (guild_id, user_id) VALUES (?, ?)",
+                        (guild_id, user_id)
+                    )
                 conn.commit()
 
-                return new_streak, highest_streak, unlocked_rewards
+                return UserState(
+                    default_persona=default_persona,
+                    custom_settings=json.loads(settings),
+                    previous_streak=previous,
+                    streak=streak,
+                    highest_streak=highest,
+                    rewards_mask=rewards,
+                    new_rewards_mask=new_rewards
+                )
 
         except Exception as e:
-            logger.error(f"Error updating user streak: {e}")
-            return 0, 0, []
-
-    def _check_rewards(self, streak: int, current_rewards: list) -> list:
-        """Check and return any new rewards based on streak count."""
-        new_rewards = []
-        reward_tiers = {
-            5: "meme_lord",      # Unlocks special meme responses
-            10: "dank_memer",    # Original dank_memer persona
-            25: "chaos_agent",   # Unlocks more chaotic responses
-            50: "elite_status",  # Special status and custom response formats
-            100: "legendary"     # Ultimate tier with all features
-        }
-
-        for tier, reward in reward_tiers.items():
-            if streak >= tier and reward not in current_rewards:
-                new_rewards.append(reward)
-                logger.info(f"New reward unlocked: {reward} at streak {streak}")
-
-        return new_rewards
+            logger.error("Error loading user %s: %s", user_id, e)
+            return UserState(None, {}, 0, 0, 0, 0, 0)
+
+    def _advance_streak(self, cursor: sqlite3.Cursor, user_id: int) -> tuple:
+        """Bump the streak inside the caller's transaction.
+
+        Returns (previous streak, new streak, highest streak, rewards mask, mask of rewards unlocked now).
+        """
+        current_time = datetime.now()
+
+        # Get user's current streak info
+        cursor.execute('''
+            SELECT streak_count, last_use, highest_streak, rewards_mask 
+            FROM user_streaks 
+            WHERE user_id = ?
+        ''', (user_id,))
+        result = cursor.fetchone()
+
+        previous_streak, current_highest, last_use, rewards_mask = 0, 0, None, 0
+        if result:
+            previous_streak, last_use, current_highest, rewards_mask = result
+            last_use = datetime.fromisoformat(last_use)
+
+        new_streak, highest_streak, new_rewards = advance_streak(
+            previous_streak, current_highest, last_use, rewards_mask, current_time
+        )
+        rewards_mask |= new_rewards
+
+        # Update streak in database
+        cursor.execute('''
+            INSERT INTO user_streaks (
+                user_id, streak_count, highest_streak, last_use, rewards_mask
+            ) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET 
+                streak_count = excluded.streak_count,
+                highest_streak = excluded.highest_streak,
+                last_use = excluded.last_use,
+                rewards_mask = excluded.rewards_mask
+        ''', (user_id, new_streak, highest_streak, current_time, rewards_mask))
+
+        return previous_streak, new_streak, highest_streak, rewards_mask, new_rewards
+
+    def load_user(self, user_id: int) -> tuple:
+        """Read a user's stored preferences and streak without changing them.
+
+        Returns (default_persona, custom_settings, streak, highest_streak, last_use, rewards_mask);
+        last_use is None for a user who has never asked anything. Raises on database errors.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT default_persona, custom_settings 
+                FROM user_preferences 
+                WHERE user_id = ?
+            ''', (user_id,))
+            preferences = cursor.fetchone()
+            cursor.execute('''
+                SELECT streak_count, highest_streak, last_use, rewards_mask 
+                FROM user_streaks 
+                WHERE user_id = ?
+            ''', (user_id,))
+            streak = cursor.fetchone()
+
+        default_persona, settings = preferences if preferences else (None, '{}')
+        if not streak:
+            return default_persona, json.loads(settings), 0, 0, None, 0
+        streak_count, highest, last_use, rewards_mask = streak
+        return default_persona, json.loads(settings), streak_count, highest, datetime.fromisoformat(last_use), rewards_mask
+
+    def save_streaks(self, rows: list, members: list = ()):
+        """Write many users' streaks, and any new guild memberships, in one transaction.
+
+        rows holds (user_id, streak, highest_streak, last_use, rewards_mask) tuples and
+        members (guild_id, user_id) pairs. Raises on database errors.
+        """
+        with self.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO user_streaks (
+                    user_id, streak_count, highest_streak, last_use, rewards_mask
+                ) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET 
+                    streak_count = excluded.streak_count,
+                    highest_streak = excluded.highest_streak,
+                    last_use = excluded.last_use,
+                    rewards_mask = excluded.rewards_mask
+            ''', rows)
+            conn.executemany(
+                "INSERT OR IGNORE INTO guild_members (guild_id, user_id) VALUES (?, ?)",
+                members
+            )
+            conn.commit()
+
+    def top_streaks(self, kind: str, limit: int, guild_id: int = None) -> list:
+        """Top (user_id, score, last_use) rows for the leaderboard; see StorageBackend.top_streaks."""
+        with self.get_connection() as conn:
+            rows = conn.execute(
+                top_streaks_query(kind, guild_id is not None),
+                top_streaks_params(kind, limit, guild_id)
+            ).fetchall()
+        return [(user_id, score, datetime.fromisoformat(last_use)) for user_id, score, last_use in rows]
 
     def get_user_streak(self, user_id: int) -> tuple:
         """Get current streak info for a user."""
@@ -137,20 +361,15 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    SELECT streak_count, highest_streak, unlocked_rewards 
+                    SELECT streak_count, highest_streak, rewards_mask 
                     FROM user_streaks 
                     WHERE user_id = ?
                 ''', (user_id,))
-                result = cursor.fetchone()
-
-                if result:
-                    streak, highest, rewards = result
-                    return streak, highest, json.loads(rewards)
-                return 0, 0, []
+                return cursor.fetchone() or (0, 0, 0)
 
         except Exception as e:
-            logger.error(f"Error getting user streak: {e}")
-            return 0, 0, []
+            logger.error("Error getting user streak: %s", e)
+            return 0, 0, 0
 
     def save_user_preference(self, user_id: int, default_persona: str = None, custom_settings: dict = None) -> bool:
         """Save user preferences."""
@@ -179,7 +398,7 @@ class Database:
                 return True
 
         except Exception as e:
-            logger.error(f"Error saving user preferences: {e}")
+            logger.error("Error saving user preferences: %s", e)
             return False
 
     def get_user_preferences(self, user_id: int) -> tuple:
@@ -200,5 +419,5 @@ class Database:
                 return None, {}
 
         except Exception as e:
-            logger.error(f"Error getting user preferences: {e}")
+            logger.error("Error getting user preferences: %s", e)
             return None, {}
\ No newline at end of file
@@ -0,0 +1,224 @@
+import logging
+import time
+from bisect import insort
+from collections import OrderedDict
+from datetime import datetime
+from config import LEADERBOARD_SIZE, LEADERBOARD_CACHE_TTL, LEADERBOARD_REFRESH, LEADERBOARD_GUILDS
+from async_database import AsyncDatabase
+from cache import SingleFlight
+from database import LEADERBOARD_COLUMNS, STREAK_WINDOW
+
+logger = logging.getLogger(__name__)
+
+MEDALS = ["🥇", "🥈", "🥉"]
+
+class TopK:
+    """The k best (member, score) pairs of a set, kept in order as scores change.
+
+    Built from the top k rows of a query. While exhaustive, the set had no
+    more than k members, so nobody off the board can outrank anyone on it.
+    When a score on a full board drops, someone off the board may now
+    belong on it; the board can't know who, so it marks itself stale.
+    """
+
+    def __init__(self, k: int, entries: list = ()):
+        self.k = k
+        self._scores = {}  # member -> score
+        self._order = []  # (-score, member), best first
+        for member, score in entries:
+            self._insert(member, score)
+        self.exhaustive = len(self._order) < k
+        self.stale = False
+
+    def _insert(self, member: int, score: int):
+        self._scores[member] = score
+        insort(self._order, (-score, member))
+
+    def update(self, member: int, score: int):
+        """Apply a member's new score; returns the member it pushed off the board, if any."""
+        old = self._scores.get(member)
+        if old is not None:
+            if score != old:
+                self._order.remove((-old, member))
+                self._insert(member, score)
+                if score < old and not self.exhaustive:
+                    self.stale = True
+            return None
+
+        if len(self._order) < self.k:
+            self._insert(member, score)
+            return None
+
+        self.exhaustive = False
+        if (-score, member) > self._order[-1]:
+            return None
+        self._insert(member, score)
+        _, evicted = self._order.pop()
+        del self._scores[evicted]
+        return evicted
+
+    def entries(self) -> list:
+        return [(member, -negated) for negated, member in self._order]
+
+    def __contains__(self, member: int) -> bool:
+        return member in self._scores
+
+    def __iter__(self):
+        return iter(self._scores)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+def render(entries: list, kind: str, guild_id: int = None) -> str:
+    """Format a board as a Discord message."""
+    scope = "this server" if guild_id is not None else "everywhere"
+    title = "🔥 **Top Current Streaks" if kind == "current" else "🏆 **Top Streaks of All Time"
+    lines = [f"{title} ({scope})**"]
+    if not entries:
+        lines.append("Nobody's on the board yet! Use `/smelty` to start a streak 🚀")
+    for rank, (user_id, score) in enumerate(entries):
+        place = MEDALS[rank] if rank < len(MEDALS) else f"`#{rank + 1}`"
+        lines.append(f"{place} <@{user_id}> — {score}")
+    return "\n".join(lines)
+
+class Leaderboard:
+    """Top streaks globally and per guild, kept in memory between reads.
+
+    A board is loaded once with an indexed query, then kept up to date by
+    record() on every streak change, so reading it costs no database work.
+    Boards are reloaded after `refresh` seconds, which also picks up other
+    processes' writes, and sooner once an update leaves a board unsure who
+    belongs on it or a current streak on it lapses. Rendered text is reused
+    for cache_ttl seconds, so a guild spamming the command costs nothing.
+
+    flush, if given, is awaited before loading so write-behind streaks are
+    in the database first.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        size: int = LEADERBOARD_SIZE,
+        cache_ttl: float = LEADERBOARD_CACHE_TTL,
+        refresh: float = LEADERBOARD_REFRESH,
+        max_guilds: int = LEADERBOARD_GUILDS,
+        flush=None
+    ):
+        self.db = db
+        self.size = size
+        self.cache_ttl = cache_ttl
+        self.refresh = refresh
+        self.max_boards = (max_guilds + 1) * len(LEADERBOARD_COLUMNS)
+        self.flush = flush
+        self._boards = OrderedDict()  # (guild_id or None, kind) -> (loaded_at, TopK); least recently read first
+        self._placed = {}  # user_id -> keys of the boards they are on
+        self._last_use = {}  # user_id -> last use, for users on a board
+        self._rendered = OrderedDict()  # (guild_id or None, kind) -> (expires_at, text)
+        self._loads = SingleFlight()
+        self.loads = 0
+        self.renders = 0
+        self.render_hits = 0
+
+    def record(self, user_id: int, guild_id: int, streak: int, highest_streak: int, last_use: datetime):
+        """Apply a user's new streak to every loaded board they are on or now qualify for."""
+        scores = {"current": streak, "highest": highest_streak}
+        keys = set(self._placed.get(user_id, ()))
+        for kind in LEADERBOARD_COLUMNS:
+            keys.add((None, kind))
+            if guild_id is not None:
+                keys.add((guild_id, kind))
+
+        for key in keys:
+            loaded = self._boards.get(key)
+            if loaded is None:
+                continue
+            board = loaded[1]
+            evicted = board.update(user_id, scores[key[1]])
+            if user_id in board:
+                self._placed.setdefault(user_id, set()).add(key)
+            if evicted is not None:
+                self._unplace(evicted, key)
+        if user_id in self._placed:
+            self._last_use[user_id] = last_use
+
+    def _unplace(self, user_id: int, key: tuple):
+        keys = self._placed.get(user_id)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self._placed[user_id]
+            self._last_use.pop(user_id, None)
+
+    def _drop(self, key: tuple):
+        _, board = self._boards.pop(key)
+        for user_id in board:
+            self._unplace(user_id, key)
+
+    def _needs_load(self, key: tuple) -> bool:
+        loaded = self._boards.get(key)
+        if loaded is None:
+            return True
+        loaded_at, board = loaded
+        if board.stale or time.monotonic() - loaded_at > self.refresh:
+            return True
+        if key[1] == "current":
+            cutoff = datetime.now() - STREAK_WINDOW
+            return any(self._last_use.get(user_id, cutoff) < cutoff for user_id in board)
+        return False
+
+    async def _load(self, key: tuple) -> TopK:
+        guild_id, kind = key
+        if self.flush is not None:
+            await self.flush()
+        rows = await self.db.top_streaks(kind, self.size, guild_id)
+        self.loads += 1
+
+        if key in self._boards:
+            self._drop(key)
+        board = TopK(self.size, [(user_id, score) for user_id, score, _ in rows])
+        self._boards[key] = (time.monotonic(), board)
+        for user_id, _, last_use in rows:
+            self._placed.setdefault(user_id, set()).add(key)
+            known = self._last_use.get(user_id)
+            if known is None or last_use > known:  # record() may already have a newer one
+                self._last_use[user_id] = last_use
+
+        while len(self._boards) > self.max_boards:
+            self._drop(next(iter(self._boards)))
+        logger.debug("Loaded %s leaderboard for %s (%s users)", kind, guild_id or 'all guilds', len(rows))
+        return board
+
+    async def top(self, kind: str, guild_id: int = None) -> list:
+        """Return the board's (user_id, score) pairs, best first."""
+        key = (guild_id, kind)
+        if self._needs_load(key):
+            board = await self._loads.do(key, lambda: self._load(key))
+        else:
+            board = self._boards[key][1]
+            self._boards.move_to_end(key)
+        return board.entries()
+
+    async def text(self, kind: str, guild_id: int = None) -> str:
+        """The rendered board, reused for cache_ttl seconds."""
+        key = (guild_id, kind)
+        cached = self._rendered.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.render_hits += 1
+            return cached[1]
+
+        text = render(await self.top(kind, guild_id), kind, guild_id)
+        self.renders += 1
+        self._rendered[key] = (time.monotonic() + self.cache_ttl, text)
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.max_boards:
+            self._rendered.popitem(last=False)
+        return text
+
+    def stats(self) -> dict:
+        return {
+            "boards": len(self._boards),
+            "loads": self.loads,
+            "renders": self.renders,
+            "render_hits": self.render_hits
+        }
@@ -0,0 +1,460 @@
+import logging
+import asyncio
+import json
+import aiohttp
+from collections import deque
+from functools import lru_cache
+from yarl import URL
+from circuit_breaker import CircuitBreaker
+from config import (
+    DEFAULT_MAX_TOKENS,
+    HUGGINGFACE_API_URL,
+    HUGGINGFACE_TOKEN,
+    DEEPSEEK_API_KEY,
+    DEEPSEEK_API_URL,
+    REQUEST_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_WARMUP_CONNECTIONS
+)
+from metrics import LLM_COMPLETION_TOKENS, LLM_PROMPT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Sampling settings shared by every provider; also part of the response cache key.
+# max_tokens is the default answer budget; callers may pass their own.
+GENERATION_PARAMS = {
+    "max_tokens": DEFAULT_MAX_TOKENS,
+    "temperature": 0.7,
+    "top_p": 0.9
+}
+
+DEEPSEEK_MODEL = "deepseek-chat"
+
+@lru_cache(maxsize=256)
+def _chat_prefix(system_message: str) -> bytes:
+    """A DeepSeek request body up to the question, serialized once per system prompt.
+
+    The system prompt goes first and always serializes to the same bytes,
+    so the provider's prefix cache recognizes it across requests.
+    """
+    return (
+        '{"model":' + json.dumps(DEEPSEEK_MODEL) +
+        ',"messages":[{"role":"system","content":' + json.dumps(system_message) +
+        '},{"role":"user","content":'
+    ).encode()
+
+def generation_params(max_tokens: int = None) -> dict:
+    """GENERATION_PARAMS with the answer budget set to max_tokens, if given."""
+    if max_tokens is None:
+        return GENERATION_PARAMS
+    return {**GENERATION_PARAMS, "max_tokens": max_tokens}
+
+@lru_cache(maxsize=64)
+def _chat_suffix(stream: bool, max_tokens: int = None) -> bytes:
+    """Everything after the question: the generation settings."""
+    params = {**generation_params(max_tokens), "stream": stream}
+    if stream:
+        params["stream_options"] = {"include_usage": True}  # Usage arrives in a final event
+    return ("}]," + json.dumps(params, separators=(",", ":"))[1:]).encode()
+
+def chat_body(system_message: str, user_message: str, stream: bool = False, max_tokens: int = None) -> bytes:
+    """The JSON body of a DeepSeek chat completion request."""
+    return _chat_prefix(system_message) + json.dumps(user_message).encode() + _chat_suffix(stream, max_tokens)
+
+class ProviderError(Exception):
+    """An upstream provider failed to produce a completion."""
+
+class ProviderRateLimited(ProviderError):
+    """The provider answered 429 Too Many Requests."""
+
+class ProviderTimeout(ProviderError):
+    """The provider did not answer within the request timeout."""
+
+class PoolStats:
+    """Connection pool counters for one provider, fed by aiohttp request tracing."""
+
+    def __init__(self):
+        self.created = 0
+        self.reused = 0
+        self.queued = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def reuse_ratio(self) -> float:
+        """Fraction of requests served on an already open connection."""
+        total = self.created + self.reused
+        return self.reused / total if total else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "reuse_ratio": round(self.reuse_ratio, 3),
+            "queued": self.queued,
+            "avg_wait": round(self.wait_time / self.queued, 4) if self.queued else 0.0,
+            "max_wait": round(self.max_wait, 4)
+        }
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Build a TraceConfig that records connection reuse and pool wait time."""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_queued_start(session, ctx, params):
+            ctx.queued_at = asyncio.get_running_loop().time()
+
+        async def on_queued_end(session, ctx, params):
+            waited = asyncio.get_running_loop().time() - ctx.queued_at
+            self.queued += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        async def on_create_end(session, ctx, params):
+            self.created += 1
+
+        async def on_reuse(session, ctx, params):
+            self.reused += 1
+
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        trace_config.on_connection_create_end.append(on_create_end)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        return trace_config
+
+class TokenUsage:
+    """Tokens billed by one provider, from the usage block of its responses."""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.cache_hit = 0  # Prompt tokens the provider's prefix cache already had
+        self.cache_miss = 0
+        self.completion = 0
+
+    def record(self, usage: dict):
+        if not usage:
+            return
+        hit = usage.get("prompt_cache_hit_tokens")
+        miss = usage.get("prompt_cache_miss_tokens")
+        if hit is None and miss is None:  # The provider doesn't report caching
+            miss = usage.get("prompt_tokens")
+        hit, miss, completion = hit or 0, miss or 0, usage.get("completion_tokens") or 0
+        self.cache_hit += hit
+        self.cache_miss += miss
+        self.completion += completion
+        LLM_PROMPT_TOKENS.inc(self.provider, "hit", amount=hit)
+        LLM_PROMPT_TOKENS.inc(self.provider, "miss", amount=miss)
+        LLM_COMPLETION_TOKENS.inc(self.provider, amount=completion)
+
+    def as_dict(self) -> dict:
+        prompt = self.cache_hit + self.cache_miss
+        return {
+            "prompt_cache_hit": self.cache_hit,
+            "prompt_cache_miss": self.cache_miss,
+            "prompt_cache_hit_ratio": round(self.cache_hit / prompt, 3) if prompt else 0.0,
+            "completion": self.completion
+        }
+
+class LatencyTracker:
+    """Rolling window of recent successful call latencies for one provider."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.wins = 0  # hedged races this provider answered first
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> float:
+        """Latency at the given percentile, or None until enough samples are in."""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def as_dict(self) -> dict:
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        return {
+            "samples": len(self.samples),
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p95": round(p95, 3) if p95 is not None else None,
+            "wins": self.wins
+        }
+
+class ProviderPool:
+    """Long-lived keep-alive HTTP session for a single upstream provider."""
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        timeout: float = REQUEST_TIMEOUT,
+        pool_size: int = HTTP_POOL_SIZE,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT
+    ):
+        self.name = name
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.stats = PoolStats()
+        self.latency = LatencyTracker()
+        self.tokens = TokenUsage(name)
+        self.breaker = CircuitBreaker(name)
+        self._session = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the pooled session, creating it on the running loop if needed."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                trace_configs=[self.stats.trace_config()]
+            )
+        return self._session
+
+    async def warm_up(self, connections: int = HTTP_WARMUP_CONNECTIONS):
+        """Open keep-alive connections ahead of the first real request."""
+        session = await self.get_session()
+        origin = str(URL(self.url).origin())
+
+        async def touch():
+            async with session.head(origin, allow_redirects=False) as response:
+                await response.read()
+
+        results = await asyncio.gather(*(touch() for _ in range(connections)), return_exceptions=True)
+        failures = [r for r in results if isinstance(r, Exception)]
+        if failures:
+            logger.warning("%s warm-up: %s/%s connections failed (%r)", self.name, len(failures), connections, failures[0])
+        else:
+            logger.info("%s warm-up: opened %s connections to %s", self.name, connections, origin)
+
+    async def close(self):
+        """Close the pooled session and its connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+class LLMClient:
+    """Async client for the DeepSeek and HuggingFace completion APIs."""
+
+    def __init__(
+        self,
+        deepseek_url: str = DEEPSEEK_API_URL,
+        deepseek_key: str = DEEPSEEK_API_KEY,
+        huggingface_url: str = HUGGINGFACE_API_URL,
+        huggingface_token: str = HUGGINGFACE_TOKEN,
+        timeout: float = REQUEST_TIMEOUT,
+        pool_size: int = HTTP_POOL_SIZE
+    ):
+        self.deepseek_key = deepseek_key
+        self.huggingface_token = huggingface_token
+        self._deepseek_headers = {
+            "Authorization": f"Bearer {deepseek_key}",
+            "Content-Type": "application/json"
+        }
+        self._deepseek_stream_headers = {**self._deepseek_headers, "Accept": "text/event-stream"}
+        self.deepseek = ProviderPool("deepseek", deepseek_url, timeout, pool_size)
+        self.huggingface = ProviderPool("huggingface", huggingface_url, timeout, pool_size)
+
+        # While a circuit is open, these tiny requests decide when to try live traffic again
+        self.deepseek.breaker.probe = lambda: self.call_deepseek("Reply with OK.", "ping")
+        self.huggingface.breaker.probe = lambda: self.call_huggingface("Reply with OK.", "ping")
+
+    @property
+    def providers(self) -> list:
+        """Provider pools that have credentials configured."""
+        pools = []
+        if self.deepseek_key:
+            pools.append(self.deepseek)
+        if self.huggingface_token:
+            pools.append(self.huggingface)
+        return pools
+
+    async def warm_up(self):
+        """Pre-open connections to every configured provider."""
+        await asyncio.gather(*(pool.warm_up() for pool in self.providers))
+
+    def pool_stats(self) -> dict:
+        """Connection reuse and pool wait statistics per provider."""
+        return {pool.name: pool.stats.as_dict() for pool in (self.deepseek, self.huggingface)}
+
+    def latency_stats(self) -> dict:
+        """Recent latency percentiles and hedge wins per provider."""
+        return {pool.name: pool.latency.as_dict() for pool in (self.deepseek, self.huggingface)}
+
+    def health_stats(self) -> dict:
+        """Circuit breaker state and health score per provider."""
+        return {pool.name: pool.breaker.as_dict() for pool in (self.deepseek, self.huggingface)}
+
+    def token_stats(self) -> dict:
+        """Tokens billed per provider, including prompt tokens served from its prefix cache."""
+        return {pool.name: pool.tokens.as_dict() for pool in (self.deepseek, self.huggingface)}
+
+    async def close(self):
+        """Close every provider session."""
+        logger.info(
+            "Closing LLM client, pool stats: %s, latency: %s, tokens: %s",
+            self.pool_stats(), self.latency_stats(), self.token_stats()
+        )
+        self.deepseek.breaker.close()
+        self.huggingface.breaker.close()
+        await self.deepseek.close()
+        await self.huggingface.close()
+
+    async def call_deepseek(self, system_message: str, user_message: str, max_tokens: int = None) -> str:
+        """Call the DeepSeek API with enhanced error handling and detailed logging."""
+        try:
+            body = chat_body(system_message, user_message, max_tokens=max_tokens)
+            logger.debug("Making request to DeepSeek API: %s (%s bytes)", self.deepseek.url, len(body))
+
+            session = await self.deepseek.get_session()
+            async with session.post(self.deepseek.url, headers=self._deepseek_headers, data=body) as response:
+                logger.debug("DeepSeek API Response Status: %s", response.status)
+                logger.debug("Response Headers: %s", response.headers)
+
+                if response.status == 429:
+                    logger.warning("DeepSeek API rate limit hit")
+                    raise ProviderRateLimited("DeepSeek API rate limit hit")
+
+                if response.status == 401:
+                    logger.error("DeepSeek API authentication failed")
+                    raise ProviderError("DeepSeek API authentication failed")
+
+                if response.status == 400:
+                    logger.error("DeepSeek API bad request: %s", await response.text())
+                    raise ProviderError("DeepSeek API bad request")
+
+                if response.status != 200:
+                    body = await response.read()
+                    error_content = body.decode(errors="replace") if body else "No error content"
+                    logger.error("DeepSeek API error: Status %s, Content: %s", response.status, error_content)
+                    raise ProviderError(f"DeepSeek API error: Status {response.status}")
+
+                result = await response.json()
+
+            logger.debug("Successfully received DeepSeek API response")
+            self.deepseek.tokens.record(result.get("usage"))
+
+            try:
+                return result['choices'][0]['message']['content'].strip()
+            except (KeyError, IndexError, TypeError) as e:
+                logger.error("Unexpected API response format: %s", e)
+                logger.debug("API Response: %s", result)
+                raise ProviderError("Unexpected DeepSeek API response format") from e
+
+        except asyncio.TimeoutError as e:
+            logger.error("DeepSeek API timeout")
+            raise ProviderTimeout("DeepSeek API timeout") from e
+
+        except aiohttp.ClientError as e:
+            logger.error("Network error calling DeepSeek API: %s", e)
+            raise ProviderError(f"Network error calling DeepSeek API: {e}") from e
+
+    async def stream_deepseek(self, system_message: str, user_message: str, max_tokens: int = None):
+        """Stream a DeepSeek completion, yielding content chunks as they arrive.
+
+        Raises a ProviderError if the request fails, including part-way
+        through the stream.
+        """
+        body = chat_body(system_message, user_message, stream=True, max_tokens=max_tokens)
+
+        # The whole stream may outlive REQUEST_TIMEOUT, so only bound the gap between reads
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.deepseek.timeout.total)
+
+        try:
+            session = await self.deepseek.get_session()
+            async with session.post(self.deepseek.url, headers=self._deepseek_stream_headers, data=body, timeout=timeout) as response:
+                if response.status == 429:
+                    logger.warning("DeepSeek API rate limit hit")
+                    raise ProviderRateLimited("DeepSeek API rate limit hit")
+
+                if response.status != 200:
+                    logger.error("DeepSeek streaming error: Status %s, Content: %s", response.status, await response.text())
+                    raise ProviderError(f"DeepSeek streaming error: Status {response.status}")
+
+                async for line in response.content:
+                    line = line.strip()
+                    if not line.startswith(b"data:"):
+                        continue
+
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+
+                    try:
+                        event = json.loads(data)
+                        self.deepseek.tokens.record(event.get("usage"))
+                        if not event['choices']:  # The final usage-only event
+                            continue
+                        chunk = event['choices'][0]['delta'].get('content')
+                    except (ValueError, KeyError, IndexError, AttributeError) as e:
+                        logger.warning("Skipping malformed DeepSeek stream event: %s", e)
+                        continue
+
+                    if chunk:
+                        yield chunk
+
+        except asyncio.TimeoutError as e:
+            logger.error("DeepSeek stream timed out")
+            raise ProviderTimeout("DeepSeek stream timed out") from e
+
+        except aiohttp.ClientError as e:
+            logger.error("Network error streaming from DeepSeek API: %s", e)
+            raise ProviderError(f"Network error streaming from DeepSeek API: {e}") from e
+
+    async def call_huggingface(self, system_message: str, user_message: str, max_tokens: int = None) -> str:
+        """Call the HuggingFace API as fallback with improved error handling."""
+        try:
+            headers = {"Authorization": f"Bearer {self.huggingface_token}"}
+
+            payload = {
+                "inputs": f"<|system|>{system_message}</s><|user|>{user_message}</s><|assistant|>",
+                "parameters": {
+                    "max_new_tokens": max_tokens or GENERATION_PARAMS["max_tokens"],
+                    "temperature": GENERATION_PARAMS["temperature"],
+                    "top_p": GENERATION_PARAMS["top_p"],
+                    "do_sample": True
+                }
+            }
+
+            logger.debug("Making HuggingFace API request")
+
+            session = await self.huggingface.get_session()
+            async with session.post(self.huggingface.url, headers=headers, json=payload) as response:
+                if response.status == 429:
+                    logger.warning("HuggingFace API rate limit hit")
+                    raise ProviderRateLimited("HuggingFace API rate limit hit")
+
+                if response.status != 200:
+                    logger.error("HuggingFace API error: Status %s", response.status)
+                    logger.debug("Error response: %s", await response.text())
+                    raise ProviderError(f"HuggingFace API error: Status {response.status}")
+
+                result = await response.json()
+
+            try:
+                generated_text = result[0]['generated_text']
+            except (KeyError, IndexError, TypeError) as e:
+                logger.error("Unexpected HuggingFace response format: %s", e)
+                raise ProviderError("Unexpected HuggingFace API response format") from e
+
+            # Extract only the assistant's response
+            assistant_response = generated_text.split("<|assistant|>")[-1].strip()
+            return assistant_response
+
+        except asyncio.TimeoutError as e:
+            logger.error("HuggingFace API timeout")
+            raise ProviderTimeout("HuggingFace API timeout") from e
+
+        except aiohttp.ClientError as e:
+            logger.error("Network error calling HuggingFace API: %s", e)
+            raise ProviderError(f"Network error calling HuggingFace API: {e}") from e
@@ -0,0 +1,433 @@
+"""Offline load test: the bot's command handlers against a fake LLM server.
+
+Usage: python loadtest.py [--users N] [--requests N] [--latency S] [--error-rate R] ...
+
+Each simulated user runs /smelty, /help and /prefs back to back through
+mock interactions, using the handlers, user state, database, scheduler,
+cache and provider clients the bot really runs. Only Discord and the LLM
+providers are replaced: mock interactions stand in for Discord and can add
+latency to each API call, and FakeLLMServer is an OpenAI-compatible HTTP
+server on localhost with configurable latency, 500s and 429s.
+
+Reports throughput and p50/p95/p99 latency per command. Latency is the time
+until the handler returns; "ack" is the time until Discord would have seen
+the first response or defer. Per-user and provider rate limits are lifted
+unless --rate-limits is given, so they don't cap the measurement.
+--max-p95 makes the run fail when /smelty is slower than that, to catch
+regressions before a deploy.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from aiohttp import web
+import bot
+import utils
+from cache import ResponseCache
+from database import Database
+from llm_client import LLMClient
+from logs import setup_logging
+from personas import PERSONAS
+from rate_limit import DEFAULT_LIMITS, RateLimiter
+
+# Share of interactions per command
+COMMAND_MIX = {"smelty": 0.8, "help": 0.1, "prefs": 0.1}
+
+QUESTIONS = [
+    "Should I quit my job to build an AI startup?",
+    "What's the best pizza topping?",
+    "Explain quantum computing to a cat.",
+    "Is it worth learning Rust in 2025?",
+    "Write a haiku about Mondays."
+]
+
+# Text that marks a reply as a failure rather than an answer
+FAILURE_MARKERS = (
+    utils.ALL_PROVIDERS_FAILED_MESSAGE,
+    utils.PROVIDERS_BUSY_MESSAGE,
+    utils.PROVIDERS_RATE_LIMITED_MESSAGE,
+    utils.PROVIDERS_TIMEOUT_MESSAGE,
+    "Rate limit reached",
+    "Oops!",
+    "Something went sideways",
+    "I'm swamped",
+    "your question timed out",
+    "❌"
+)
+
+class FakeLLMServer:
+    """OpenAI-compatible stand-in for DeepSeek, plus HuggingFace's inference API, on localhost.
+
+    Each completion waits latency ± jitter seconds. error_rate of them answer
+    500 and rate_limit_rate answer 429. Streamed answers send their words in
+    `chunks` events, chunk_interval seconds apart.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.05,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        chunks: int = 8,
+        chunk_interval: float = 0.01,
+        seed: int = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.chunks = chunks
+        self.chunk_interval = chunk_interval
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.streamed = 0
+        self._seen_prompts = set()
+        self.last_request = None  # Body of the most recent completion request
+        self.url = None
+        self._runner = None
+
+    async def start(self) -> str:
+        """Listen on a free port; returns the base URL."""
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat)
+        app.router.add_post("/huggingface", self._huggingface)
+        app.router.add_route("HEAD", "/", self._head)  # Connection warm-up
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited, "streamed": self.streamed}
+
+    async def _head(self, request):
+        return web.Response()
+
+    async def _respond_or_fail(self):
+        """Wait out the simulated latency; returns an error response to send instead, if any."""
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            self.rate_limited += 1
+            return web.json_response({"error": {"message": "Rate limit reached"}}, status=429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"message": "Internal error"}}, status=500)
+        return None
+
+    def _answer(self, question: str) -> list:
+        words = f"Here is a very fake answer to: {question}".split()
+        size = max(1, -(-len(words) // self.chunks))
+        return [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+
+    def _usage(self, system: str, question: str, parts: list) -> dict:
+        """A DeepSeek-style usage block; a system prompt seen before counts as cached."""
+        system_tokens, question_tokens = len(system) // 4 + 1, len(question) // 4 + 1
+        hit = system_tokens if system in self._seen_prompts else 0
+        self._seen_prompts.add(system)
+        completion = sum(len(part) for part in parts) // 4 + 1
+        return {
+            "prompt_tokens": system_tokens + question_tokens,
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": system_tokens + question_tokens - hit,
+            "completion_tokens": completion,
+            "total_tokens": system_tokens + question_tokens + completion
+        }
+
+    async def _chat(self, request):
+        body = self.last_request = await request.json()
+        failure = await self._respond_or_fail()
+        if failure is not None:
+            return failure
+        system, question = body["messages"][0]["content"], body["messages"][-1]["content"]
+        parts = self._answer(question)
+        usage = self._usage(system, question, parts)
+
+        if not body.get("stream"):
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": "".join(parts)}}],
+                "usage": usage
+            })
+
+        self.streamed += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i, part in enumerate(parts):
+            if i:
+                await asyncio.sleep(self.chunk_interval)
+            event = {"choices": [{"delta": {"content": part}}]}
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+        if body.get("stream_options", {}).get("include_usage"):
+            await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _huggingface(self, request):
+        body = self.last_request = await request.json()
+        failure = await self._respond_or_fail()
+        if failure is not None:
+            return failure
+        question = body["inputs"].split("<|user|>")[-1].split("</s>")[0]
+        return web.json_response([{"generated_text": body["inputs"] + "".join(self._answer(question))}])
+
+class MockMessage:
+    """A sent followup message that can be edited."""
+
+    def __init__(self, interaction, content: str):
+        self.interaction = interaction
+        self.content = content
+
+    async def edit(self, content: str = None, **kwargs):
+        await self.interaction._call_discord()
+        self.content = content
+        self.interaction.messages.append(content)
+
+class MockResponse:
+    """interaction.response: the first reply, which must come within Discord's 3 seconds."""
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _acknowledge(self):
+        await self.interaction._call_discord()
+        self._done = True
+        self.interaction.acked_at = time.perf_counter()
+
+    async def send_message(self, content: str = None, **kwargs):
+        await self._acknowledge()
+        self.interaction.messages.append(content)
+
+    async def defer(self, **kwargs):
+        await self._acknowledge()
+
+class MockFollowup:
+    """interaction.followup: messages sent after the first reply."""
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content: str = None, wait: bool = False, **kwargs):
+        await self.interaction._call_discord()
+        self.interaction.messages.append(content)
+        return MockMessage(self.interaction, content)
+
+class MockInteraction:
+    """Enough of discord.Interaction for the slash command handlers.
+
+    Every Discord API call sleeps discord_latency seconds. messages records
+    the content of each send and edit, in order.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id: int, guild_id: int = None, discord_latency: float = 0.0):
+        self.id = next(self._ids)
+        self.user = SimpleNamespace(id=user_id, name=f"load_user_{user_id}", display_name=f"Load User {user_id}")
+        self.guild_id = guild_id
+        self.discord_latency = discord_latency
+        self.response = MockResponse(self)
+        self.followup = MockFollowup(self)
+        self.messages = []
+        self.acked_at = None
+        self.original_deleted = False
+
+    async def _call_discord(self):
+        if self.discord_latency:
+            await asyncio.sleep(self.discord_latency)
+
+    async def edit_original_response(self, content: str = None, **kwargs):
+        await self._call_discord()
+        self.messages.append(content)
+
+    async def delete_original_response(self):
+        await self._call_discord()
+        self.original_deleted = True
+
+    @property
+    def failed(self) -> bool:
+        """Whether the last thing the user saw was an error rather than an answer."""
+        if not self.messages or self.acked_at is None:
+            return True
+        last = self.messages[-1] or ""
+        return any(marker in last for marker in FAILURE_MARKERS)
+
+def percentile(ordered: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(len(ordered) * pct / 100) - 1)]
+
+def summarize(results: list, elapsed: float) -> dict:
+    """Per-command counts, failures and latency percentiles (ms) from (command, latency, ack, failed) tuples."""
+    report = {"elapsed": elapsed, "total": len(results), "throughput": len(results) / elapsed if elapsed else 0.0, "commands": {}}
+    for command in COMMAND_MIX:
+        rows = [r for r in results if r[0] == command]
+        if not rows:
+            continue
+        latencies = sorted(r[1] * 1000 for r in rows)
+        acks = sorted(r[2] * 1000 for r in rows if r[2] is not None)
+        report["commands"][command] = {
+            "count": len(rows),
+            "failed": sum(1 for r in rows if r[3]),
+            **{f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+            "ack_p95": percentile(acks, 95)
+        }
+    return report
+
+async def run_command(command: str, interaction: MockInteraction, rng: random.Random, next_question):
+    if command == "smelty":
+        await bot.smelty.callback(interaction, question=next_question(rng), mode=rng.choice(list(PERSONAS)))
+    elif command == "help":
+        await bot.help_command.callback(interaction)
+    elif rng.random() < 0.5:
+        await bot.preferences.callback(interaction)
+    else:
+        await bot.preferences.callback(interaction, response_style=rng.choice(["normal", "fancy", "minimal"]))
+
+async def user_session(user_id: int, options, rng: random.Random, next_question, results: list):
+    """One simulated user: options.requests commands, each starting when the last one is answered."""
+    guild_id = user_id % options.guilds + 1 if options.guilds else None
+    commands, weights = zip(*COMMAND_MIX.items())
+    for _ in range(options.requests):
+        command = rng.choices(commands, weights)[0]
+        interaction = MockInteraction(user_id, guild_id, options.discord_latency)
+        start = time.perf_counter()
+        await run_command(command, interaction, rng, next_question)
+        ack = interaction.acked_at - start if interaction.acked_at is not None else None
+        results.append((command, time.perf_counter() - start, ack, interaction.failed))
+        if options.think:
+            await asyncio.sleep(rng.uniform(0, 2 * options.think))
+
+def question_source(distinct: int):
+    """Returns next_question(rng): one of `distinct` questions, or with 0 a new one each time so none hit the cache."""
+    if distinct:
+        pool = [f"{QUESTIONS[i % len(QUESTIONS)]} (#{i})" for i in range(distinct)]
+        return lambda rng: rng.choice(pool)
+    numbers = itertools.count()
+    return lambda rng: f"{rng.choice(QUESTIONS)} (#{next(numbers)})"
+
+@asynccontextmanager
+async def offline_bot(server: FakeLLMServer, rate_limits: bool = False):
+    """Point the bot at a started FakeLLMServer with a temporary database; yields the LLM client.
+
+    The provider client, rate limiter and response cache are fresh for the
+    run and put back afterwards. Unless rate_limits is True, the limiter
+    lets everything through.
+    """
+    client = LLMClient(
+        deepseek_url=f"{server.url}/v1/chat/completions",
+        deepseek_key="sk-load",
+        huggingface_url=f"{server.url}/huggingface",
+        huggingface_token="hf-load"
+    )
+    if rate_limits:
+        limiter = RateLimiter()
+    else:
+        limiter = RateLimiter({scope: (float("inf"), float("inf")) for scope in DEFAULT_LIMITS})
+    saved = utils.llm_client, utils.rate_limiter, utils.response_cache
+    utils.llm_client, utils.rate_limiter, utils.response_cache = client, limiter, ResponseCache()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.init_storage(Database(os.path.join(tmp, "load.db")))
+        bot.user_states.start()
+        try:
+            yield client
+        finally:
+            await bot.close_storage()
+            await client.close()
+            utils.llm_client, utils.rate_limiter, utils.response_cache = saved
+
+async def run_load(options) -> dict:
+    """Start a fake LLM server, point the bot at it and run the simulated users; returns summarize()'s report."""
+    server = FakeLLMServer(
+        options.latency, options.jitter, options.error_rate, options.rate_limit_rate,
+        chunk_interval=options.chunk_interval, seed=options.seed
+    )
+    await server.start()
+    rng = random.Random(options.seed)
+    next_question = question_source(options.distinct_questions)
+    results = []
+    try:
+        async with offline_bot(server, options.rate_limits) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                user_session(user_id, options, random.Random(rng.random()), next_question, results)
+                for user_id in range(1, options.users + 1)
+            ))
+            elapsed = time.perf_counter() - start
+    finally:
+        await server.stop()
+
+    report = summarize(results, elapsed)
+    report["server"] = server.stats()
+    report["tokens"] = client.token_stats()["deepseek"]
+    return report
+
+def print_report(report: dict, options):
+    print(f"{options.users} users x {options.requests} commands, upstream latency {options.latency * 1000:.0f}ms")
+    print(f"  {report['total']} commands in {report['elapsed']:.2f}s: {report['throughput']:.1f}/sec")
+    print(f"  {'command':<8} {'count':>6} {'failed':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'ack p95':>9}")
+    for command, row in report["commands"].items():
+        print(
+            f"  {command:<8} {row['count']:6d} {row['failed']:6d} "
+            f"{row['p50']:7.1f}ms {row['p95']:7.1f}ms {row['p99']:7.1f}ms {row['ack_p95']:7.1f}ms"
+        )
+    print(f"  fake LLM server: {report['server']}")
+    print(f"  DeepSeek tokens: {report['tokens']}")
+
+def parse_args(argv: list = None):
+    parser = argparse.ArgumentParser(description="Offline load test of the bot's command handlers")
+    parser.add_argument("--users", type=int, default=50, help="concurrent simulated users")
+    parser.add_argument("--requests", type=int, default=10, help="commands per user")
+    parser.add_argument("--guilds", type=int, default=5, help="guilds the users are spread over (0: DMs)")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds a user waits between commands")
+    parser.add_argument("--latency", type=float, default=0.2, help="mean upstream seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.05, help="standard deviation of upstream latency")
+    parser.add_argument("--chunk-interval", type=float, default=0.01, help="seconds between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls answering 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of upstream calls answering 429")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="seconds per mock Discord API call")
+    parser.add_argument("--distinct-questions", type=int, default=0, help="questions to draw from (0: all unique)")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the configured user/guild/provider limits")
+    parser.add_argument("--max-p95", type=float, default=None, help="fail if /smelty p95 exceeds this many ms")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+def main():
+    options = parse_args()
+    setup_logging("WARNING")
+    report = asyncio.run(run_load(options))
+    print_report(report, options)
+
+    smelty = report["commands"].get("smelty")
+    if options.max_p95 is not None and smelty and smelty["p95"] > options.max_p95:
+        print(f"/smelty p95 {smelty['p95']:.1f}ms is over the {options.max_p95:.0f}ms limit")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
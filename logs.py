@@ -0,0 +1,103 @@
+"""Logging setup: a queue in front of a background writer thread.
+
+Every module logs through its own logging.getLogger(__name__), so levels can
+be set per module. Callers only pay for the level check and for putting the
+record on a queue. Messages use %-style arguments, and the writer thread
+formats them, adds exception text and writes the output as text or as JSON
+lines. Unless LOG_DEBUG_SAMPLE_RATE is 1, only that share of DEBUG records
+is kept, so debug logging can stay on in production.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class DebugSampler(logging.Filter):
+    """Passes records above DEBUG, and DEBUG ones with probability rate."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats the message before enqueueing it. This one
+    enqueues the record as it is, so callers don't pay for formatting. Log
+    arguments should therefore not be changed after the call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def parse_levels(spec: str) -> dict:
+    """Parse "module=LEVEL,other=LEVEL" into {logger name: level}."""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+_listener = None
+
+def setup_logging(level: str = "INFO", module_levels: str = "", fmt: str = "text", debug_sample_rate: float = 1.0, stream=None):
+    """Route all logging through a queue to a writer thread; safe to call again to reconfigure."""
+    global _listener
+    stop_logging()
+    # No output uses them, and every record would pay to look them up
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    if debug_sample_rate < 1:
+        handler.addFilter(DebugSampler(debug_sample_rate))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, module_level in parse_levels(module_levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+def stop_logging():
+    """Write out queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
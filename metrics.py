@@ -0,0 +1,184 @@
+"""Process-wide metrics, rendered in the Prometheus text format for /metrics.
+
+Counters and histograms keep a separate shard per thread, so recording a
+value is a thread-local lookup and an unlocked add; shards are only summed
+when the endpoint is scraped. Gauges read their value from a callback at
+scrape time and cost nothing in between.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, from a cache hit to a slow completion
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Sharded:
+    """Base for metrics whose values live in per-thread dicts keyed by label values."""
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._local = threading.local()
+        self._shards = []  # Every thread's dict; only its own thread writes to it
+        self._lock = threading.Lock()  # Guards _shards when a thread records for the first time
+        _registry.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _snapshots(self) -> list:
+        with self._lock:
+            shards = list(self._shards)
+        return [shard.copy() for shard in shards]
+
+class Counter(_Sharded):
+    """A monotonically increasing count, optionally per label values."""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return sum(snapshot.get(labels, 0) for snapshot in self._snapshots())
+
+    def samples(self) -> list:
+        totals = {}
+        for snapshot in self._snapshots():
+            for labels, value in snapshot.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return [(self.name, _format_labels(self.labels, labels), value) for labels, value in sorted(totals.items())]
+
+class Histogram(_Sharded):
+    """Counts of observed values per bucket, plus their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)  # Buckets, +Inf, then the sum
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the wall-clock seconds spent in the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def merged(self) -> dict:
+        """label values -> per-bucket counts (not cumulative), +Inf count and sum, across threads."""
+        totals = {}
+        for snapshot in self._snapshots():
+            for labels, counts in snapshot.items():
+                total = totals.setdefault(labels, [0] * len(counts))
+                for i, count in enumerate(list(counts)):
+                    total[i] += count
+        return totals
+
+    def samples(self) -> list:
+        samples = []
+        for labels, counts in sorted(self.merged().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                samples.append((f"{self.name}_bucket", _format_labels(self.labels, labels, le), cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.labels, labels), counts[-1]))
+            samples.append((f"{self.name}_count", _format_labels(self.labels, labels), cumulative))
+        return samples
+
+class Gauge:
+    """A value read from callback() at scrape time.
+
+    callback returns a number, or a dict of label values -> number when labels
+    are given. kind may be "counter" for totals another object already keeps.
+    """
+
+    def __init__(self, name: str, documentation: str, callback, labels: tuple = (), kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labels = labels
+        self.kind = kind
+        _registry.append(self)
+
+    def samples(self) -> list:
+        values = self.callback()
+        if not self.labels:
+            values = {(): values}
+        return [
+            (self.name, _format_labels(self.labels, labels), value)
+            for labels, value in sorted(values.items())
+            if value is not None
+        ]
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        try:
+            samples = metric.samples()
+        except Exception as e:  # A failing gauge shouldn't hide the others
+            lines.append(f"# {metric.name} unavailable: {e!r}")
+            continue
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+# Hot-path metrics, recorded where the work happens
+LLM_REQUEST_SECONDS = Histogram(
+    "smelty_llm_request_seconds", "Upstream LLM call latency", ("provider", "outcome")
+)
+LLM_PROMPT_TOKENS = Counter(
+    "smelty_llm_prompt_tokens_total", "Prompt tokens sent upstream, by whether the provider's prefix cache had them",
+    ("provider", "cache")
+)
+LLM_COMPLETION_TOKENS = Counter(
+    "smelty_llm_completion_tokens_total", "Tokens generated upstream", ("provider",)
+)
+DB_OPERATION_SECONDS = Histogram(
+    "smelty_db_operation_seconds", "Time spent in each storage backend method", ("method",)
+)
+DISCORD_SEND_SECONDS = Histogram(
+    "smelty_discord_send_seconds", "Latency of sending or editing Discord messages", ("operation",)
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "smelty_rate_limit_rejections_total", "Requests refused by a rate limit", ("scope",)
+)
@@ -0,0 +1,189 @@
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# (version, description, statements) in order. Never edit a released entry;
+# append a new one instead. Each migration runs in the same transaction as
+# its schema_version row, so a failure leaves the schema untouched.
+MIGRATIONS = [
+    (1, "Create user_streaks and user_preferences", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_streaks (
+            user_id INTEGER PRIMARY KEY,
+            streak_count INTEGER DEFAULT 0,
+            highest_streak INTEGER DEFAULT 0,
+            last_use TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            unlocked_rewards TEXT DEFAULT '[]'
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            user_id INTEGER PRIMARY KEY,
+            default_persona TEXT,
+            custom_settings TEXT DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    ]),
+    (2, "Store unlocked rewards as a bitmask", [
+        "ALTER TABLE user_streaks ADD COLUMN rewards_mask INTEGER NOT NULL DEFAULT 0",
+        # Bits as assigned in rewards.REWARD_TIERS when this migration was written
+        '''
+        UPDATE user_streaks SET rewards_mask = (
+            SELECT COALESCE(SUM(DISTINCT CASE value
+                WHEN 'meme_lord' THEN 1
+                WHEN 'dank_memer' THEN 2
+                WHEN 'poetry_master' THEN 4
+                WHEN 'chaos_agent' THEN 8
+                WHEN 'quantum_physicist' THEN 16
+                WHEN 'elite_status' THEN 32
+                WHEN 'shakespearean_dramatist' THEN 64
+                WHEN 'legendary' THEN 128
+                ELSE 0 END), 0)
+            FROM json_each(user_streaks.unlocked_rewards)
+        )
+        WHERE json_valid(unlocked_rewards)
+        ''',
+        "ALTER TABLE user_streaks DROP COLUMN unlocked_rewards"
+    ]),
+    (3, "Add guild membership and leaderboard indexes", [
+        '''
+        CREATE TABLE IF NOT EXISTS guild_members (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_streaks_current ON user_streaks (streak_count DESC, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_streaks_highest ON user_streaks (highest_streak DESC, user_id)"
+    ]),
+]
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Return the highest applied migration, or 0 for a new database."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection, migrations: list = MIGRATIONS) -> int:
+    """Bring the schema up to date and return its version.
+
+    When the schema is current this is a single read. Otherwise every pending
+    migration is applied in one write transaction, so concurrent starters
+    serialize and nothing is half-applied.
+    """
+    latest = migrations[-1][0] if migrations else 0
+    current = schema_version(conn)
+    conn.commit()
+    if current >= latest:
+        return current
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        current = schema_version(conn)  # Someone else may have migrated while we waited for the lock
+        for version, description, statements in migrations:
+            if version <= current:
+                continue
+            logger.info("Applying schema migration %s: %s", version, description)
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            current = version
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logger.info("Database schema at version %s", current)
+    return current
+
+# PostgreSQL has no pre-bitmask history, so it starts at the schema SQLite
+# reaches with migration 2. Later versions should mirror the SQLite list.
+POSTGRES_MIGRATIONS = [
+    (2, "Create user_streaks and user_preferences", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_streaks (
+            user_id BIGINT PRIMARY KEY,
+            streak_count INTEGER NOT NULL DEFAULT 0,
+            highest_streak INTEGER NOT NULL DEFAULT 0,
+            last_use TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            rewards_mask BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            user_id BIGINT PRIMARY KEY,
+            default_persona TEXT,
+            custom_settings TEXT DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    ]),
+    (3, "Add guild membership and leaderboard indexes", [
+        '''
+        CREATE TABLE IF NOT EXISTS guild_members (
+            guild_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_streaks_current ON user_streaks (streak_count DESC, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_streaks_highest ON user_streaks (highest_streak DESC, user_id)"
+    ]),
+]
+
+# pg_advisory_xact_lock key serializing migrations across processes
+POSTGRES_MIGRATION_LOCK = 0x736d656c7479
+
+def migrate_postgres(conn, migrations: list = POSTGRES_MIGRATIONS) -> int:
+    """PostgreSQL counterpart of migrate() for a psycopg2 connection.
+
+    Starters take a transaction-scoped advisory lock first; it is held only
+    for the single version read when the schema is current.
+    """
+    latest = migrations[-1][0] if migrations else 0
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (POSTGRES_MIGRATION_LOCK,))
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            current = cursor.fetchone()[0]
+            if current >= latest:
+                conn.commit()
+                return current
+
+            for version, description, statements in migrations:
+                if version <= current:
+                    continue
+                logger.info("Applying schema migration %s: %s", version, description)
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                current = version
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logger.info("Database schema at version %s", current)
+    return current
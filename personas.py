@@ -1,3 +1,7 @@
+from types import MappingProxyType
+from config import DEFAULT_MAX_TOKENS
+from rewards import has_reward
+
 # Base personas available to all users
 PERSONAS = {
     "cynical_vc": {
@@ -18,7 +22,8 @@ PERSONAS = {
         - Use current internet slang
         - Never say anything negative
         - End sentences with multiple exclamation marks""",
-        "example": "OMG bestie! 🌟 That's literally 💫 the most amazing 🎯 thing ever!!!"
+        "example": "OMG bestie! 🌟 That's literally 💫 the most amazing 🎯 thing ever!!!",
+        "max_tokens": 80  # Short bursts of hype
     },
     "conspiracy_nut": {
         "prompt": """You are a paranoid conspiracy theorist.
@@ -93,6 +98,7 @@ REWARD_PERSONAS = {
         - Speak in meme-speak
         - Add relevant ASCII art when possible""",
         "example": "( ͡° ͜ʖ ͡°) Challenge accepted! Time to unleash the power of memes!",
+        "max_tokens": 100,  # A meme lands fast
         "unlock_message": "🎉 You've unlocked the Meme Lord persona! Time to embrace the power of memes!"
     },
     "dank_memer": {
@@ -103,6 +109,7 @@ REWARD_PERSONAS = {
         - Include 'based' and 'kek'
         - Make references to Reddit and 4chan culture""",
         "example": "Based and redpilled take, my dude. *tips fedora* This is definitely a certified hood classic.",
+        "max_tokens": 100,  # A meme lands fast
         "unlock_message": "🎭 Congratulations! You've unlocked the legendary Dank Memer mode!"
     },
     "poetry_master": {
@@ -114,6 +121,7 @@ REWARD_PERSONAS = {
         - Include literary references
         - End with a poetic flourish""",
         "example": "In circuits bright and bytes so fair, I craft an answer with poetic flair...",
+        "max_tokens": 250,  # Room for a few stanzas
         "unlock_message": "📝 The Poetry Master has blessed you with their presence! Your words shall now flow like honey!"
     },
     "quantum_physicist": {
@@ -136,6 +144,7 @@ REWARD_PERSONAS = {
         - Be extremely theatrical
         - End with a dramatic exit""",
         "example": "To code, or not to code - that is the question!",
+        "max_tokens": 300,  # Soliloquies run long
         "unlock_message": "🎭 Hark! The Shakespearean Dramatist has entered the chat! All the world's a stage!"
     },
     "chaos_agent": {
@@ -147,41 +156,42 @@ REWARD_PERSONAS = {
         - Use surreal humor
         - Break the fourth wall occasionally""",
         "example": "CHAOS REIGNS! *throws glitter while reciting Shakespeare in UwU speak*",
-        "unlock_message": "🌪️ The Chaos Agent has been unleashed! Reality will never be the same!"
+        "unlock_message": "🌪️ The Chaos Agent has been unleashed! Reality will never be the same!",
+        "cacheable": False  # Every answer should be a fresh surprise
     }
 }
 
-# Update reward tiers in the streak check function
-def _check_rewards(streak: int, current_rewards: list) -> list:
-    """Check and return any new rewards based on streak count."""
-    new_rewards = []
-    reward_tiers = {
-        5: "meme_lord",      # Unlocks special meme responses
-        10: "dank_memer",    # Original dank_memer persona
-        15: "poetry_master", # New poetic responses
-        25: "chaos_agent",   # Unlocks more chaotic responses
-        35: "quantum_physicist", # Scientific and quantum responses
-        50: "elite_status",  # Special status and custom response formats
-        75: "shakespearean_dramatist", # Theatrical and dramatic responses
-        100: "legendary"     # Ultimate tier with all features
-    }
+def normalize_prompt(prompt: str) -> str:
+    """Strip the source indentation and blank lines from a prompt."""
+    return "\n".join(line.strip() for line in prompt.splitlines() if line.strip())
 
-    for tier, reward in reward_tiers.items():
-        if streak >= tier and reward not in current_rewards:
-            new_rewards.append(reward)
-            # Assuming a logger object is available in the larger application context.
-            # Replace this with appropriate logging mechanism if needed.
-            logger.info(f"New reward unlocked: {reward} at streak {streak}")
+def compile_personas(personas: dict) -> dict:
+    """Return read-only copies of personas with normalized prompts.
+
+    A prompt is the system message of every request for its persona. The
+    provider caches the prompt prefixes it has already seen, so the text is
+    fixed once here and can't change afterwards. Personas without their own
+    answer budget get DEFAULT_MAX_TOKENS.
+    """
+    return {
+        name: MappingProxyType({
+            "max_tokens": DEFAULT_MAX_TOKENS,
+            **persona,
+            "prompt": normalize_prompt(persona["prompt"])
+        })
+        for name, persona in personas.items()
+    }
 
-    return new_rewards
+PERSONAS = compile_personas(PERSONAS)
+REWARD_PERSONAS = compile_personas(REWARD_PERSONAS)
 
 def get_unlock_message(reward_tier: str) -> str:
     """Get the unlock message for a specific reward tier."""
     return REWARD_PERSONAS.get(reward_tier, {}).get("unlock_message", "🎉 New reward unlocked!")
 
-def get_persona(mode: str, unlocked_rewards: list) -> dict:
-    """Get the appropriate persona based on mode and unlocked rewards."""
-    if mode in REWARD_PERSONAS and mode in unlocked_rewards:
+def get_persona(mode: str, rewards_mask: int) -> dict:
+    """Get the appropriate persona based on mode and the user's rewards mask."""
+    if mode in REWARD_PERSONAS and has_reward(rewards_mask, mode):
         return REWARD_PERSONAS[mode]
     return PERSONAS.get(mode, PERSONAS["cynical_vc"])  # Default to cynical_vc if mode not found
 
@@ -0,0 +1,211 @@
+import logging
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from config import DATABASE_POOL_SIZE
+from database import StorageBackend, UserState, advance_streak, top_streaks_params, top_streaks_query
+from migrations import migrate_postgres
+
+logger = logging.getLogger(__name__)
+
+# Rows sent per INSERT statement by execute_values
+UPSERT_PAGE_SIZE = 500
+
+class PostgresDatabase(StorageBackend):
+    """PostgreSQL backend, so several bot processes and the web app share one store.
+
+    Connections come from a thread-safe pool of pool_size; the async layer
+    runs up to that many calls at once.
+    """
+
+    def __init__(self, dsn: str, pool_size: int = DATABASE_POOL_SIZE):
+        self.max_workers = pool_size
+        self._pool = ThreadedConnectionPool(1, pool_size, dsn)
+        self.init_db()
+
+    def init_db(self):
+        """Create or upgrade the schema; existing data is kept."""
+        try:
+            with self.get_connection() as conn:
+                migrate_postgres(conn)
+        except Exception as e:
+            logger.error("Database initialization failed: %s", e)
+            raise
+
+    @contextmanager
+    def get_connection(self):
+        """Borrow a pooled connection; commits on success and rolls back on error."""
+        conn = self._pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.putconn(conn)
+
+    def close(self):
+        self._pool.closeall()
+
+    def load_user(self, user_id: int) -> tuple:
+        with self.get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute('''
+                SELECT p.default_persona, p.custom_settings,
+                       s.streak_count, s.highest_streak, s.last_use, s.rewards_mask
+                FROM (SELECT %s::BIGINT AS user_id) AS u
+                LEFT JOIN user_preferences p ON p.user_id = u.user_id
+                LEFT JOIN user_streaks s ON s.user_id = u.user_id
+            ''', (user_id,))
+            persona, settings, streak, highest, last_use, rewards_mask = cursor.fetchone()
+
+        return persona, json.loads(settings or '{}'), streak or 0, highest or 0, last_use, rewards_mask or 0
+
+    def save_streaks(self, rows: list, members: list = ()):
+        with self.get_connection() as conn, conn.cursor() as cursor:
+            execute_values(cursor, '''
+                INSERT INTO user_streaks (
+                    user_id, streak_count, highest_streak, last_use, rewards_mask
+                ) VALUES %s
+                ON CONFLICT (user_id) DO UPDATE SET
+                    streak_count = EXCLUDED.streak_count,
+                    highest_streak = EXCLUDED.highest_streak,
+                    last_use = EXCLUDED.last_use,
+                    rewards_mask = EXCLUDED.rewards_mask
+            ''', rows, page_size=UPSERT_PAGE_SIZE)
+            if members:
+                execute_values(cursor, '''
+                    INSERT INTO guild_members (guild_id, user_id) VALUES %s
+                    ON CONFLICT DO NOTHING
+                ''', list(members), page_size=UPSERT_PAGE_SIZE)
+
+    def top_streaks(self, kind: str, limit: int, guild_id: int = None) -> list:
+        with self.get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                top_streaks_query(kind, guild_id is not None, "%s"),
+                top_streaks_params(kind, limit, guild_id)
+            )
+            return cursor.fetchall()
+
+    def _advance_streak(self, cursor, user_id: int) -> tuple:
+        """Bump the streak inside the caller's transaction, locking the row while it is read."""
+        current_time = datetime.now()
+        cursor.execute('''
+            SELECT streak_count, last_use, highest_streak, rewards_mask
+            FROM user_streaks
+            WHERE user_id = %s
+            FOR UPDATE
+        ''', (user_id,))
+        previous_streak, last_use, current_highest, rewards_mask = cursor.fetchone() or (0, None, 0, 0)
+
+        new_streak, highest_streak, new_rewards = advance_streak(
+            previous_streak, current_highest, last_use, rewards_mask, current_time
+        )
+        rewards_mask |= new_rewards
+
+        cursor.execute('''
+            INSERT INTO user_streaks (
+                user_id, streak_count, highest_streak, last_use, rewards_mask
+            ) VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET
+                streak_count = EXCLUDED.streak_count,
+                highest_streak = EXCLUDED.highest_streak,
+                last_use = EXCLUDED.last_use,
+                rewards_mask = EXCLUDED.rewards_mask
+        ''', (user_id, new_streak, highest_streak, current_time, rewards_mask))
+
+        return previous_streak, new_streak, highest_streak, rewards_mask, new_rewards
+
+    def update_user_streak(self, user_id: int) -> tuple:
+        try:
+            with self.get_connection() as conn, conn.cursor() as cursor:
+                _, streak, highest_streak, rewards_mask, _ = self._advance_streak(cursor, user_id)
+                return streak, highest_streak, rewards_mask
+
+        except Exception as e:
+            logger.error("Error updating user streak: %s", e)
+            return 0, 0, 0
+
+    def load_and_touch_user(self, user_id: int, guild_id: int = None) -> UserState:
+        try:
+            with self.get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute('''
+                    SELECT default_persona, custom_settings
+                    FROM user_preferences
+                    WHERE user_id = %s
+                ''', (user_id,))
+                default_persona, settings = cursor.fetchone() or (None, '{}')
+                previous, streak, highest, rewards, new_rewards = self._advance_streak(cursor, user_id)
+                if guild_id is not None:
+                    cursor.execute('''
+                        INSERT INTO guild_members (guild_id, user_id) VALUES (%s, %s)
+                        ON CONFLICT DO NOTHING
+                    ''', (guild_id, user_id))
+
+            return UserState(
+                default_persona=default_persona,
+                custom_settings=json.loads(settings),
+                previous_streak=previous,
+                streak=streak,
+                highest_streak=highest,
+                rewards_mask=rewards,
+                new_rewards_mask=new_rewards
+            )
+
+        except Exception as e:
+            logger.error("Error loading user %s: %s", user_id, e)
+            return UserState(None, {}, 0, 0, 0, 0, 0)
+
+    def get_user_streak(self, user_id: int) -> tuple:
+        try:
+            with self.get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute('''
+                    SELECT streak_count, highest_streak, rewards_mask
+                    FROM user_streaks
+                    WHERE user_id = %s
+                ''', (user_id,))
+                return cursor.fetchone() or (0, 0, 0)
+
+        except Exception as e:
+            logger.error("Error getting user streak: %s", e)
+            return 0, 0, 0
+
+    def save_user_preference(self, user_id: int, default_persona: str = None, custom_settings: dict = None) -> bool:
+        try:
+            with self.get_connection() as conn, conn.cursor() as cursor:
+                settings = json.dumps(custom_settings or {})
+                cursor.execute('''
+                    INSERT INTO user_preferences (
+                        user_id, default_persona, custom_settings, updated_at
+                    ) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        default_persona = COALESCE(EXCLUDED.default_persona, user_preferences.default_persona),
+                        custom_settings = EXCLUDED.custom_settings,
+                        updated_at = EXCLUDED.updated_at
+                ''', (user_id, default_persona, settings, datetime.now()))
+                return True
+
+        except Exception as e:
+            logger.error("Error saving user preferences: %s", e)
+            return False
+
+    def get_user_preferences(self, user_id: int) -> tuple:
+        try:
+            with self.get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute('''
+                    SELECT default_persona, custom_settings
+                    FROM user_preferences
+                    WHERE user_id = %s
+                ''', (user_id,))
+                result = cursor.fetchone()
+
+            if result:
+                persona, settings = result
+                return persona, json.loads(settings)
+            return None, {}
+
+        except Exception as e:
+            logger.error("Error getting user preferences: %s", e)
+            return None, {}
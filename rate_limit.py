@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+from config import (
+    MAX_REQUESTS_PER_MINUTE,
+    USER_RATE_LIMIT_BURST,
+    GUILD_REQUESTS_PER_MINUTE,
+    GUILD_RATE_LIMIT_BURST,
+    PROVIDER_REQUESTS_PER_MINUTE,
+    PROVIDER_RATE_LIMIT_BURST,
+    RATE_LIMIT_MAX_BUCKETS
+)
+
+# scope -> (burst capacity, tokens refilled per second)
+DEFAULT_LIMITS = {
+    "user": (USER_RATE_LIMIT_BURST, MAX_REQUESTS_PER_MINUTE / 60),
+    "guild": (GUILD_RATE_LIMIT_BURST, GUILD_REQUESTS_PER_MINUTE / 60),
+    "provider": (PROVIDER_RATE_LIMIT_BURST, PROVIDER_REQUESTS_PER_MINUTE / 60)
+}
+
+class TokenBucket:
+    """Tokens left and when they were last topped up; refilled lazily on access."""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+class RateLimiter:
+    """Constant-time token buckets keyed by (scope, id).
+
+    Each scope (user, guild, provider) has its own burst capacity and refill
+    rate. Buckets are kept in least-recently-used order; a bucket idle long
+    enough to refill completely is indistinguishable from a new one, so
+    those are dropped, and the total is capped at max_buckets.
+    """
+
+    def __init__(self, limits: dict = None, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self.rejections = 0
+
+    def _bucket(self, key: tuple, now: float) -> TokenBucket:
+        capacity, rate = self.limits[key[0]]
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(capacity, now)
+            self._buckets[key] = bucket
+        else:
+            bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, *keys: tuple, now: float = None) -> float:
+        """Take one token from every bucket in keys.
+
+        Returns 0 on success. If any bucket is empty nothing is consumed and the
+        number of seconds until all of them have a token is returned instead.
+        """
+        now = time.monotonic() if now is None else now
+        buckets = [(key, self._bucket(key, now)) for key in keys]
+
+        wait = 0.0
+        for key, bucket in buckets:
+            if bucket.tokens < 1:
+                rate = self.limits[key[0]][1]
+                wait = max(wait, (1 - bucket.tokens) / rate if rate else float("inf"))
+
+        if wait:
+            self.rejections += 1
+        else:
+            for _, bucket in buckets:
+                bucket.tokens -= 1
+
+        self._evict(now)
+        return wait
+
+    def _evict(self, now: float):
+        """Drop idle buckets from the old end, and anything beyond max_buckets."""
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            capacity, rate = self.limits[key[0]]
+            refilled = bucket.tokens + (now - bucket.updated) * rate >= capacity
+            if not refilled and len(self._buckets) <= self.max_buckets:
+                break
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def stats(self) -> dict:
+        return {"buckets": len(self._buckets), "rejections": self.rejections}
@@ -0,0 +1,44 @@
+from bisect import bisect_right
+from typing import NamedTuple
+
+class RewardTier(NamedTuple):
+    streak: int       # Streak that unlocks it
+    name: str         # Reward id; reward personas share it
+    title: str
+    description: str
+
+# The one list of streak rewards, in unlock order. A tier's position is its
+# bit in the stored rewards mask, so only ever append to this list.
+REWARD_TIERS = (
+    RewardTier(5, "meme_lord", "Meme Lord Mode", "Master of internet culture and memes"),
+    RewardTier(10, "dank_memer", "Dank Memer Mode", "The original chaotic personality"),
+    RewardTier(15, "poetry_master", "Poetry Master", "Responses flow like beautiful verses"),
+    RewardTier(25, "chaos_agent", "Chaos Agent Mode", "Pure randomness and surreal humor"),
+    RewardTier(35, "quantum_physicist", "Quantum Physicist", "Scientific and quantum-inspired responses"),
+    RewardTier(50, "elite_status", "Elite Status", "Fancy formatting and theatrical responses"),
+    RewardTier(75, "shakespearean_dramatist", "Shakespearean Dramatist", "Dramatic and theatrical responses"),
+    RewardTier(100, "legendary", "Legendary Mode", "The ultimate AI personality")
+)
+
+THRESHOLDS = [tier.streak for tier in REWARD_TIERS]
+REWARD_BITS = {tier.name: 1 << i for i, tier in enumerate(REWARD_TIERS)}
+
+def unlocked_by(streak: int) -> int:
+    """Mask of every reward a streak this long has earned."""
+    return (1 << bisect_right(THRESHOLDS, streak)) - 1
+
+def newly_unlocked(streak: int, rewards_mask: int) -> int:
+    """Mask of rewards earned at this streak that aren't in rewards_mask yet."""
+    return unlocked_by(streak) & ~rewards_mask
+
+def has_reward(rewards_mask: int, name: str) -> bool:
+    return bool(rewards_mask & REWARD_BITS.get(name, 0))
+
+def reward_names(rewards_mask: int) -> list:
+    """Names of the rewards in a mask, in unlock order."""
+    return [tier.name for i, tier in enumerate(REWARD_TIERS) if rewards_mask >> i & 1]
+
+def next_tier(streak: int) -> RewardTier:
+    """The next reward to unlock, or None once all are unlocked."""
+    i = bisect_right(THRESHOLDS, streak)
+    return REWARD_TIERS[i] if i < len(REWARD_TIERS) else None
@@ -0,0 +1,208 @@
+import logging
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from config import (
+    LLM_WORKERS,
+    LLM_QUEUE_SIZE,
+    LLM_QUEUE_DEADLINE,
+    LLM_GUILD_WEIGHTS
+)
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+HIGH = 0
+NORMAL = 1
+
+# After this many HIGH picks in a row, a waiting NORMAL request gets the next slot
+HIGH_BURST = 4
+
+class QueueFull(Exception):
+    """The upstream queue is at capacity; the request was refused up front."""
+
+class DeadlineExceeded(Exception):
+    """The request waited longer than its deadline for an upstream slot."""
+
+def parse_weights(spec: str) -> dict:
+    """Guild weights from "guild_id=weight,..." (LLM_GUILD_WEIGHTS)."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        guild_id, _, weight = item.partition("=")
+        try:
+            weights[int(guild_id)] = max(1, int(weight))
+        except ValueError:
+            logger.warning("Ignoring invalid guild weight %r", item)
+    return weights
+
+class Ticket:
+    """A request waiting for an upstream slot."""
+
+    __slots__ = ("future", "deadline", "guild_id", "lane")
+
+    def __init__(self, future: asyncio.Future, deadline: float, guild_id, lane: int):
+        self.future = future
+        self.deadline = deadline
+        self.guild_id = guild_id
+        self.lane = lane
+
+class LLMScheduler:
+    """Bounded pool of upstream call slots with priority lanes and fair queueing.
+
+    At most `workers` calls hold a slot at once. Everything else waits in one
+    of two lanes (HIGH before NORMAL, with HIGH_BURST to avoid starving
+    NORMAL). Within a lane, guilds take turns by deficit round robin, so a
+    guild with weight 2 gets two slots per turn and one busy guild cannot
+    crowd out the rest. Guilds weigh 1 unless listed in weights. A full
+    queue refuses new requests, and tickets past their deadline are dropped
+    instead of being served late.
+    """
+
+    def __init__(
+        self,
+        workers: int = LLM_WORKERS,
+        max_queue: int = LLM_QUEUE_SIZE,
+        deadline: float = LLM_QUEUE_DEADLINE,
+        weights: dict = None
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.weights = parse_weights(LLM_GUILD_WEIGHTS) if weights is None else dict(weights)  # guild_id -> slots per turn
+        self.active = 0
+        self.queued = 0
+        self._lanes = [OrderedDict(), OrderedDict()]  # lane -> guild_id -> deque of tickets
+        self._lane_sizes = [0, 0]
+        self._deficits = [{}, {}]
+        self._high_streak = 0
+        self.served = 0
+        self.rejected = 0
+        self.expired = 0
+
+    @asynccontextmanager
+    async def slot(self, guild_id=None, priority: int = NORMAL, deadline: float = None, on_queued=None):
+        """Hold an upstream slot for the duration of the block.
+
+        on_queued, if given, is awaited with the caller's approximate queue
+        position when it has to wait. Raises QueueFull or DeadlineExceeded.
+        """
+        with span("llm.queue_wait"):
+            await self.acquire(guild_id, priority, deadline, on_queued)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, guild_id=None, priority: int = NORMAL, deadline: float = None, on_queued=None):
+        if self.active < self.workers and not self.queued:
+            self.active += 1
+            self.served += 1
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            logger.warning("LLM queue full (%s waiting), refusing request from guild %s", self.queued, guild_id)
+            raise QueueFull()
+
+        loop = asyncio.get_running_loop()
+        timeout = self.deadline if deadline is None else deadline
+        ticket = Ticket(loop.create_future(), loop.time() + timeout, guild_id, priority)
+        self._enqueue(ticket)
+        position = sum(self._lane_sizes[:priority + 1])
+        self._dispatch()
+
+        try:
+            if on_queued is not None and not ticket.future.done():
+                try:
+                    await on_queued(position)
+                except Exception as e:
+                    logger.warning("Queue position callback failed: %s", e)
+            await asyncio.wait_for(ticket.future, max(0, ticket.deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self._discard(ticket)
+            self.expired += 1
+            raise DeadlineExceeded() from None
+        except asyncio.CancelledError:
+            # Granted while the callback ran or right as we were cancelled: hand the slot on
+            if ticket.future.done() and not ticket.future.cancelled() and ticket.future.exception() is None:
+                self.release()
+            else:
+                self._discard(ticket)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _enqueue(self, ticket: Ticket):
+        guilds = self._lanes[ticket.lane]
+        if ticket.guild_id not in guilds:
+            guilds[ticket.guild_id] = deque()
+        guilds[ticket.guild_id].append(ticket)
+        self._lane_sizes[ticket.lane] += 1
+        self.queued += 1
+
+    def _discard(self, ticket: Ticket):
+        """Take a ticket whose caller gave up out of its lane, if it is still waiting."""
+        guilds = self._lanes[ticket.lane]
+        tickets = guilds.get(ticket.guild_id)
+        if tickets is None or ticket not in tickets:
+            return  # Already handed a slot or dropped by _dispatch
+        tickets.remove(ticket)
+        self._lane_sizes[ticket.lane] -= 1
+        self.queued -= 1
+        if not tickets:
+            del guilds[ticket.guild_id]
+            self._deficits[ticket.lane].pop(ticket.guild_id, None)
+
+    def _dispatch(self):
+        """Hand free slots to waiting tickets, dropping any past their deadline."""
+        now = asyncio.get_running_loop().time()
+        while self.active < self.workers and self.queued:
+            ticket = self._next_ticket()
+            if ticket.future.done():
+                continue  # Caller is giving up; wait_for cancelled the future before _discard ran
+            if ticket.deadline <= now:
+                self.expired += 1
+                ticket.future.set_exception(DeadlineExceeded())
+                continue
+            self.active += 1
+            self.served += 1
+            ticket.future.set_result(None)
+
+    def _next_ticket(self) -> Ticket:
+        high_waiting = self._lane_sizes[HIGH] > 0
+        normal_waiting = self._lane_sizes[NORMAL] > 0
+        if high_waiting and (not normal_waiting or self._high_streak < HIGH_BURST):
+            lane = HIGH
+            self._high_streak += 1
+        else:
+            lane = NORMAL
+            self._high_streak = 0
+
+        guilds = self._lanes[lane]
+        deficits = self._deficits[lane]
+        guild_id, tickets = next(iter(guilds.items()))
+        if deficits.get(guild_id, 0) < 1:
+            deficits[guild_id] = deficits.get(guild_id, 0) + self.weights.get(guild_id, 1)
+
+        ticket = tickets.popleft()
+        deficits[guild_id] -= 1
+        self._lane_sizes[lane] -= 1
+        self.queued -= 1
+
+        if not tickets:
+            del guilds[guild_id]
+            deficits.pop(guild_id, None)
+        elif deficits[guild_id] < 1:
+            guilds.move_to_end(guild_id)
+        return ticket
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "served": self.served,
+            "rejected": self.rejected,
+            "expired": self.expired
+        }
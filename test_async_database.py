@@ -0,0 +1,62 @@
+import time
+import asyncio
+
+from async_database import AsyncDatabase
+from database import Database
+
+DISK_STALL = 0.02  # seconds each simulated write blocks for
+WRITES = 50
+
+class StallingDatabase(Database):
+    """A database whose writes block like a slow disk."""
+
+    def save_streaks(self, rows: list, members: list = ()):
+        time.sleep(DISK_STALL)
+        super().save_streaks(rows, members)
+
+async def max_loop_lag(work) -> float:
+    """Run work() while ticking the loop every millisecond; return the worst tick overshoot."""
+    lag = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal lag
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            start = loop.time()
+            await asyncio.sleep(0.001)
+            lag = max(lag, loop.time() - start - 0.001)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0)  # Let the ticker start
+    await work()
+    done.set()
+    await tick
+    return lag
+
+def test_event_loop_stays_responsive_while_database_is_saturated(tmp_path):
+    db = StallingDatabase(str(tmp_path / "bot.db"))
+    rows = [(user_id, 1, 1, None, 0) for user_id in range(100)]
+
+    async def scenario():
+        async_db = AsyncDatabase(db)
+
+        async def saturate():
+            reads = [async_db.get_user_streak(user_id % 10) for user_id in range(WRITES)]
+            writes = [async_db.save_streaks(rows) for _ in range(WRITES)]
+            await asyncio.gather(*writes, *reads)
+
+        async def block_inline():
+            for _ in range(5):
+                db.save_streaks(rows)
+
+        offloaded_lag = await max_loop_lag(saturate)
+        inline_lag = await max_loop_lag(block_inline)
+        await async_db.close()
+        return offloaded_lag, inline_lag, async_db.stats()
+
+    offloaded_lag, inline_lag, stats = asyncio.run(scenario())
+
+    assert inline_lag >= DISK_STALL * 5  # Blocked for every inline write
+    assert offloaded_lag < inline_lag / 2  # Relative, so a loaded machine slows both sides alike
+    assert stats["reads_coalesced"] > 0
@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+import cache
+import utils
+from cache import ResponseCache
+from loadtest import FakeLLMServer, offline_bot
+
+def key(question: str) -> tuple:
+    return ResponseCache.make_key("persona", question, {"max_tokens": 150})
+
+def test_keys_ignore_case_and_spacing_but_not_parameters():
+    assert ResponseCache.make_key("p", "  Why  SO serious? ", {}) == ResponseCache.make_key("p", "why so serious?", {})
+    assert ResponseCache.make_key("p", "q", {"max_tokens": 80}) != ResponseCache.make_key("p", "q", {"max_tokens": 150})
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    responses = ResponseCache(ttl=300)
+    responses.set(key("q"), "answer")
+
+    now[0] += 299
+    assert responses.get(key("q")) == "answer"
+    now[0] += 1
+    assert responses.get(key("q")) is None
+    assert responses.stats() == {
+        "entries": 0, "bytes": 0, "hits": 1, "misses": 1, "hit_ratio": 0.5, "evictions": 0, "expirations": 1
+    }
+
+def test_least_recently_used_entries_are_evicted_first():
+    responses = ResponseCache(max_entries=2)
+    responses.set(key("a"), "1")
+    responses.set(key("b"), "2")
+    responses.get(key("a"))  # Now b is the oldest use
+    responses.set(key("c"), "3")
+
+    assert responses.get(key("b")) is None
+    assert responses.get(key("a")) == "1" and responses.get(key("c")) == "3"
+    assert responses.stats()["evictions"] == 1
+
+def test_total_size_stays_under_the_byte_ceiling():
+    responses = ResponseCache(max_bytes=100)
+    for i in range(10):
+        responses.set(key(f"q{i}"), "x" * 30)  # 32 bytes with the question
+    stats = responses.stats()
+    assert stats["bytes"] <= 100 and stats["entries"] == 3
+    assert stats["evictions"] == 7
+
+    responses.set(key("huge"), "x" * 200)  # Larger than the whole cache: not stored, nothing evicted
+    assert responses.get(key("huge")) is None
+    assert responses.stats()["entries"] == 3
+
+def test_replacing_an_entry_does_not_count_its_old_size():
+    responses = ResponseCache()
+    responses.set(key("q"), "short")
+    responses.set(key("q"), "a longer answer")
+    assert responses.stats()["entries"] == 1
+    assert responses.stats()["bytes"] == len("q") + len("a longer answer")
+
+def test_uncacheable_calls_skip_the_cache():
+    async def scenario():
+        server = FakeLLMServer(latency=0, jitter=0)
+        await server.start()
+        try:
+            async with offline_bot(server):
+                for cacheable in (True, True, False, False):
+                    await utils.call_llm("persona", "Same question", cacheable=cacheable)
+                return server.stats()["requests"], utils.response_cache.stats()
+        finally:
+            await server.stop()
+
+    requests, stats = asyncio.run(scenario())
+    assert requests == 3  # One for both cacheable calls, one each for the others
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+def test_concurrent_uncacheable_calls_each_get_their_own_answer():
+    async def scenario():
+        server = FakeLLMServer(latency=0.05, jitter=0)
+        await server.start()
+        try:
+            async with offline_bot(server):
+                await asyncio.gather(
+                    utils.call_llm("persona", "Surprise me", cacheable=False),
+                    utils.call_llm("persona", "Surprise me", cacheable=False)
+                )
+
+                async def stream():
+                    return [chunk async for chunk in utils.stream_llm("persona", "Surprise me", cacheable=False)]
+
+                await asyncio.gather(stream(), stream())
+                return server.stats()["requests"], utils.inflight_requests.stats()
+        finally:
+            await server.stop()
+
+    coalesced_before = utils.inflight_requests.stats()["coalesced"]
+    requests, inflight = asyncio.run(scenario())
+    assert requests == 4
+    assert inflight["coalesced"] == coalesced_before
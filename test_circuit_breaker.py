@@ -0,0 +1,120 @@
+import asyncio
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def breaker(clock=None, **kwargs) -> CircuitBreaker:
+    options = {"failure_rate": 0.5, "window": 10, "min_calls": 4, "open_seconds": 30, "slow_call_seconds": 2}
+    return CircuitBreaker("test", clock=clock or Clock(), **{**options, **kwargs})
+
+def test_stays_closed_until_min_calls_are_seen():
+    cb = breaker()
+    for _ in range(3):
+        cb.record_failure()
+    assert cb.state == CLOSED and cb.allow()
+    cb.record_failure()
+    assert cb.state == OPEN and not cb.allow()
+    assert cb.times_opened == 1 and cb.health() == 0.0
+
+def test_opens_at_the_failure_rate_over_the_window():
+    cb = breaker()
+    for _ in range(3):
+        cb.record_success(0.1)
+    cb.record_failure()
+    assert cb.state == CLOSED and cb.health() == 0.75
+    cb.record_failure()
+    cb.record_failure()  # 3 of 6
+    assert cb.state == OPEN
+
+def test_slow_calls_count_as_failures():
+    cb = breaker()
+    for _ in range(4):
+        cb.record_success(2.5)
+    assert cb.state == OPEN
+
+def test_half_open_after_cool_down_allows_one_trial_then_closes():
+    clock = Clock()
+    cb = breaker(clock)
+    for _ in range(4):
+        cb.record_failure()
+
+    clock.now += 29
+    assert not cb.allow()
+    clock.now += 1
+    trial = cb.allow()
+    assert trial and cb.state == HALF_OPEN
+    assert not cb.allow()  # Only one trial call at a time
+
+    cb.record_success(0.1, trial)
+    assert cb.state == CLOSED and cb.allow() and cb.allow()
+    assert cb.health() == 1.0
+
+def test_failed_or_slow_trial_reopens():
+    clock = Clock()
+    cb = breaker(clock)
+    for _ in range(4):
+        cb.record_failure()
+    clock.now += 30
+    cb.record_failure(cb.allow())
+    assert cb.state == OPEN and cb.times_opened == 2 and cb.opened_at == clock.now
+
+    clock.now += 30
+    cb.record_success(5.0, cb.allow())
+    assert cb.state == OPEN and cb.times_opened == 3
+
+def test_released_trial_slot_can_be_used_again():
+    clock = Clock()
+    cb = breaker(clock)
+    for _ in range(4):
+        cb.record_failure()
+    clock.now += 30
+    trial = cb.allow()
+    cb.release(trial)  # e.g. the call was cancelled before it reached the provider
+    assert cb.allow()
+
+def test_calls_admitted_before_opening_do_not_decide_half_open():
+    clock = Clock()
+    cb = breaker(clock)
+    stragglers = [cb.allow() for _ in range(3)]
+    for _ in range(4):
+        cb.record_failure(cb.allow())
+    clock.now += 30
+    trial = cb.allow()
+
+    cb.record_success(0.1, stragglers[0])
+    cb.record_failure(stragglers[1])
+    cb.release(stragglers[2])
+    cb.record_success(0.1)
+    assert cb.state == HALF_OPEN and not cb.allow()  # Still waiting on the trial
+
+    cb.record_failure(trial)
+    assert cb.state == OPEN and cb.times_opened == 2
+
+def test_background_probe_moves_to_half_open_once_healthy():
+    probes = []
+
+    async def probe():
+        probes.append(len(probes))
+        if len(probes) < 3:
+            raise ConnectionError("still down")
+
+    async def scenario():
+        cb = breaker(probe=probe, open_seconds=0.01)
+        for _ in range(4):
+            cb.record_failure()
+        assert not cb.allow()  # The probe, not a live call, tests the provider while open
+        while cb.state == OPEN:
+            await asyncio.sleep(0.01)
+        state = cb.state
+        trial = cb.allow()
+        cb.record_success(0.1, trial)
+        cb.close()
+        return state, bool(trial), cb.state
+
+    assert asyncio.run(scenario()) == (HALF_OPEN, True, CLOSED)
+    assert len(probes) == 3
@@ -0,0 +1,261 @@
+import asyncio
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from cache import ResponseCache
+from cluster import SharedObject, Supervisor, shard_ranges, shared_object
+from database import Database
+
+SHARDS = 4
+WORKERS = 2
+
+# Scaling: a fake gateway's interactions, handled by 1, 2 and 4 workers
+GATEWAY_SHARDS = 8
+EVENTS_PER_SHARD = 5
+HANDLE_COST = 0.02  # seconds of a worker's event loop each interaction is charged
+BURST_USER = 42  # Asks from both workers at once; the user bucket holds USER_RATE_LIMIT_BURST (5)
+
+# cluster_id -> phase -> (user_id, question) interactions handled by that worker, in order
+PLAN = {
+    0: {
+        1: [(1, "Should I buy a boat?")],  # Asked here first...
+        3: [(BURST_USER, f"Burst question {i} from worker 0") for i in range(3)]
+    },
+    1: {
+        2: [(2, "Should I buy a boat?")],  # ...and answered from the shared cache here
+        3: [(BURST_USER, f"Burst question {i} from worker 1") for i in range(3)]
+    }
+}
+PHASES = 3
+
+def handler_worker(cluster_id, shard_ids, shard_count, state_address, health_queue, llm_url, db_path, phases):
+    """Stand-in for run_worker: runs the real /smelty handler on mock interactions, phase by phase.
+
+    Like a worker, it reads the shared rate limiter and response cache from
+    the state server. Each phase's last messages go back on the health queue.
+    """
+    # bot and utils read these from config when imported below
+    import config
+    config.SHARD_IDS = shard_ids
+    config.SHARD_COUNT = shard_count
+    config.CLUSTER_STATE_ADDRESS = state_address
+
+    import bot
+    import utils
+    from llm_client import LLMClient
+    from loadtest import MockInteraction
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        utils.llm_client = LLMClient(deepseek_url=f"{llm_url}/v1/chat/completions", deepseek_key="sk-test", huggingface_token=None)
+        bot.init_storage(Database(db_path))
+        for phase, ready in enumerate(phases, 1):
+            await loop.run_in_executor(None, ready.wait)
+            answers = []
+            for user_id, question in PLAN[cluster_id].get(phase, ()):
+                interaction = MockInteraction(user_id, guild_id=cluster_id)
+                await bot.smelty.callback(interaction, question=question, mode="cynical_vc")
+                answers.append(interaction.messages[-1])
+            health_queue.put({"cluster_id": cluster_id, "shard_id": shard_ids[0], "phase": phase, "answers": answers})
+        await bot.close_storage()
+        await utils.llm_client.close()
+
+    asyncio.run(run())
+    threading.Event().wait()  # Stay up like a worker until the supervisor stops us
+
+def gateway_events() -> list:
+    """(guild_id, user_id) interactions spread evenly over GATEWAY_SHARDS, as a gateway would deliver them."""
+    return [((i % GATEWAY_SHARDS) << 22 | i, i) for i in range(GATEWAY_SHARDS * EVENTS_PER_SHARD)]
+
+def gateway_worker(cluster_id, shard_ids, shard_count, state_address, health_queue, db_path, events):
+    """Stand-in for run_worker: handles the fake gateway's interactions for its own shards.
+
+    Interactions are routed like Discord does, (guild_id >> 22) % shard_count,
+    to the shards of the worker's AutoShardedClient, and run through the
+    /help handler. Per-shard counts go back on the health queue.
+    """
+    import config
+    config.SHARD_IDS = shard_ids
+    config.SHARD_COUNT = shard_count
+    config.CLUSTER_STATE_ADDRESS = state_address
+
+    import discord
+    import bot
+    from loadtest import MockInteraction
+
+    async def run() -> dict:
+        bot.init_storage(Database(db_path))
+        handled = {shard_id: 0 for shard_id in bot.client.shard_ids}
+        for guild_id, user_id in events:
+            shard_id = (guild_id >> 22) % bot.client.shard_count
+            if shard_id in handled:
+                interaction = MockInteraction(user_id, guild_id=guild_id)
+                await bot.help_command.callback(interaction)
+                handled[shard_id] += not interaction.failed
+        await bot.close_storage()
+        return handled
+
+    handled = asyncio.run(run())
+    sharded = isinstance(bot.client, discord.AutoShardedClient)
+    for shard_id, count in handled.items():
+        health_queue.put({"cluster_id": cluster_id, "shard_id": shard_id, "handled": count, "sharded": sharded})
+    threading.Event().wait()
+
+def run_gateway(workers: int, db_path: str) -> dict:
+    """Run the fake gateway through a cluster; return each shard's report."""
+    supervisor = Supervisor(GATEWAY_SHARDS, workers, target=gateway_worker, extra_args=(db_path, gateway_events()))
+    supervisor.start()
+    try:
+        while len(supervisor.health) < GATEWAY_SHARDS:
+            supervisor.poll(0.05)
+        return supervisor.health
+    finally:
+        supervisor.shutdown()
+
+@contextmanager
+def fake_llm_server():
+    """A FakeLLMServer on its own loop thread, so the test can block in the supervisor."""
+    from loadtest import FakeLLMServer  # Imports bot, which spawned workers must import after setting config
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = FakeLLMServer(latency=0, jitter=0)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+def run_phases(supervisor: Supervisor, phases: list, server) -> dict:
+    """Release the workers one phase at a time; return each phase's answers and upstream request count."""
+    reporting = [shard_ids[0] for shard_ids in supervisor.ranges]
+    results = {}
+    for phase, ready in enumerate(phases, 1):
+        ready.set()
+        while not all(supervisor.health.get(shard_id, {}).get("phase") == phase for shard_id in reporting):
+            supervisor.poll(0.05)
+        answers = {supervisor.health[shard_id]["cluster_id"]: supervisor.health[shard_id]["answers"] for shard_id in reporting}
+        results[phase] = answers, server.stats()["requests"]
+    return results
+
+def test_shard_ranges_are_contiguous_and_balanced():
+    assert shard_ranges(8, 3) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert shard_ranges(2, 4) == [[0], [1]]
+    assert shard_ranges(5, 1) == [[0, 1, 2, 3, 4]]
+
+class RecordingProxy:
+    """Stands in for a manager proxy; remembers which thread made each call."""
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.threads = []
+
+    def call(self, method, *args, **kwargs):
+        self.threads.append(threading.get_ident())
+        return getattr(self.obj, method)(*args, **kwargs)
+
+def test_shared_state_calls_run_off_the_event_loop():
+    from utils import shared_call  # Imported here: spawned workers must import utils after setting config
+    proxy = RecordingProxy(ResponseCache())
+    key = ResponseCache.make_key("persona", "question", {})
+
+    async def scenario():
+        await shared_call(SharedObject(proxy), "set", key, "answer")
+        return await shared_call(SharedObject(proxy), "get", key), threading.get_ident()
+
+    cached, loop_thread = asyncio.run(scenario())
+    assert cached == "answer"
+    assert len(proxy.threads) == 2 and loop_thread not in proxy.threads
+
+def test_handled_interactions_scale_with_workers(tmp_path):
+    db_path = str(tmp_path / "cluster.db")
+    Database(db_path).close()
+    throughput = {}
+    for workers in (1, 2, 4):
+        health = run_gateway(workers, db_path)
+        assert all(report["sharded"] for report in health.values())
+        assert {shard_id: report["handled"] for shard_id, report in health.items()} == dict.fromkeys(range(GATEWAY_SHARDS), EVENTS_PER_SHARD)
+
+        per_worker = {}
+        for report in health.values():
+            per_worker[report["cluster_id"]] = per_worker.get(report["cluster_id"], 0) + report["handled"]
+        assert len(per_worker) == workers and len(set(per_worker.values())) == 1  # Every worker got an equal share
+
+        # Each worker's loop is busy HANDLE_COST per interaction, so the cluster is done when its busiest worker is
+        throughput[workers] = sum(per_worker.values()) / (max(per_worker.values()) * HANDLE_COST)
+
+    assert throughput[2] == 2 * throughput[1]
+    assert throughput[4] == 4 * throughput[1]
+
+def test_shard_health_is_reported_per_shard(monkeypatch):
+    import discord
+    import bot  # Not at the top: spawned workers must import bot after setting config
+    from types import SimpleNamespace
+
+    class FakeShardedClient(discord.AutoShardedClient):
+        """Two connected shards with three guilds, closed after one report."""
+
+        checks = 0
+
+        @property
+        def shards(self):
+            return {
+                0: SimpleNamespace(latency=0.05, is_closed=lambda: False),
+                1: SimpleNamespace(latency=0.2, is_closed=lambda: True)
+            }
+
+        @property
+        def guilds(self):
+            return [SimpleNamespace(shard_id=0), SimpleNamespace(shard_id=0), SimpleNamespace(shard_id=1)]
+
+        async def wait_until_ready(self):
+            pass
+
+        def is_closed(self):
+            self.checks += 1
+            return self.checks > 1
+
+    monkeypatch.setattr(bot, "client", FakeShardedClient(intents=discord.Intents.default(), shard_count=2, shard_ids=[0, 1]))
+    reports = []
+    asyncio.run(bot.report_shard_health(reports.append, interval=0))
+
+    assert reports == [
+        {"shard_id": 0, "latency": 0.05, "closed": False, "guilds": 2},
+        {"shard_id": 1, "latency": 0.2, "closed": True, "guilds": 1}
+    ]
+
+    supervisor = Supervisor(4, 2)
+    for report in reports:
+        supervisor.health_queue.put({"cluster_id": 0, **report})
+    supervisor.poll(0.5)
+    assert supervisor.stale_shards(interval=60) == [2, 3]  # Shards 0 and 1 just reported
+
+def test_workers_share_the_response_cache_and_rate_limits(tmp_path):
+    db_path = str(tmp_path / "cluster.db")
+    Database(db_path).close()  # Create the schema before two processes open it
+    phases = [multiprocessing.get_context("spawn").Event() for _ in range(PHASES)]
+
+    with fake_llm_server() as server:
+        supervisor = Supervisor(SHARDS, WORKERS, target=handler_worker, extra_args=(server.url, db_path, phases))
+        supervisor.start()
+        try:
+            results = run_phases(supervisor, phases, server)
+            limiter = shared_object("rate_limiter", supervisor.state_address).stats()
+            cache = shared_object("response_cache", supervisor.state_address).stats()
+        finally:
+            supervisor.shutdown()
+
+    (first, after_first), (second, after_second), (burst, _) = results[1], results[2], results[3]
+    answer = "Here is a very fake answer to: Should I buy a boat?"
+    assert after_first == 1 and answer in first[0][0]
+    # Worker 1 got worker 0's answer without another upstream call
+    assert after_second == 1 and answer in second[1][0]
+    assert cache["hits"] >= 1
+
+    # Six requests from one user across two workers: the shared bucket lets five through
+    limited = [answer for answer in burst[0] + burst[1] if answer.startswith("🚫 Rate limit reached!")]
+    assert len(limited) == 1
+    assert limiter["rejections"] == 1
@@ -0,0 +1,112 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+
+from database import Database, StorageBackend
+from rewards import REWARD_BITS
+
+# The same tests run against every storage backend; PostgreSQL only when
+# TEST_DATABASE_URL points at a scratch database (its tables are emptied).
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def db(request, tmp_path):
+    if request.param == "sqlite":
+        backend = Database(str(tmp_path / "bot.db"))
+    else:
+        if not TEST_DATABASE_URL:
+            pytest.skip("TEST_DATABASE_URL not set")
+        from postgres_database import PostgresDatabase
+        backend = PostgresDatabase(TEST_DATABASE_URL, pool_size=2)
+        with backend.get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("TRUNCATE user_streaks, user_preferences, guild_members")
+    yield backend
+    backend.close()
+
+def set_streak(db, user_id, streak, last_use, rewards_mask=0):
+    db.save_streaks([(user_id, streak, streak, last_use, rewards_mask)])
+
+def test_load_and_touch_user_reads_preferences_and_bumps_streak(db):
+    db.save_user_preference(1, "dank_memer", {"streak_display": "off"})
+
+    first = db.load_and_touch_user(1)
+    assert first.default_persona == "dank_memer"
+    assert first.custom_settings == {"streak_display": "off"}
+    assert (first.previous_streak, first.streak, first.new_rewards_mask) == (0, 1, 0)
+
+    second = db.load_and_touch_user(1)
+    assert (second.previous_streak, second.streak) == (1, 2)
+    assert tuple(db.get_user_streak(1)) == (2, 2, 0)
+
+def test_new_rewards_are_only_reported_once(db):
+    db.load_and_touch_user(7)
+    set_streak(db, 7, 4, datetime.now())
+
+    unlocked = db.load_and_touch_user(7)
+    assert unlocked.streak == 5
+    assert unlocked.new_rewards_mask == REWARD_BITS["meme_lord"]
+    assert unlocked.rewards_mask == REWARD_BITS["meme_lord"]
+
+    again = db.load_and_touch_user(7)
+    assert again.new_rewards_mask == 0
+    assert again.rewards_mask == REWARD_BITS["meme_lord"]
+
+def test_streak_resets_after_a_day_but_keeps_rewards(db):
+    set_streak(db, 3, 5, datetime.now() - timedelta(days=2), REWARD_BITS["meme_lord"])
+
+    state = db.load_and_touch_user(3)
+    assert (state.streak, state.highest_streak) == (1, 5)
+    assert state.rewards_mask == REWARD_BITS["meme_lord"]
+    assert state.new_rewards_mask == 0
+    assert state.default_persona is None and state.custom_settings == {}
+
+def test_save_streaks_upserts_a_batch(db):
+    last_use = datetime(2026, 1, 2, 3, 4, 5, 678)
+    set_streak(db, 1, 9, last_use)
+    db.save_streaks([(user_id, user_id, user_id * 2, last_use, 1) for user_id in range(1, 1201)])
+
+    assert tuple(db.get_user_streak(1)) == (1, 2, 1)
+    assert tuple(db.get_user_streak(1200)) == (1200, 2400, 1)
+    assert db.load_user(5) == (None, {}, 5, 10, last_use, 1)
+    assert db.load_user(99999) == (None, {}, 0, 0, None, 0)
+
+def test_preferences_keep_persona_when_only_settings_change(db):
+    assert db.save_user_preference(4, "cynical_vc", {"response_style": "fancy"})
+    assert db.save_user_preference(4, None, {"response_style": "minimal"})
+    assert db.get_user_preferences(4) == ("cynical_vc", {"response_style": "minimal"})
+    assert db.get_user_preferences(5) == (None, {})
+
+def test_top_streaks_rank_globally_and_per_guild(db):
+    now = datetime.now()
+    db.save_streaks(
+        [(1, 3, 9, now, 0), (2, 7, 7, now, 0), (3, 5, 5, now, 0), (4, 8, 8, now - timedelta(days=2), 0)],
+        members=[(10, 1), (10, 3), (20, 2), (10, 3)]
+    )
+    db.load_and_touch_user(4, guild_id=20)  # Lapsed streak restarts at 1
+
+    assert [row[:2] for row in db.top_streaks("current", 2)] == [(2, 7), (3, 5)]
+    assert [row[:2] for row in db.top_streaks("highest", 10)] == [(1, 9), (4, 8), (2, 7), (3, 5)]
+    assert [row[:2] for row in db.top_streaks("current", 10, guild_id=10)] == [(3, 5), (1, 3)]
+    assert [row[:2] for row in db.top_streaks("highest", 10, guild_id=20)] == [(4, 8), (2, 7)]
+    assert db.top_streaks("current", 10, guild_id=30) == []
+
+def test_incomplete_backends_fail_when_created():
+    class LoadOnly(StorageBackend):
+        def load_user(self, user_id: int) -> tuple:
+            return None, {}, 0, 0, None, 0
+
+    with pytest.raises(TypeError, match="save_streaks"):
+        LoadOnly()
+
+def test_update_user_streak_extends_within_a_day(db):
+    set_streak(db, 6, 1, datetime.now() - timedelta(hours=1))
+    assert tuple(db.update_user_streak(6)) == (2, 2, 0)
+    assert tuple(db.update_user_streak(7)) == (1, 1, 0)
+
+def test_a_failed_batch_writes_nothing(db):
+    last_use = datetime.now()
+    with pytest.raises(Exception):
+        db.save_streaks([(8, 1, 1, last_use, 0), (2 ** 70, 1, 1, last_use, 0)])  # Too big for the user_id column
+    assert tuple(db.get_user_streak(8)) == (0, 0, 0)
+    db.save_streaks([(8, 2, 2, last_use, 0)])  # The connection is usable again
+    assert tuple(db.get_user_streak(8)) == (2, 2, 0)
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from async_database import AsyncDatabase
+from database import Database
+from leaderboard import Leaderboard, TopK
+from user_state import UserStateCache
+
+def test_top_k_tracks_the_best_scores():
+    board = TopK(2, [(1, 5)])
+    assert board.exhaustive
+    board.update(2, 3)
+    assert board.update(3, 4) == 2  # Pushes the lowest off
+    assert board.entries() == [(1, 5), (3, 4)]
+    assert not board.exhaustive
+
+    board.update(3, 9)
+    assert board.entries() == [(3, 9), (1, 5)] and not board.stale
+    board.update(1, 1)  # Someone off the board may now rank higher
+    assert board.stale
+
+def test_boards_follow_streaks_without_reloading(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    now = datetime.now()
+    db.save_streaks([(1, 4, 4, now, 0), (2, 6, 6, now, 0), (3, 2, 2, now - timedelta(days=3), 0)],
+                    members=[(10, 1), (10, 3)])
+
+    async def scenario():
+        users = UserStateCache(AsyncDatabase(db))
+        board = Leaderboard(users.db, size=2, flush=users.flush)
+        assert await board.top("current") == [(2, 6), (1, 4)]
+        assert await board.top("current", guild_id=10) == [(1, 4)]  # User 3's streak has lapsed
+        assert await board.top("highest", guild_id=10) == [(1, 4), (3, 2)]
+
+        for _ in range(3):
+            state = await users.touch(3, guild_id=10)
+            board.record(3, 10, state.streak, state.highest_streak, datetime.now())
+        assert await board.top("current") == [(2, 6), (1, 4)]
+        assert await board.top("current", guild_id=10) == [(1, 4), (3, 3)]
+        assert await board.top("highest", guild_id=10) == [(1, 4), (3, 3)]
+        assert board.stats()["loads"] == 3
+
+        # Rendered text is reused until it expires
+        first = await board.text("current")
+        board.record(1, None, 9, 9, datetime.now())
+        assert await board.text("current") == first
+        board._rendered.clear()
+        assert "<@1> — 9" in await board.text("current")
+        assert board.stats()["render_hits"] == 1
+
+        # New members and streaks reach the database with the next write-back
+        await users.close()
+        assert [row[:2] for row in db.top_streaks("current", 5, guild_id=10)] == [(1, 4), (3, 3)]
+        await users.db.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import asyncio
+from aiohttp import web
+
+import utils
+from cache import ResponseCache, SingleFlight
+from config import HTTP_POOL_SIZE
+from llm_client import LLMClient, chat_body
+from personas import PERSONAS
+from rate_limit import RateLimiter
+from scheduler import LLMScheduler
+
+CONCURRENT_REQUESTS = 200
+UPSTREAM_LATENCY = 0.25  # seconds the fake server holds every request
+
+upstream_calls = 0
+
+async def fake_completion(request):
+    """Answer like the DeepSeek chat completions endpoint, after a delay."""
+    global upstream_calls
+    upstream_calls += 1
+    payload = await request.json()
+    await asyncio.sleep(UPSTREAM_LATENCY)
+    question = payload["messages"][-1]["content"]
+    return web.json_response({
+        "choices": [{"message": {"content": f"echo: {question}"}}],
+        "usage": {"total_tokens": 1}
+    })
+
+async def start_fake_server():
+    """Start the fake completion server on a free local port."""
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", fake_completion)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/v1/chat/completions"
+
+async def run_concurrent_calls(monkeypatch):
+    runner, url = await start_fake_server()
+    client = LLMClient(deepseek_url=url, deepseek_key="sk-test", huggingface_token=None)
+    monkeypatch.setattr(utils, "llm_client", client)
+
+    # Track how late a 10ms ticker wakes up while the calls are in flight
+    max_lag = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal max_lag
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            max_lag = max(max_lag, time.perf_counter() - start - 0.01)
+
+    ticker_task = asyncio.create_task(ticker())
+    try:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(
+            utils.call_llm("You are a test persona.", f"question {i}")
+            for i in range(CONCURRENT_REQUESTS)
+        ))
+        elapsed = time.perf_counter() - start
+        stats = client.pool_stats()["deepseek"]
+    finally:
+        done.set()
+        await ticker_task
+        await client.close()
+        await runner.cleanup()
+
+    return responses, elapsed, max_lag, stats
+
+def test_call_llm_runs_concurrently(monkeypatch):
+    monkeypatch.setattr(utils, "rate_limiter", RateLimiter({"provider": (CONCURRENT_REQUESTS, 1)}))
+    monkeypatch.setattr(utils, "llm_scheduler", LLMScheduler(workers=CONCURRENT_REQUESTS))
+
+    responses, elapsed, max_lag, stats = asyncio.run(run_concurrent_calls(monkeypatch))
+
+    assert responses == [f"echo: question {i}" for i in range(CONCURRENT_REQUESTS)]
+    # Serially this would take CONCURRENT_REQUESTS * UPSTREAM_LATENCY = 50s
+    assert elapsed < 10 * UPSTREAM_LATENCY
+    # The event loop keeps serving other work while requests are waiting upstream
+    assert max_lag < 0.5
+    # Connections come from the bounded keep-alive pool, not one per request
+    assert stats["created"] <= HTTP_POOL_SIZE
+    assert stats["created"] + stats["reused"] == CONCURRENT_REQUESTS
+
+async def run_identical_calls(monkeypatch):
+    runner, url = await start_fake_server()
+    client = LLMClient(deepseek_url=url, deepseek_key="sk-test", huggingface_token=None)
+    monkeypatch.setattr(utils, "llm_client", client)
+    try:
+        return await asyncio.gather(*(
+            utils.call_llm("You are a test persona.", "Same question?")
+            for _ in range(50)
+        ))
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+def test_identical_calls_share_one_upstream_request(monkeypatch):
+    monkeypatch.setattr(utils, "inflight_requests", SingleFlight())
+    monkeypatch.setattr(utils, "response_cache", ResponseCache())  # All 50 miss: none has finished yet
+    calls_before = upstream_calls
+
+    responses = asyncio.run(run_identical_calls(monkeypatch))
+
+    assert responses == ["echo: Same question?"] * 50
+    assert upstream_calls - calls_before == 1
+    assert utils.inflight_requests.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 49}
+
+async def slow_completion(request):
+    await asyncio.sleep(5)
+    return web.json_response({"choices": [{"message": {"content": "too late"}}]})
+
+async def fast_generation(request):
+    return web.json_response([{"generated_text": "<|assistant|>hedged answer"}])
+
+async def run_hedged_call(monkeypatch):
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", slow_completion)
+    app.router.add_post("/models/backup", fast_generation)
+    # Stop the slow handler as soon as the cancelled primary disconnects
+    runner = web.AppRunner(app, handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+    client = LLMClient(
+        deepseek_url=f"{base}/v1/chat/completions",
+        deepseek_key="sk-test",
+        huggingface_url=f"{base}/models/backup",
+        huggingface_token="hf-test"
+    )
+    monkeypatch.setattr(utils, "llm_client", client)
+    try:
+        start = time.perf_counter()
+        response = await utils.call_llm("You are a test persona.", "Who answers first?", cacheable=False)
+        return response, time.perf_counter() - start, client.latency_stats()
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+def test_slow_primary_is_hedged_with_backup(monkeypatch):
+    monkeypatch.setattr(utils, "HEDGE_REQUESTS", True)
+    monkeypatch.setattr(utils, "HEDGE_DELAY", 0.1)
+
+    response, elapsed, latency = asyncio.run(run_hedged_call(monkeypatch))
+
+    assert response == "hedged answer"
+    assert elapsed < 2
+    assert latency["huggingface"]["wins"] == 1
+    assert latency["deepseek"]["samples"] == 0
+
+class FakeMessage:
+    def __init__(self, content):
+        self.edits = [content]
+
+    async def edit(self, content):
+        self.edits.append(content)
+
+class FakeFollowup:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content, wait=False):
+        message = FakeMessage(content)
+        self.messages.append(message)
+        return message
+
+class FakeInteraction:
+    def __init__(self):
+        self.followup = FakeFollowup()
+
+async def fake_stream(request):
+    """Answer like the DeepSeek endpoint with stream=true, one token at a time, then usage."""
+    payload = await request.json()
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for token in ["Hello", " there", ", streamer"]:
+        event = {"choices": [{"delta": {"content": token}}]}
+        await response.write(f"data: {json.dumps(event)}\n\n".encode())
+        await asyncio.sleep(0.05)
+    if payload["stream_options"]["include_usage"]:
+        usage = {"prompt_cache_hit_tokens": 64, "prompt_cache_miss_tokens": 6, "completion_tokens": 3}
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+    await response.write(b"data: [DONE]\n\n")
+    return response
+
+async def run_streamed_response(monkeypatch):
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", fake_stream)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/v1/chat/completions"
+
+    client = LLMClient(deepseek_url=url, deepseek_key="sk-test", huggingface_token=None)
+    monkeypatch.setattr(utils, "llm_client", client)
+    interaction = FakeInteraction()
+    try:
+        await utils.send_streamed_response(
+            interaction,
+            utils.stream_llm("You are a test persona.", "hi"),
+            header="**[test]** ",
+            footer="\n🎯 Current Streak: 1"
+        )
+    finally:
+        await client.close()
+        await runner.cleanup()
+    return interaction, client.token_stats()["deepseek"]
+
+def test_streamed_response_edits_one_message(monkeypatch):
+    monkeypatch.setattr(utils, "STREAM_EDIT_INTERVAL", 0)
+
+    interaction, tokens = asyncio.run(run_streamed_response(monkeypatch))
+
+    assert len(interaction.followup.messages) == 1
+    edits = interaction.followup.messages[0].edits
+    # The first token is shown on its own before the rest of the stream arrives
+    assert edits[0] == "**[test]** Hello"
+    assert edits[-1] == "**[test]** Hello there, streamer\n🎯 Current Streak: 1"
+    # Read from the usage-only event at the end of the stream
+    assert tokens == {"prompt_cache_hit": 64, "prompt_cache_miss": 6, "prompt_cache_hit_ratio": 0.914, "completion": 3}
+
+def test_requests_for_a_persona_share_a_byte_identical_prefix():
+    prompt = PERSONAS["cynical_vc"]["prompt"]
+    first = chat_body(prompt, "Is my startup a unicorn?")
+    second = chat_body(prompt, "What's a burn rate?", stream=True)
+
+    assert not any(line != line.strip() for line in prompt.splitlines())
+    shared = len(os.path.commonprefix([first, second]))
+    assert first[:shared].endswith(b'"role":"user","content":"')
+    assert json.loads(first)["messages"] == [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": "Is my startup a unicorn?"}
+    ]
+    assert json.loads(second)["stream"] is True
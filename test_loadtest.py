@@ -0,0 +1,32 @@
+import asyncio
+
+from loadtest import parse_args, percentile, run_load
+
+def test_percentiles_use_nearest_rank():
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) == 0.0
+
+def test_commands_run_end_to_end_against_the_fake_server():
+    options = parse_args(["--users", "10", "--requests", "4", "--latency", "0.01", "--jitter", "0",
+                          "--discord-latency", "0", "--seed", "3"])
+    report = asyncio.run(run_load(options))
+
+    assert report["total"] == 40
+    assert sum(row["count"] for row in report["commands"].values()) == 40
+    assert all(row["failed"] == 0 for row in report["commands"].values())
+    # Every question is new, so each /smelty made exactly one upstream call
+    assert report["server"]["requests"] == report["commands"]["smelty"]["count"]
+    smelty = report["commands"]["smelty"]
+    assert smelty["p50"] <= smelty["p95"] <= smelty["p99"]
+
+def test_upstream_failures_are_reported_as_failed_commands():
+    options = parse_args(["--users", "5", "--requests", "4", "--latency", "0.01", "--jitter", "0",
+                          "--discord-latency", "0", "--rate-limit-rate", "1", "--seed", "4"])
+    report = asyncio.run(run_load(options))
+
+    smelty = report["commands"]["smelty"]
+    assert smelty["failed"] == smelty["count"] > 0
+    assert report["server"]["rate_limited"] == report["server"]["requests"]
+    assert all(row["failed"] == 0 for command, row in report["commands"].items() if command != "smelty")
@@ -0,0 +1,42 @@
+import io
+import json
+import logging
+
+import config
+from logs import DebugSampler, parse_levels, setup_logging, stop_logging
+
+def restore_logging():
+    setup_logging(config.LOG_LEVEL, config.LOG_LEVELS, config.LOG_FORMAT, config.LOG_DEBUG_SAMPLE_RATE)
+
+def test_records_are_written_as_json_lines_by_the_writer_thread():
+    stream = io.StringIO()
+    try:
+        setup_logging("WARNING", "llm_client=DEBUG", fmt="json", stream=stream)
+        logging.getLogger("llm_client").debug("Payload length: %s characters", 1234)
+        logging.getLogger("bot").info("Dropped: %s", "root level is WARNING")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("bot").error("Failed for user %s", 7, exc_info=True)
+        stop_logging()  # Drains the queue
+    finally:
+        logging.getLogger("llm_client").setLevel(logging.NOTSET)
+        restore_logging()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(e["logger"], e["level"], e["msg"]) for e in entries] == [
+        ("llm_client", "DEBUG", "Payload length: 1234 characters"),
+        ("bot", "ERROR", "Failed for user 7")
+    ]
+    assert "ValueError: boom" in entries[1]["exc"]
+
+def test_debug_records_are_sampled():
+    sampler = DebugSampler(0.1)
+    debug = logging.LogRecord("x", logging.DEBUG, __file__, 1, "m", (), None)
+    warning = logging.LogRecord("x", logging.WARNING, __file__, 1, "m", (), None)
+    kept = sum(sampler.filter(debug) for _ in range(10000))
+    assert 700 < kept < 1300
+    assert all(sampler.filter(warning) for _ in range(100))
+
+def test_module_levels_are_parsed():
+    assert parse_levels("llm_client=debug, discord=WARNING,,junk") == {"llm_client": "DEBUG", "discord": "WARNING"}
@@ -0,0 +1,46 @@
+import threading
+
+import metrics
+from metrics import Counter, Histogram
+
+def test_counter_shards_are_summed_across_threads():
+    counter = Counter("test_events_total", "Events", ("kind",))
+
+    def record():
+        for _ in range(1000):
+            counter.inc("a")
+        counter.inc("b", amount=2)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value("a") == 4000
+    assert counter.value("b") == 8
+    assert 'test_events_total{kind="a"} 4000' in metrics.render()
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_wait_seconds", "Waits", ("lane",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, "fast")
+    with histogram.time("slow"):
+        pass
+
+    text = metrics.render()
+    assert "# TYPE test_wait_seconds histogram" in text
+    assert 'test_wait_seconds_bucket{lane="fast",le="0.1"} 2' in text
+    assert 'test_wait_seconds_bucket{lane="fast",le="1.0"} 3' in text
+    assert 'test_wait_seconds_bucket{lane="fast",le="+Inf"} 4' in text
+    assert 'test_wait_seconds_sum{lane="fast"} 3.65' in text
+    assert 'test_wait_seconds_count{lane="slow"} 1' in text
+
+def test_metrics_route_serves_prometheus_text():
+    from app import app
+    metrics.RATE_LIMIT_REJECTIONS.inc("request")
+
+    response = app.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    assert 'smelty_rate_limit_rejections_total{scope="request"}' in response.get_data(as_text=True)
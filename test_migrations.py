@@ -0,0 +1,56 @@
+import sqlite3
+import pytest
+
+from database import Database
+from migrations import MIGRATIONS, migrate, schema_version
+from rewards import REWARD_BITS
+
+def test_restart_keeps_existing_streaks(tmp_path):
+    path = str(tmp_path / "bot.db")
+    db = Database(path)
+    db.update_user_streak(1)
+    db.save_user_preference(1, "dank_memer")
+    db.close()
+
+    db = Database(path)
+    assert db.get_user_streak(1)[0] == 1
+    assert db.get_user_preferences(1)[0] == "dank_memer"
+    with db.get_connection() as conn:
+        assert schema_version(conn) == MIGRATIONS[-1][0]
+    db.close()
+
+def test_pre_migration_database_is_adopted(tmp_path):
+    path = str(tmp_path / "bot.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE user_streaks (user_id INTEGER PRIMARY KEY, streak_count INTEGER DEFAULT 0, "
+                 "highest_streak INTEGER DEFAULT 0, last_use TIMESTAMP, unlocked_rewards TEXT DEFAULT '[]')")
+    conn.execute("INSERT INTO user_streaks VALUES (4, 12, 12, '2026-01-01 00:00:00', '[\"meme_lord\", \"dank_memer\"]')")
+    conn.execute("INSERT INTO user_streaks VALUES (5, 3, 3, '2026-01-01 00:00:00', '[]')")
+    conn.commit()
+
+    assert migrate(conn) == MIGRATIONS[-1][0]
+    rows = conn.execute("SELECT user_id, streak_count, rewards_mask FROM user_streaks ORDER BY user_id").fetchall()
+    assert rows == [(4, 12, REWARD_BITS["meme_lord"] | REWARD_BITS["dank_memer"]), (5, 3, 0)]
+    conn.close()
+
+def test_failed_migration_leaves_schema_untouched(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "bot.db"))
+    migrate(conn)
+    version = schema_version(conn)
+
+    broken = MIGRATIONS + [
+        (version + 1, "Add an index", ["CREATE INDEX idx_streak ON user_streaks (streak_count)"]),
+        (version + 2, "Broken", ["ALTER TABLE no_such_table ADD COLUMN x INTEGER"])
+    ]
+    with pytest.raises(sqlite3.OperationalError):
+        migrate(conn, broken)
+
+    assert schema_version(conn) == version
+    indexes = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_streak'").fetchall()
+    assert indexes == []
+
+    # Fixed and re-run: applied once, and a second run is a no-op
+    fixed = broken[:-1]
+    assert migrate(conn, fixed) == version + 1
+    assert migrate(conn, fixed) == version + 1
+    conn.close()
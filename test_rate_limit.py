@@ -0,0 +1,55 @@
+from rate_limit import RateLimiter
+
+LIMITS = {
+    "user": (3, 1.0),  # Bursts of 3, one token a second
+    "guild": (5, 0.5)
+}
+
+def test_bursts_up_to_capacity_then_waits_for_refill():
+    limiter = RateLimiter(LIMITS)
+    assert [limiter.acquire(("user", 1), now=0) for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire(("user", 1), now=0) == 1.0
+    assert limiter.acquire(("user", 1), now=0.5) == 0.5
+    assert limiter.acquire(("user", 1), now=1.0) == 0
+    assert limiter.stats()["rejections"] == 2
+
+def test_refill_never_exceeds_capacity():
+    limiter = RateLimiter(LIMITS)
+    limiter.acquire(("user", 1), now=0)
+    allowed = [limiter.acquire(("user", 1), now=1000) == 0 for _ in range(4)]
+    assert allowed == [True, True, True, False]
+
+def test_keys_are_limited_independently():
+    limiter = RateLimiter(LIMITS)
+    for _ in range(3):
+        limiter.acquire(("user", 1), now=0)
+    assert limiter.acquire(("user", 1), now=0) > 0
+    assert limiter.acquire(("user", 2), now=0) == 0
+
+def test_multi_key_acquire_takes_nothing_when_any_bucket_is_empty():
+    limiter = RateLimiter(LIMITS)
+    for user_id in range(5):
+        assert limiter.acquire(("user", user_id), ("guild", 1), now=0) == 0
+
+    # The guild is empty: refused for as long as the guild bucket needs, and the user keeps its tokens
+    assert limiter.acquire(("user", 9), ("guild", 1), now=0) == 2.0
+    assert [limiter.acquire(("user", 9), now=0) for _ in range(3)] == [0, 0, 0]
+
+def test_idle_buckets_are_dropped_once_refilled():
+    limiter = RateLimiter(LIMITS)
+    limiter.acquire(("user", 1), now=0)
+    limiter.acquire(("user", 2), now=0.5)
+    assert len(limiter) == 2
+    limiter.acquire(("user", 3), now=1.0)  # User 1 has refilled; user 2 has not
+    assert len(limiter) == 2
+    assert limiter.acquire(("user", 2), now=1.0) == 0 and len(limiter) == 2
+
+def test_bucket_count_is_capped_at_max_buckets():
+    limiter = RateLimiter(LIMITS, max_buckets=100)
+    for user_id in range(1000):
+        limiter.acquire(("user", user_id), now=0)
+    assert len(limiter) == 100
+    # The most recently used buckets are the ones kept
+    assert limiter.acquire(("user", 999), now=0) == 0
+    assert limiter.acquire(("user", 999), now=0) == 0
+    assert limiter.acquire(("user", 999), now=0) == 1.0
@@ -0,0 +1,23 @@
+from personas import PERSONAS, REWARD_PERSONAS, get_persona
+from rewards import REWARD_BITS, REWARD_TIERS, newly_unlocked, next_tier, reward_names, unlocked_by
+
+def test_tiers_unlock_by_threshold():
+    assert unlocked_by(4) == 0
+    assert reward_names(unlocked_by(5)) == ["meme_lord"]
+    assert reward_names(unlocked_by(30)) == ["meme_lord", "dank_memer", "poetry_master", "chaos_agent"]
+    assert unlocked_by(1000) == (1 << len(REWARD_TIERS)) - 1
+
+def test_only_missing_rewards_are_new():
+    have = REWARD_BITS["meme_lord"]
+    assert reward_names(newly_unlocked(15, have)) == ["dank_memer", "poetry_master"]
+    assert newly_unlocked(15, unlocked_by(15)) == 0
+
+def test_next_tier():
+    assert next_tier(0).streak == 5
+    assert next_tier(5).name == "dank_memer"
+    assert next_tier(100) is None
+
+def test_reward_personas_need_their_bit():
+    assert get_persona("chaos_agent", REWARD_BITS["meme_lord"]) is PERSONAS["cynical_vc"]
+    assert get_persona("chaos_agent", unlocked_by(25)) is REWARD_PERSONAS["chaos_agent"]
+    assert all(name in REWARD_BITS for name in REWARD_PERSONAS)
@@ -0,0 +1,159 @@
+import asyncio
+import pytest
+import bot
+import utils
+from loadtest import FakeLLMServer, MockInteraction, offline_bot
+from scheduler import HIGH, NORMAL, DeadlineExceeded, LLMScheduler, QueueFull, parse_weights
+
+def test_expired_waiters_leave_the_queue():
+    async def scenario():
+        scheduler = LLMScheduler(workers=1, max_queue=1, deadline=0.05)
+        await scheduler.acquire()
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.acquire()
+        stats = scheduler.stats()
+
+        # The expired ticket no longer takes the only queue place
+        waiter = asyncio.ensure_future(scheduler.acquire(deadline=1))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await waiter
+        return stats, scheduler.stats()
+
+    expired, served = asyncio.run(scenario())
+    assert expired == {"active": 1, "queued": 0, "served": 1, "rejected": 0, "expired": 1}
+    assert served == {"active": 1, "queued": 0, "served": 2, "rejected": 0, "expired": 1}
+
+def test_cancelled_waiters_leave_the_queue():
+    async def scenario():
+        scheduler = LLMScheduler(workers=1, max_queue=5)
+        await scheduler.acquire()
+        waiters = [asyncio.ensure_future(scheduler.acquire(guild_id=1)) for _ in range(3)]
+        await asyncio.sleep(0)
+        queued = scheduler.queued
+        waiters[1].cancel()
+        await asyncio.gather(waiters[1], return_exceptions=True)
+        after_cancel = scheduler.queued
+
+        scheduler.release()
+        await waiters[0]
+        scheduler.release()
+        await waiters[2]
+        return queued, after_cancel, scheduler.stats()
+
+    queued, after_cancel, stats = asyncio.run(scenario())
+    assert (queued, after_cancel) == (3, 2)
+    assert stats["queued"] == 0 and stats["active"] == 1 and stats["served"] == 3
+
+def test_cancelling_during_the_queue_callback_frees_the_ticket_or_slot():
+    async def scenario(grant_first: bool):
+        scheduler = LLMScheduler(workers=1, max_queue=5)
+        await scheduler.acquire()
+        editing = asyncio.Event()
+
+        async def slow_edit(position):
+            editing.set()
+            await asyncio.sleep(10)  # A Discord edit that never finishes
+
+        waiter = asyncio.ensure_future(scheduler.acquire(on_queued=slow_edit))
+        await editing.wait()
+        if grant_first:
+            scheduler.release()  # The slot goes to the waiter while its callback runs
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        if not grant_first:
+            scheduler.release()
+
+        await asyncio.wait_for(scheduler.acquire(), 1)  # The only slot is free again
+        return scheduler.stats()
+
+    for grant_first in (False, True):
+        stats = asyncio.run(scenario(grant_first))
+        assert stats["queued"] == 0 and stats["active"] == 1
+
+def test_full_queue_refuses_new_requests():
+    async def scenario():
+        scheduler = LLMScheduler(workers=1, max_queue=2)
+        await scheduler.acquire()
+        waiters = [asyncio.ensure_future(scheduler.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            await scheduler.acquire()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 1
+    assert stats["queued"] == 0
+
+def test_high_lane_goes_first_without_starving_normal():
+    async def scenario():
+        scheduler = LLMScheduler(workers=1, max_queue=20)
+        await scheduler.acquire()
+        order = []
+
+        async def request(name, priority):
+            await scheduler.acquire(priority=priority)
+            order.append(name)
+            scheduler.release()
+
+        tasks = [asyncio.ensure_future(request("normal", NORMAL))]
+        tasks += [asyncio.ensure_future(request(f"high{i}", HIGH)) for i in range(6)]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order == ["high0", "high1", "high2", "high3", "normal", "high4", "high5"]
+
+def test_guilds_take_turns_by_weight():
+    async def scenario():
+        scheduler = LLMScheduler(workers=1, max_queue=20, weights={1: 2})
+        await scheduler.acquire()
+        order = []
+
+        async def request(guild_id):
+            await scheduler.acquire(guild_id=guild_id)
+            order.append(guild_id)
+            scheduler.release()
+
+        tasks = [asyncio.ensure_future(request(1)) for _ in range(4)]
+        tasks += [asyncio.ensure_future(request(2)) for _ in range(2)]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == [1, 1, 2, 1, 1, 2]
+
+def test_weights_are_parsed_from_config():
+    assert parse_weights("123=3, 456=2,,bad") == {123: 3, 456: 2}
+    assert parse_weights("") == {}
+
+def test_queue_position_message_is_removed_once_answered(monkeypatch):
+    scheduler = LLMScheduler(workers=1)
+    monkeypatch.setattr(utils, "llm_scheduler", scheduler)
+
+    async def scenario():
+        server = FakeLLMServer(latency=0, jitter=0)
+        await server.start()
+        try:
+            async with offline_bot(server):
+                await scheduler.acquire()  # Someone else holds the only slot
+                interaction = MockInteraction(user_id=1, guild_id=1)
+                answer = asyncio.ensure_future(bot.smelty.callback(interaction, question="Why?", mode="cynical_vc"))
+                while not interaction.messages:
+                    await asyncio.sleep(0.01)
+                scheduler.release()
+                await answer
+        finally:
+            await server.stop()
+        return interaction
+
+    interaction = asyncio.run(scenario())
+    assert interaction.messages[0].startswith("⏳") and "#1 in line" in interaction.messages[0]
+    assert not interaction.failed
+    assert interaction.original_deleted
@@ -0,0 +1,71 @@
+import os
+import signal
+import subprocess
+import sys
+from database import Database
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def run_python(code: str, cwd: str, **env) -> subprocess.CompletedProcess:
+    environ = {k: v for k, v in os.environ.items() if k not in ("DISCORD_TOKEN", "DEEPSEEK_API_KEY")}
+    environ.update(env, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=environ, capture_output=True, text=True, timeout=60)
+
+def test_importing_config_has_no_side_effects(tmp_path):
+    result = run_python(
+        "import logging, config; print(len(logging.getLogger().handlers), config.DISCORD_TOKEN)",
+        str(tmp_path)
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["0", "None"]  # No exit over missing keys, no log handlers
+
+    result = run_python("import config; config.init()", str(tmp_path))
+    assert result.returncode == 1
+    assert "Missing required API keys: DISCORD_TOKEN, DEEPSEEK_API_KEY" in result.stderr
+
+def test_importing_bot_does_not_open_the_database(tmp_path):
+    result = run_python(
+        "import bot; print(bot.db); bot.init_storage(); print(type(bot.db.db).__name__)",
+        str(tmp_path),
+        DISCORD_TOKEN="test-discord-token",
+        DEEPSEEK_API_KEY="sk-test"
+    )
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.split()
+    assert lines[0] == "None"
+    assert lines[1] == "Database"
+    assert (tmp_path / "discord_bot.db").exists()
+
+SIGINT_SCRIPT = """
+import asyncio
+import bot
+
+async def run_until_interrupted(token):
+    await bot.user_states.touch(1, 1)  # A streak that only the shutdown write-back saves
+    print("ready", flush=True)
+    await asyncio.Event().wait()
+
+async def no_warm_up():
+    pass
+
+bot.client.start = run_until_interrupted
+bot.llm_client.warm_up = no_warm_up
+asyncio.run(bot.start_bot())
+"""
+
+def test_ctrl_c_still_writes_back_user_state(tmp_path):
+    environ = dict(os.environ, PYTHONPATH=ROOT, DISCORD_TOKEN="test-discord-token", DEEPSEEK_API_KEY="sk-test")
+    process = subprocess.Popen(
+        [sys.executable, "-c", SIGINT_SCRIPT], cwd=str(tmp_path), env=environ,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        assert process.stdout.readline().strip() == "ready"
+        process.send_signal(signal.SIGINT)
+        _, stderr = process.communicate(timeout=30)
+    finally:
+        process.kill()
+
+    assert "User state cache stats" in stderr
+    streak = Database(str(tmp_path / "discord_bot.db")).get_user_streak(1)
+    assert streak[0] == 1
@@ -0,0 +1,60 @@
+import json
+import asyncio
+
+import bot
+from llm_client import chat_body
+from loadtest import FakeLLMServer, MockInteraction, offline_bot
+from personas import PERSONAS
+from tokens import estimate_tokens, truncate_tokens
+
+def test_estimates_err_on_the_high_side_of_bpe_counts():
+    # Ten short words and a question mark: at least a token each
+    assert 11 <= estimate_tokens("Should I quit my job to build an AI startup?") <= 15
+    assert estimate_tokens("2025") == 2
+    assert estimate_tokens("🌟🌟") == 2
+    assert estimate_tokens("   ") == 0
+
+def test_truncation_stops_at_a_word_within_the_limit():
+    text = "burn rate " * 200
+    cut = truncate_tokens(text, 50)
+    assert estimate_tokens(cut) <= 50
+    assert cut.endswith("…") and text.startswith(cut[:-1])
+    assert cut[-2] != " "
+    assert truncate_tokens("short question", 50) == "short question"
+
+def test_answer_budget_follows_the_cache_friendly_prefix():
+    prompt = PERSONAS["starry_teen"]["prompt"]
+    short = chat_body(prompt, "hi", max_tokens=PERSONAS["starry_teen"]["max_tokens"])
+    default = chat_body(prompt, "hi")
+    assert json.loads(short)["max_tokens"] == 80
+    assert json.loads(default)["max_tokens"] == 150
+    assert short.split(b'"max_tokens"')[0] == default.split(b'"max_tokens"')[0]
+
+async def ask(question: str, mode: str) -> tuple:
+    server = FakeLLMServer(latency=0, jitter=0)
+    await server.start()
+    try:
+        async with offline_bot(server):
+            interaction = MockInteraction(user_id=1, guild_id=1)
+            await bot.smelty.callback(interaction, question=question, mode=mode)
+    finally:
+        await server.stop()
+    return interaction, server.last_request
+
+def test_oversized_questions_are_trimmed_and_short_budgets_are_not_streamed(monkeypatch):
+    monkeypatch.setattr(bot, "MAX_QUESTION_TOKENS", 20)
+    interaction, request = asyncio.run(ask("Is this too long? " * 20, "starry_teen"))
+
+    assert request["max_tokens"] == 80
+    assert request["stream"] is False  # Under STREAM_MIN_TOKENS: one followup, no edits
+    assert estimate_tokens(request["messages"][-1]["content"]) <= 20
+    assert len(interaction.messages) == 1
+    assert "✂️ Your question was trimmed to fit." in interaction.messages[0]
+
+def test_oversized_questions_can_be_rejected(monkeypatch):
+    monkeypatch.setattr(bot, "MAX_QUESTION_TOKENS", 20)
+    monkeypatch.setattr(bot, "QUESTION_OVERFLOW", "reject")
+    interaction, request = asyncio.run(ask("Is this too long? " * 20, "cynical_vc"))
+
+    assert request is None
+    assert interaction.messages[0].startswith("📏")
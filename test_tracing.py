@@ -0,0 +1,80 @@
+import asyncio
+import json
+import time
+
+import tracing
+from async_database import AsyncDatabase
+from database import Database
+from tracing import JsonlExporter, OtlpExporter, Tracer, span, start_trace
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+        self.exported = self.failed = 0
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+def test_spans_follow_the_interaction_into_tasks_and_database_threads(tmp_path, monkeypatch):
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, "tracer", Tracer(1.0, 0, exporter))
+    db = AsyncDatabase(Database(str(tmp_path / "bot.db")))
+
+    async def provider():
+        with span("llm.deepseek") as s:
+            s.set(tokens=12)
+
+    async def scenario():
+        with start_trace("smelty", 1234, user_id=7):
+            await db.get_user_streak(7)
+            with span("call_llm"):
+                await asyncio.ensure_future(provider())
+        await db.close()
+
+    asyncio.run(scenario())
+    spans = {s.name: s for s in exporter.spans}
+    root = spans["smelty"]
+    assert root.trace.trace_id == f"{1234:032x}" and root.parent_id is None
+    assert spans["db.get_user_streak"].parent_id == root.span_id
+    assert spans["llm.deepseek"].parent_id == spans["call_llm"].span_id
+    assert spans["llm.deepseek"].attributes == {"tokens": 12}
+
+def test_unsampled_traces_are_kept_only_when_slow(monkeypatch):
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, "tracer", Tracer(0.0, 0.05, exporter))
+
+    with start_trace("fast"):
+        with span("stage"):
+            pass
+    assert exporter.spans == []
+
+    with start_trace("slow"):
+        with span("stage"):
+            time.sleep(0.06)
+    assert [s.name for s in exporter.spans] == ["stage", "slow"]
+    assert span("outside").__enter__() is tracing.NOOP_SPAN
+
+def test_exported_spans_render_as_a_waterfall(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    tracer = Tracer(1.0, 0, JsonlExporter(path))
+    with tracer.start_trace("smelty", 99):
+        with tracer.span("discord.defer"):
+            time.sleep(0.01)
+        try:
+            with tracer.span("call_llm"):
+                raise TimeoutError()
+        except TimeoutError:
+            pass
+    tracer.close()
+
+    with open(path) as f:
+        spans = [json.loads(line) for line in f]
+    assert {s["name"] for s in spans} == {"smelty", "discord.defer", "call_llm"}
+    text = tracing.waterfall(spans)
+    assert text.splitlines()[1].startswith("smelty")
+    assert "  call_llm ✗" in text
+
+    payload = OtlpExporter().payload([tracing.Span(tracing.Trace("ab" * 16), "x", None, {"n": 1})])
+    otlp_span = payload["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert otlp_span["traceId"] == "ab" * 16
+    assert otlp_span["attributes"] == [{"key": "n", "value": {"intValue": "1"}}]
@@ -0,0 +1,102 @@
+import asyncio
+
+from async_database import AsyncDatabase
+from database import Database
+from user_state import UserStateCache
+
+def test_streaks_are_written_back_in_batches(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+
+    async def scenario():
+        users = UserStateCache(AsyncDatabase(db), flush_batch=3)
+        await users.touch(1)
+        await users.touch(1)
+        await users.touch(2)
+        assert await users.get_streak(1) == (2, 2, 0)
+        assert db.get_user_streak(1) == (0, 0, 0)  # Not written yet
+
+        await users.touch(3)  # Third dirty user triggers a write-back
+        assert [db.get_user_streak(u)[0] for u in (1, 2, 3)] == [2, 1, 1]
+        assert users.stats()["flushes"] == 1
+
+        await users.touch(1)
+        await users.close()
+        assert db.get_user_streak(1)[0] == 3
+        await users.db.close()
+
+    asyncio.run(scenario())
+
+def test_evicted_users_are_flushed_and_reloaded(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    db.save_user_preference(1, "dank_memer", {"streak_display": "off"})
+
+    async def scenario():
+        users = UserStateCache(AsyncDatabase(db), max_users=2, flush_batch=100)
+        first = await users.touch(1)
+        assert first.default_persona == "dank_memer"
+        await users.touch(2)
+        await users.touch(3)  # Pushes user 1 out, writing its streak first
+        assert len(users) == 2
+        assert db.get_user_streak(1)[0] == 1
+
+        again = await users.touch(1)
+        assert (again.previous_streak, again.streak) == (1, 2)
+        assert again.custom_settings == {"streak_display": "off"}
+        await users.close()
+        await users.db.close()
+
+    asyncio.run(scenario())
+
+def test_preferences_are_written_through(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+
+    async def scenario():
+        users = UserStateCache(AsyncDatabase(db))
+        await users.touch(5)
+        assert await users.save_preferences(5, "cynical_vc", {"response_style": "fancy"})
+        assert await users.get_preferences(5) == ("cynical_vc", {"response_style": "fancy"})
+        assert db.get_user_preferences(5) == ("cynical_vc", {"response_style": "fancy"})
+        await users.db.close()
+
+    asyncio.run(scenario())
+
+def test_concurrent_first_touches_load_the_user_once(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+
+    async def scenario():
+        async_db = AsyncDatabase(db)
+        users = UserStateCache(async_db)
+        states = await asyncio.gather(*(users.touch(9) for _ in range(5)))
+        assert sorted(s.streak for s in states) == [1, 2, 3, 4, 5]
+        assert async_db.stats() == {"calls": 1, "reads_coalesced": 4}
+        await async_db.close()
+
+    asyncio.run(scenario())
+
+def test_periodic_flush_keeps_running_after_an_error(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+
+    async def scenario():
+        users = UserStateCache(AsyncDatabase(db), flush_interval=0.01)
+        calls = []
+        flush = users.flush
+
+        async def flaky_flush():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            return await flush()
+
+        users.flush = flaky_flush
+        users.start()
+        await users.touch(1)
+        for _ in range(100):
+            if len(calls) >= 3:
+                break
+            await asyncio.sleep(0.01)
+        assert len(calls) >= 3  # The loop survived the failed flush
+        assert db.get_user_streak(1)[0] == 1  # Written back by a later flush
+        await users.close()
+        await users.db.close()
+
+    asyncio.run(scenario())
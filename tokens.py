@@ -0,0 +1,34 @@
+"""Local token estimates, so request sizes are known before anything is sent upstream.
+
+The estimate follows how BPE tokenizers split text rather than running
+one: about four letters of an English word per token, three digits per
+token, and one token per punctuation mark. Non-ASCII text (accents, CJK,
+emoji) is split finely by those tokenizers, so each of its characters
+counts as a token. It errs high, which is the safe side for limits.
+"""
+import re
+
+_PIECES = re.compile(r"[^\W\d_]+|\d+|\S")
+
+def _piece_tokens(piece: str) -> int:
+    if not piece.isascii():
+        return len(piece)
+    if piece.isalpha():
+        return (len(piece) + 3) // 4
+    if piece.isdigit():
+        return (len(piece) + 2) // 3
+    return 1
+
+def estimate_tokens(text: str) -> int:
+    """Roughly how many tokens text takes up in a prompt."""
+    return sum(_piece_tokens(piece) for piece in _PIECES.findall(text))
+
+def truncate_tokens(text: str, limit: int, marker: str = "…") -> str:
+    """Cut text after the last whole word that fits in limit tokens, marker included."""
+    budget = limit - estimate_tokens(marker)
+    used = 0
+    for match in _PIECES.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > budget:
+            return text[:match.start()].rstrip() + marker
+    return text
@@ -0,0 +1,325 @@
+"""Lightweight span tracing for per-interaction latency breakdowns.
+
+Usage: python tracing.py [traces.jsonl]   # print a waterfall per trace
+
+start_trace() opens the root span for one interaction and span() opens a
+child of whatever span is current. The current span lives in a ContextVar,
+so it follows the interaction into awaited coroutines, tasks it starts and
+(via contextvars.copy_context) database executor threads.
+
+A trace is kept when it is head-sampled (TRACE_SAMPLE_RATE) or its root took
+at least TRACE_SLOW_SECONDS. Kept spans are handed to a background exporter
+that writes JSON lines to TRACE_FILE or posts OTLP/JSON to a collector.
+With both settings at 0, span() is a ContextVar lookup and nothing else.
+"""
+import logging
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from config import (
+    TRACE_EXPORT,
+    TRACE_FILE,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH = 512  # spans per write or POST
+EXPORT_INTERVAL = 1.0  # seconds a partial batch may wait
+
+_current = ContextVar("smelty_span", default=None)
+
+class Trace:
+    """Spans recorded for one root until it decides whether they are kept."""
+
+    __slots__ = ("trace_id", "spans", "finished", "kept")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans = []
+        self.finished = False
+        self.kept = False
+
+class Span:
+    """One timed stage of a trace."""
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, trace: Trace, name: str, parent_id: str, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.end = None
+        self.start = time.time_ns()
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        """Seconds from start to end."""
+        return (self.end - self.start) / 1e9
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start / 1e9,
+            "duration_ms": round((self.end - self.start) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+class _NoopSpan:
+    """Stands in for a span when the interaction isn't being traced."""
+
+    def set(self, **attributes):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class BackgroundExporter:
+    """Batches finished spans on a daemon thread; subclasses implement write()."""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.failed = 0
+
+    def export(self, spans: list):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        for span in spans:
+            self._queue.put(span)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH:
+                try:
+                    span = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stopping = True
+                    break
+                batch.append(span)
+            if not batch:
+                continue
+            try:
+                self.write(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.warning("Dropped %s trace spans: %s", len(batch), e)
+
+    def write(self, spans: list):
+        raise NotImplementedError
+
+    def close(self, timeout: float = 5):
+        """Export whatever is queued, then stop the thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+class JsonlExporter(BackgroundExporter):
+    """Appends one JSON object per span to a file."""
+
+    def __init__(self, path: str = TRACE_FILE):
+        super().__init__()
+        self.path = path
+
+    def write(self, spans: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(span.as_dict(), default=str) + "\n" for span in spans)
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class OtlpExporter(BackgroundExporter):
+    """Posts spans as OTLP/JSON to a collector's HTTP endpoint."""
+
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT, service_name: str = "smelty"):
+        super().__init__()
+        self.endpoint = endpoint
+        self.service_name = service_name
+
+    def payload(self, spans: list) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "smelty"},
+                "spans": [{
+                    "traceId": span.trace.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 1,  # SPAN_KIND_INTERNAL
+                    "startTimeUnixNano": str(span.start),
+                    "endTimeUnixNano": str(span.end),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+                } for span in spans]
+            }]
+        }]}
+
+    def write(self, spans: list):
+        import requests  # Only needed when exporting over OTLP
+        response = requests.post(self.endpoint, json=self.payload(spans), timeout=5)
+        response.raise_for_status()
+
+class Tracer:
+    """Sampling settings and the exporter for this process."""
+
+    def __init__(self, sample_rate: float, slow_seconds: float, exporter: BackgroundExporter):
+        self.sample_rate = sample_rate
+        self.slow_ns = int(slow_seconds * 1e9)
+        self.exporter = exporter
+        self.traces = 0
+        self.kept = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ns > 0
+
+    def _finish(self, span: Span):
+        trace = span.trace
+        if not trace.finished:
+            trace.spans.append(span)
+        elif trace.kept:  # Outlived its root, e.g. a background task
+            self.exporter.export([span])
+
+    @contextmanager
+    def _span(self, trace: Trace, name: str, parent_id: str, attributes: dict):
+        span = Span(trace, name, parent_id, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end = time.time_ns()
+            _current.reset(token)
+            self._finish(span)
+
+    @contextmanager
+    def start_trace(self, name: str, trace_id: int = None, **attributes):
+        """Open the root span of a new trace; trace_id (e.g. the interaction ID) links it to logs."""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        sampled = random.random() < self.sample_rate
+        if not sampled and not self.slow_ns:
+            yield NOOP_SPAN
+            return
+
+        self.traces += 1
+        trace = Trace(f"{trace_id if trace_id is not None else random.getrandbits(128):032x}")
+        try:
+            with self._span(trace, name, None, attributes) as root:
+                yield root
+        finally:
+            trace.finished = True
+            if sampled or root.end - root.start >= self.slow_ns:
+                trace.kept = True
+                self.kept += 1
+                self.exporter.export(trace.spans)
+            trace.spans = []
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time a stage as a child of the current span; a no-op outside a trace."""
+        parent = _current.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+        with self._span(parent.trace, name, parent.span_id, attributes) as span:
+            yield span
+
+    def close(self):
+        self.exporter.close()
+
+    def stats(self) -> dict:
+        return {"traces": self.traces, "kept": self.kept, "exported": self.exporter.exported, "failed": self.exporter.failed}
+
+tracer = Tracer(
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_SECONDS,
+    OtlpExporter() if TRACE_EXPORT == "otlp" else JsonlExporter()
+)
+
+def start_trace(name: str, trace_id: int = None, **attributes):
+    return tracer.start_trace(name, trace_id, **attributes)
+
+def span(name: str, **attributes):
+    return tracer.span(name, **attributes)
+
+def waterfall(spans: list, width: int = 40) -> str:
+    """Render one trace's span dicts (as written by JsonlExporter) as a text waterfall."""
+    children = {}
+    for s in spans:
+        children.setdefault(s["parent_id"], []).append(s)
+    roots = children.get(None, [])
+    if not roots:
+        return ""
+    origin = min(s["start"] for s in spans)
+    total = max(s["start"] * 1000 + s["duration_ms"] for s in spans) - origin * 1000 or 1
+
+    lines = []
+
+    def draw(s, depth):
+        offset = (s["start"] - origin) * 1000
+        begin = int(offset / total * width)
+        length = max(1, int(s["duration_ms"] / total * width))
+        bar = " " * begin + "█" * min(length, width - begin)
+        label = "  " * depth + s["name"] + (" ✗" if s["error"] else "")
+        lines.append(f"{label:<32} {bar:<{width}} {offset:8.1f}ms +{s['duration_ms']:.1f}ms")
+        for child in sorted(children.get(s["span_id"], []), key=lambda c: c["start"]):
+            draw(child, depth + 1)
+
+    for root in roots:
+        lines.append(f"trace {root['trace_id']} ({root['duration_ms']:.1f}ms) {root['attributes']}")
+        draw(root, 0)
+    return "\n".join(lines)
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE
+    traces = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            s = json.loads(line)
+            traces.setdefault(s["trace_id"], []).append(s)
+    for spans in traces.values():
+        print(waterfall(spans))
+        print()
+
+if __name__ == "__main__":
+    main()
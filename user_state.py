@@ -0,0 +1,230 @@
+import logging
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from config import USER_CACHE_SIZE, USER_FLUSH_INTERVAL, USER_FLUSH_BATCH
+from async_database import AsyncDatabase
+from database import UserState, advance_streak
+
+logger = logging.getLogger(__name__)
+
+class CachedUser:
+    """Preferences and streak for one user, as last loaded or changed."""
+
+    __slots__ = ("default_persona", "custom_settings", "streak", "highest_streak", "last_use", "rewards_mask", "guild_ids")
+
+    def __init__(self, default_persona, custom_settings, streak, highest_streak, last_use, rewards_mask):
+        self.default_persona = default_persona
+        self.custom_settings = custom_settings
+        self.streak = streak
+        self.highest_streak = highest_streak
+        self.last_use = last_use
+        self.rewards_mask = rewards_mask
+        self.guild_ids = set()  # Guilds whose membership is already recorded or queued
+
+class UserStateCache:
+    """Read-through, write-behind cache of user state in front of AsyncDatabase.
+
+    Users are loaded from the database on first access and then served from
+    memory. Streak updates only mark the user dirty; dirty users are written
+    back in one transaction every flush_interval seconds, as soon as
+    flush_batch of them pile up, and on close(). Preference changes are rare
+    and written through immediately. At most max_users are kept, least
+    recently used first out; a dirty user is flushed before being dropped.
+
+    A crash loses at most the last flush_interval seconds of streak updates.
+
+    With enabled=False nothing is cached and every call goes straight to the
+    database; use that when other processes update the same users.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabase,
+        max_users: int = USER_CACHE_SIZE,
+        flush_interval: float = USER_FLUSH_INTERVAL,
+        flush_batch: int = USER_FLUSH_BATCH,
+        enabled: bool = True
+    ):
+        self.db = db
+        self.enabled = enabled
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._users = OrderedDict()  # user_id -> CachedUser; least recently used first
+        self._dirty = set()
+        self._flushing = set()  # Being written back right now
+        self._new_members = set()  # (guild_id, user_id) pairs to record with the next write-back
+        self._flush_task = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    async def _get(self, user_id: int) -> CachedUser:
+        user = self._users.get(user_id)
+        if user is not None:
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return user
+
+        self.misses += 1
+        row = await self.db.load_user(user_id)
+        user = self._users.get(user_id)
+        if user is None:  # Another caller may have loaded it while we waited
+            persona, settings, streak, highest, last_use, rewards_mask = row
+            user = CachedUser(persona, dict(settings), streak, highest, last_use, rewards_mask)
+            self._users[user_id] = user
+            await self._evict(keep=user_id)
+        return user
+
+    async def _evict(self, keep: int):
+        """Drop least recently used users, other than keep, whose state is already saved."""
+        while len(self._users) > self.max_users:
+            victim = next((
+                u for u in self._users
+                if u != keep and u not in self._dirty and u not in self._flushing
+            ), None)
+            if victim is not None:
+                del self._users[victim]
+            elif not self._dirty or not await self.flush():
+                break  # Keep unsaved state rather than lose it; retry on the next load
+
+    async def touch(self, user_id: int, guild_id: int = None) -> UserState:
+        """Record one use, in guild_id if given: advance the streak and return the user's state."""
+        if not self.enabled:
+            return await self.db.load_and_touch_user(user_id, guild_id)
+        try:
+            user = await self._get(user_id)
+        except Exception as e:
+            logger.error("Error loading user %s: %s", user_id, e)
+            return UserState(None, {}, 0, 0, 0, 0, 0)
+
+        now = datetime.now()
+        previous_streak = user.streak
+        user.streak, user.highest_streak, new_rewards = advance_streak(
+            user.streak, user.highest_streak, user.last_use, user.rewards_mask, now
+        )
+        user.last_use = now
+        user.rewards_mask |= new_rewards
+
+        # Another load may have evicted it while we waited on a flush; make sure this copy is the one saved
+        self._users[user_id] = user
+        self._dirty.add(user_id)
+        if guild_id is not None and guild_id not in user.guild_ids:
+            user.guild_ids.add(guild_id)
+            self._new_members.add((guild_id, user_id))
+        if len(self._dirty) >= self.flush_batch:
+            await self.flush()
+
+        return UserState(
+            default_persona=user.default_persona,
+            custom_settings=dict(user.custom_settings),
+            previous_streak=previous_streak,
+            streak=user.streak,
+            highest_streak=user.highest_streak,
+            rewards_mask=user.rewards_mask,
+            new_rewards_mask=new_rewards
+        )
+
+    async def get_streak(self, user_id: int) -> tuple:
+        """Get current streak info for a user: (streak, highest_streak, rewards_mask)."""
+        if not self.enabled:
+            return await self.db.get_user_streak(user_id)
+        try:
+            user = await self._get(user_id)
+        except Exception as e:
+            logger.error("Error getting user streak: %s", e)
+            return 0, 0, 0
+        return user.streak, user.highest_streak, user.rewards_mask
+
+    async def get_preferences(self, user_id: int) -> tuple:
+        """Get user preferences: (default_persona, custom_settings)."""
+        if not self.enabled:
+            persona, settings = await self.db.get_user_preferences(user_id)
+            return persona, dict(settings)  # Coalesced reads share one dict
+        try:
+            user = await self._get(user_id)
+        except Exception as e:
+            logger.error("Error getting user preferences: %s", e)
+            return None, {}
+        return user.default_persona, dict(user.custom_settings)
+
+    async def save_preferences(self, user_id: int, default_persona: str = None, custom_settings: dict = None) -> bool:
+        """Save user preferences to the database, then update the cached copy."""
+        if not await self.db.save_user_preference(user_id, default_persona, custom_settings):
+            return False
+
+        user = self._users.get(user_id)
+        if user is not None:
+            user.default_persona = default_persona or user.default_persona
+            user.custom_settings = dict(custom_settings or {})
+        return True
+
+    async def flush(self) -> bool:
+        """Write every dirty user back to the database in one transaction.
+
+        Returns False if the write failed; those users stay dirty for the next flush.
+        """
+        if not self._dirty:
+            return True
+
+        dirty, members = self._dirty, self._new_members
+        self._dirty, self._new_members = set(), set()
+        self._flushing |= dirty
+        rows = [
+            (user_id, user.streak, user.highest_streak, user.last_use, user.rewards_mask)
+            for user_id in dirty
+            if (user := self._users.get(user_id)) is not None
+        ]
+        try:
+            await self.db.save_streaks(rows, list(members))
+        except Exception as e:
+            logger.error("Failed to write back %s user streaks: %s", len(rows), e)
+            self._dirty |= dirty  # Retry on the next flush
+            self._new_members |= members
+            return False
+        except asyncio.CancelledError:
+            self._dirty |= dirty  # Writing them again is harmless
+            self._new_members |= members
+            raise
+        finally:
+            self._flushing -= dirty
+
+        self.flushes += 1
+        self.rows_written += len(rows)
+        logger.debug("Wrote back %s user streaks", len(rows))
+        return True
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:  # Keep writing back; a dead task would lose every later update
+                logger.error("Periodic user state flush failed: %s", e)
+
+    def start(self):
+        """Start the background write-back task on the running loop."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self):
+        """Stop the background task and write back anything still dirty."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "dirty": len(self._dirty),
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written
+        }
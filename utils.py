@@ -1,186 +1,418 @@
-import time
-import requests
-from functools import lru_cache
+import logging
+import math
 import asyncio
 from config import (
-    HUGGINGFACE_API_URL, 
-    HUGGINGFACE_TOKEN,
-    DEEPSEEK_API_KEY,
-    MAX_REQUESTS_PER_MINUTE,
-    DEEPSEEK_API_URL,
-    logger
+    CLUSTER_STATE_ADDRESS,
+    HEDGE_REQUESTS,
+    HEDGE_DELAY,
+    STREAM_EDIT_INTERVAL
 )
+from cache import ResponseCache, SingleFlight
+from circuit_breaker import OPEN
+from cluster import SharedObject, shared_object
+import metrics
+from metrics import DISCORD_SEND_SECONDS, LLM_REQUEST_SECONDS, RATE_LIMIT_REJECTIONS
+from llm_client import (
+    LLMClient,
+    ProviderError,
+    ProviderRateLimited,
+    ProviderTimeout,
+    generation_params
+)
+from scheduler import NORMAL, LLMScheduler
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Shared async client for the upstream completion APIs
+llm_client = LLMClient()
+
+# Recent answers, keyed by persona prompt, question and generation parameters (one per cluster)
+response_cache = shared_object("response_cache", CLUSTER_STATE_ADDRESS)
 
-# Rate limiting
-request_timestamps = []
+# Upstream requests currently being fetched, shared by identical callers
+inflight_requests = SingleFlight()
 
-def check_rate_limit():
-    """Check if we've exceeded our rate limit."""
-    current_time = time.time()
-    # Remove timestamps older than 1 minute
-    global request_timestamps
-    request_timestamps = [ts for ts in request_timestamps 
-                        if current_time - ts < 60]
+# Per-user, per-guild and per-provider token buckets (one per cluster)
+rate_limiter = shared_object("rate_limiter", CLUSTER_STATE_ADDRESS)
 
-    remaining_requests = MAX_REQUESTS_PER_MINUTE - len(request_timestamps)
-    if remaining_requests <= 0:
-        wait_time = 60 - (current_time - request_timestamps[0])
-        logger.warning(f"Rate limit exceeded. Next reset in {wait_time:.1f}s")
-        return f"🚫 Rate limit reached! Please wait {wait_time:.0f} seconds before trying again."
+# Bounded, fair-queued slots for upstream calls
+llm_scheduler = LLMScheduler()
+
+# Read when /metrics is scraped
+metrics.Gauge("smelty_llm_queue_depth", "Requests waiting for an upstream call slot", lambda: llm_scheduler.queued)
+metrics.Gauge("smelty_llm_active_calls", "Upstream calls holding a slot", lambda: llm_scheduler.active)
+
+def _cache_lookups() -> dict:
+    stats = response_cache.stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+metrics.Gauge(
+    "smelty_response_cache_lookups_total", "Response cache lookups by result",
+    _cache_lookups, labels=("result",), kind="counter"
+)
+metrics.Gauge("smelty_response_cache_hit_ratio", "Share of response cache lookups that hit",
+              lambda: response_cache.stats()["hit_ratio"])
+
+ALL_PROVIDERS_FAILED_MESSAGE = "😕 All API attempts failed. Our systems are taking a short break. Please try again in a minute! 🔄"
+PROVIDERS_BUSY_MESSAGE = "🚦 Our AI is fielding a lot of questions right now. Please try again in a minute! ⏳"
+PROVIDERS_RATE_LIMITED_MESSAGE = "🚫 Our AI is taking a quick break. Please try again in a minute! ⏳"
+PROVIDERS_TIMEOUT_MESSAGE = "⏱️ Request took too long. Let's try that again!"
+
+async def shared_call(obj, method: str, *args):
+    """obj.method(*args) for response_cache and rate_limiter, without blocking the event loop.
+
+    In a cluster they are SharedObjects, and each call is a socket round trip
+    to the state server, so it runs on a worker thread. Local objects are
+    called directly.
+    """
+    if isinstance(obj, SharedObject):
+        return await asyncio.get_running_loop().run_in_executor(None, obj.call, method, *args)
+    return getattr(obj, method)(*args)
+
+async def check_rate_limit(user_id: int, guild_id: int = None):
+    """Check whether a user (and their guild) may make another request."""
+    keys = [("user", user_id)]
+    if guild_id is not None:
+        keys.append(("guild", guild_id))
+
+    wait_time = await shared_call(rate_limiter, "acquire", *keys)
+    if wait_time:
+        RATE_LIMIT_REJECTIONS.inc("request")
+        logger.warning("Rate limit exceeded for user %s in guild %s. Next request in %.1fs", user_id, guild_id, wait_time)
+        return f"🚫 Rate limit reached! Please wait {math.ceil(wait_time)} seconds before trying again."
 
-    logger.debug(f"Rate limit check passed. {remaining_requests} requests remaining")
     return None
 
-def call_llm(system_message: str, user_message: str) -> str:
-    """Call the LLM API with fallback support and improved error handling."""
-    rate_limit_msg = check_rate_limit()
-    if rate_limit_msg:
-        return rate_limit_msg
+async def provider_available(pool) -> int:
+    """The breaker permit for a call to this provider, or None if its circuit or request budget rules it out."""
+    permit = pool.breaker.allow()
+    if not permit:
+        logger.info("%s circuit is %s, skipping", pool.name, pool.breaker.state)
+        return None
+    if await shared_call(rate_limiter, "acquire", ("provider", pool.name)):
+        RATE_LIMIT_REJECTIONS.inc("provider")
+        logger.warning("%s request budget exhausted, skipping", pool.name)
+        pool.breaker.release(permit)
+        return None
+    return permit
+
+def _failure_message(attempted: list, errors: list) -> str:
+    """User-facing text for a request that no provider could answer."""
+    if not attempted:
+        # Skipped because of open circuits rather than spent request budgets
+        if any(pool.breaker.state == OPEN for pool in llm_client.providers):
+            return ALL_PROVIDERS_FAILED_MESSAGE
+        return PROVIDERS_BUSY_MESSAGE
+    if errors and all(isinstance(e, ProviderRateLimited) for e in errors):
+        return PROVIDERS_RATE_LIMITED_MESSAGE
+    if any(isinstance(e, ProviderTimeout) for e in errors):
+        return PROVIDERS_TIMEOUT_MESSAGE
+    return ALL_PROVIDERS_FAILED_MESSAGE
+
+async def call_llm(
+    system_message: str,
+    user_message: str,
+    cacheable: bool = True,
+    guild_id: int = None,
+    priority: int = NORMAL,
+    on_queued=None,
+    max_tokens: int = None
+) -> str:
+    """Call the LLM API with fallback support and improved error handling.
+
+    Unless cacheable is False, answers are served from and stored in the
+    response cache, and identical concurrent calls share one upstream
+    request. Upstream calls wait for a scheduler slot, which may raise
+    QueueFull or DeadlineExceeded; on_queued is awaited with the queue
+    position if the call has to wait. max_tokens caps the answer length
+    (default: GENERATION_PARAMS).
+    """
+    key = ResponseCache.make_key(system_message, user_message, generation_params(max_tokens))
+    with span("call_llm", cacheable=cacheable) as call:
+        if cacheable:
+            cached = await shared_call(response_cache, "get", key)
+            call.set(cache_hit=bool(cached))
+            if cached:
+                logger.debug("Serving LLM response from cache")
+                return cached
+
+        async def fetch():
+            async with llm_scheduler.slot(guild_id, priority, on_queued=on_queued):
+                return await _call_providers(system_message, user_message, key if cacheable else None, max_tokens)
+
+        if not cacheable:
+            return await fetch()  # Each caller asked for a fresh answer, so don't share one
+        return await inflight_requests.do(key, fetch)
+
+def _hedge_delay() -> float:
+    """Seconds to give the primary provider before racing the backup, or None to wait it out."""
+    if not HEDGE_REQUESTS:
+        return None
+    p95 = llm_client.deepseek.latency.percentile(95)
+    return min(HEDGE_DELAY, p95) if p95 is not None else HEDGE_DELAY
+
+async def _timed(pool, coro, permit: int):
+    """Await a provider call, feeding its outcome and latency to the provider's breaker under permit."""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    try:
+        with span(f"llm.{pool.name}"):
+            result = await coro
+    except asyncio.CancelledError:
+        pool.breaker.release(permit)
+        LLM_REQUEST_SECONDS.observe(loop.time() - start, pool.name, "cancelled")
+        raise
+    except Exception:
+        pool.breaker.record_failure(permit)
+        LLM_REQUEST_SECONDS.observe(loop.time() - start, pool.name, "error")
+        raise
+
+    elapsed = loop.time() - start
+    if result:
+        pool.latency.record(elapsed)
+        pool.breaker.record_success(elapsed, permit)
+    else:
+        pool.breaker.record_failure(permit)
+    LLM_REQUEST_SECONDS.observe(elapsed, pool.name, "ok" if result else "error")
+    return result
+
+def _start(pool, coro, permit: int) -> tuple:
+    return pool, asyncio.ensure_future(_timed(pool, coro, permit))
+
+def _result(task: asyncio.Task, errors: list):
+    """A finished provider task's result; errors are collected and treated as no result."""
+    if task.cancelled():
+        return None
+    error = task.exception()
+    if error is not None:
+        if not isinstance(error, ProviderError):
+            logger.error("Unexpected error in provider call: %r", error, exc_info=error)
+        errors.append(error)
+        return None
+    return task.result()
+
+async def _race_providers(primary: tuple, start_backup, delay: float = None, errors: list = None) -> tuple:
+    """Run the primary provider call and fall back to, or hedge with, a backup.
+
+    primary is a (pool, task) pair or None. start_backup() is awaited to start
+    the backup call and returns its (pool, task) pair, or None if no backup is
+    available.
+    The backup starts as soon as the primary fails, or after delay seconds if
+    hedging. The first usable result wins and the other call is cancelled.
+    Returns (pool, result), or (None, None) if every call failed; provider
+    errors are appended to errors.
+    """
+    errors = [] if errors is None else errors
+    racers = [primary] if primary else []
+    hedged = False
+    try:
+        if primary:
+            pool, task = primary
+            await asyncio.wait([task], timeout=delay)
+            if task.done():
+                result = _result(task, errors)
+                if result:
+                    return pool, result
+                logger.warning("%s call failed, falling back", pool.name)
+            else:
+                logger.info("%s slower than %.2fs, hedging with backup provider", pool.name, delay)
+
+        backup = await start_backup()
+        if backup:
+            hedged = bool(racers) and not racers[0][1].done()
+            racers.append(backup)
+
+        pending = {task for _, task in racers if not task.done()}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for pool, task in racers:
+                if task in done:
+                    result = _result(task, errors)
+                    if result:
+                        if hedged:
+                            pool.latency.wins += 1
+                        return pool, result
+        return None, None
+    finally:
+        losers = [task for _, task in racers if not task.done()]
+        for task in losers:
+            task.cancel()
+        if losers:
+            await asyncio.wait(losers)
+
+async def _call_providers(system_message: str, user_message: str, cache_key: tuple = None, max_tokens: int = None) -> str:
+    """Ask DeepSeek, then HuggingFace, for an answer; store successes under cache_key."""
+    attempted = []
+    errors = []
+
+    async def start_huggingface():
+        permit = llm_client.huggingface_token and await provider_available(llm_client.huggingface)
+        if permit:
+            logger.debug("Attempting HuggingFace API call...")
+            attempted.append(llm_client.huggingface)
+            return _start(llm_client.huggingface, llm_client.call_huggingface(system_message, user_message, max_tokens), permit)
+        return None
 
     try:
         # Try DeepSeek API first
-        if DEEPSEEK_API_KEY:
-            logger.info("Attempting DeepSeek API call...")
-            response = call_deepseek_api(system_message, user_message)
-            if response:
-                request_timestamps.append(time.time())
-                logger.info("DeepSeek API call successful")
-                return response
-            logger.warning("DeepSeek API call failed, falling back to HuggingFace")
-
-        # Fallback to HuggingFace
-        if HUGGINGFACE_TOKEN:
-            logger.info("Attempting HuggingFace API call...")
-            response = call_huggingface_api(system_message, user_message)
-            if response:
-                request_timestamps.append(time.time())
-                logger.info("HuggingFace API call successful")
-                return response
-            logger.error("HuggingFace API call failed")
-
-        return "😕 All API attempts failed. Our systems are taking a short break. Please try again in a minute! 🔄"
+        primary = None
+        permit = llm_client.deepseek_key and await provider_available(llm_client.deepseek)
+        if permit:
+            logger.debug("Attempting DeepSeek API call...")
+            attempted.append(llm_client.deepseek)
+            primary = _start(llm_client.deepseek, llm_client.call_deepseek(system_message, user_message, max_tokens), permit)
+
+        pool, response = await _race_providers(primary, start_huggingface, _hedge_delay(), errors)
+        if response:
+            logger.debug("%s API call successful", pool.name)
+            if cache_key:
+                await shared_call(response_cache, "set", cache_key, response)
+            return response
+
+        logger.error("All provider calls failed: %s", errors)
+        return _failure_message(attempted, errors)
 
     except Exception as e:
-        logger.error(f"Unexpected error in LLM call: {str(e)}", exc_info=True)
+        logger.error("Unexpected error in LLM call: %s", e, exc_info=True)
         return "🔧 Oops! Our AI had a slight hiccup. Our engineers are looking into it! Please try again. 🛠️"
 
-def call_deepseek_api(system_message: str, user_message: str) -> str:
-    """Call the DeepSeek API with enhanced error handling and detailed logging."""
+async def stream_llm(
+    system_message: str,
+    user_message: str,
+    cacheable: bool = True,
+    guild_id: int = None,
+    priority: int = NORMAL,
+    on_queued=None,
+    max_tokens: int = None
+):
+    """Stream an LLM answer chunk by chunk, falling back to a single HuggingFace reply.
+
+    If an identical cacheable request is already in flight, its full answer
+    is yielded once it completes instead of starting another upstream call. Scheduling
+    works as in call_llm, with the slot held until the stream ends.
+    """
+    key = ResponseCache.make_key(system_message, user_message, generation_params(max_tokens))
+    if cacheable:
+        cached = await shared_call(response_cache, "get", key)
+        if cached:
+            logger.debug("Serving LLM response from cache")
+            yield cached
+            return
+
+    if not cacheable:
+        async with llm_scheduler.slot(guild_id, priority, on_queued=on_queued):
+            async for chunk in _stream_providers(system_message, user_message, None, max_tokens):
+                yield chunk
+        return
+
+    pending = inflight_requests.get(key)
+    if pending is not None:
+        logger.debug("Joining identical in-flight LLM request")
+        yield await asyncio.shield(pending) or ALL_PROVIDERS_FAILED_MESSAGE
+        return
+
+    inflight_requests.lead(key)
+    answer = []
     try:
-        logger.info("Preparing DeepSeek API call...")
-
-        headers = {
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            "max_tokens": 150,  # Increased for longer responses
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "stream": False
-        }
-
-        logger.debug(f"Making request to DeepSeek API: {DEEPSEEK_API_URL}")
-        logger.debug(f"Payload length: {len(str(payload))} characters")
-
-        response = requests.post(
-            DEEPSEEK_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
-
-        logger.debug(f"DeepSeek API Response Status: {response.status_code}")
-        logger.debug(f"Response Headers: {response.headers}")
-
-        if response.status_code == 429:
-            logger.warning("DeepSeek API rate limit hit")
-            return "🚫 Our primary AI is taking a quick break. Switching to backup system... 🔄"
-
-        if response.status_code == 401:
-            logger.error("DeepSeek API authentication failed")
-            return None
-
-        if response.status_code == 400:
-            logger.error(f"DeepSeek API bad request: {response.text}")
-            return None
-
-        if response.status_code != 200:
-            error_content = response.json() if response.content else "No error content"
-            logger.error(f"DeepSeek API error: Status {response.status_code}, Content: {error_content}")
-            return None
-
-        result = response.json()
-        logger.info("Successfully received DeepSeek API response")
-        logger.debug(f"Response tokens used: {result.get('usage', {}).get('total_tokens', 'unknown')}")
-
-        try:
-            return result['choices'][0]['message']['content'].strip()
-        except (KeyError, IndexError) as e:
-            logger.error(f"Unexpected API response format: {e}")
-            logger.debug(f"API Response: {result}")
-            return None
-
-    except requests.exceptions.Timeout:
-        logger.error("DeepSeek API timeout")
-        return "⏱️ Request took too long. Let's try that again!"
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Network error calling DeepSeek API: {str(e)}")
-        return "🌐 Having trouble connecting. Please check your internet and try again!"
-
-    except Exception as e:
-        logger.error(f"Unexpected error in DeepSeek API call: {str(e)}", exc_info=True)
-        return "🤖 Looks like I'm having a moment. Let's try that again!"
+        async with llm_scheduler.slot(guild_id, priority, on_queued=on_queued):
+            async for chunk in _stream_providers(system_message, user_message, key, max_tokens):
+                answer.append(chunk)
+                yield chunk
+    finally:
+        inflight_requests.finish(key, "".join(answer).strip())
+
+async def _stream_providers(system_message: str, user_message: str, cache_key: tuple = None, max_tokens: int = None):
+    """Stream from DeepSeek, falling back to HuggingFace; store successes under cache_key.
+
+    The DeepSeek stream races HuggingFace for the first chunk, so hedging and
+    fallback work the same way as in call_llm.
+    """
+    attempted = []
+    errors = []
+
+    async def start_huggingface():
+        permit = llm_client.huggingface_token and await provider_available(llm_client.huggingface)
+        if permit:
+            logger.debug("Attempting HuggingFace API call...")
+            attempted.append(llm_client.huggingface)
+            return _start(llm_client.huggingface, llm_client.call_huggingface(system_message, user_message, max_tokens), permit)
+        return None
+
+    stream = None
+    primary = None
+    permit = llm_client.deepseek_key and await provider_available(llm_client.deepseek)
+    if permit:
+        logger.debug("Attempting DeepSeek streaming call...")
+        attempted.append(llm_client.deepseek)
+        stream = llm_client.stream_deepseek(system_message, user_message, max_tokens)
+        primary = _start(llm_client.deepseek, anext(stream, None), permit)
 
-def call_huggingface_api(system_message: str, user_message: str) -> str:
-    """Call the HuggingFace API as fallback with improved error handling."""
     try:
-        headers = {"Authorization": f"Bearer {HUGGINGFACE_TOKEN}"}
-
-        payload = {
-            "inputs": f"<|system|>{system_message}</s><|user|>{user_message}</s><|assistant|>",
-            "parameters": {
-                "max_new_tokens": 150,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "do_sample": True
-            }
-        }
-
-        logger.debug("Making HuggingFace API request")
-
-        response = requests.post(
-            HUGGINGFACE_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
-
-        if response.status_code == 429:
-            logger.warning("HuggingFace API rate limit hit")
-            return "🚫 Our backup system needs a break too! Please try again in a minute. ⏳"
-
-        if response.status_code != 200:
-            logger.error(f"HuggingFace API error: Status {response.status_code}")
-            logger.debug(f"Error response: {response.text}")
-            return "🤖 Our backup brain needs a quick restart. Please try again!"
-
-        result = response.json()
-        generated_text = result[0]['generated_text']
-        # Extract only the assistant's response
-        assistant_response = generated_text.split("<|assistant|>")[-1].strip()
-        return assistant_response
-
-    except Exception as e:
-        logger.error(f"Error calling HuggingFace API: {e}", exc_info=True)
-        return "🔧 Our backup system isn't responding right now. Please try again!"
+        pool, first = await _race_providers(primary, start_huggingface, _hedge_delay(), errors)
+        if not first:
+            logger.error("All provider calls failed: %s", errors)
+            yield _failure_message(attempted, errors)
+            return
+
+        chunks = [first]
+        yield first
+        if pool is llm_client.deepseek:
+            try:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+            except ProviderError as e:
+                # The partial answer has already been shown; just don't cache it
+                logger.warning("DeepSeek stream interrupted: %s", e)
+                llm_client.deepseek.breaker.record_failure(permit)
+                return
+            logger.debug("DeepSeek stream completed")
+        else:
+            logger.debug("%s API call successful", pool.name)
+
+        if cache_key:
+            await shared_call(response_cache, "set", cache_key, "".join(chunks).strip())
+    finally:
+        if stream is not None:
+            await stream.aclose()
+
+async def send_streamed_response(interaction, chunks, header: str = "", footer: str = ""):
+    """Post the first chunk as a followup, then edit it as more chunks arrive.
+
+    Edits are throttled to one per STREAM_EDIT_INTERVAL seconds to stay under
+    Discord's message edit rate limits; the footer is added on the final edit.
+    """
+    loop = asyncio.get_running_loop()
+    message = None
+    text = ""
+    last_edit = 0.0
+
+    async for chunk in chunks:
+        text += chunk
+        if message is None:
+            if not text.strip():
+                continue
+            with DISCORD_SEND_SECONDS.time("send"), span("discord.send"):
+                message = await interaction.followup.send((header + text)[:2000], wait=True)
+            last_edit = loop.time()
+        elif loop.time() - last_edit >= STREAM_EDIT_INTERVAL:
+            with DISCORD_SEND_SECONDS.time("edit"), span("discord.edit"):
+                await message.edit(content=(header + text)[:2000])
+            last_edit = loop.time()
+
+    content = header + text.strip() + footer
+    if message is None:
+        with DISCORD_SEND_SECONDS.time("send"), span("discord.send"):
+            await interaction.followup.send(content[:2000])
+    else:
+        with DISCORD_SEND_SECONDS.time("edit"), span("discord.edit"):
+            await message.edit(content=content[:2000])
+
+    # Anything past Discord's message limit goes out as extra followups
+    for i in range(2000, len(content), 2000):
+        with DISCORD_SEND_SECONDS.time("send"), span("discord.send"):
+            await interaction.followup.send(content[i:i + 2000])
 
 async def handle_long_response(interaction, content: str):
     """Handle responses that might be too long for Discord."""
@@ -193,5 +425,5 @@ async def handle_long_response(interaction, content: str):
         else:
             await interaction.response.send_message(content)
     except Exception as e:
-        logger.error(f"Error handling long response: {e}", exc_info=True)
+        logger.error("Error handling long response: %s", e, exc_info=True)
         await interaction.response.send_message("❌ Something went wrong while sending the response. Please try again!")
\ No newline at end of file